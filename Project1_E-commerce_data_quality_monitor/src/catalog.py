@@ -0,0 +1,114 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+
+# Used when no catalog file is given; the same products transform_sales_data always knew about
+CATEGORY_MAP = {
+    'Electronics': {
+        'laptop': 'Laptop',
+        'wireless mouse': 'Wireless Mouse',
+        'notebook': 'Notebook',
+        'keyboard': 'Keyboard',
+        'desk lamp': 'Desk Lamp'
+    },
+    'Books': {
+        'programming book': 'Programming Book'
+    }
+}
+
+# The .idx cache is JSON; version 1 was a pickle, which is never loaded any more
+INDEX_VERSION = 2
+
+def index_path(catalog_file):
+    return catalog_file + '.idx'
+
+def build_product_index(category_products):
+    # Reverse index: lower-cased product name -> category. The first category listing a product wins,
+    # which is how the old per-category scan behaved.
+    product_index = {}
+    for category, products in category_products:
+        category = sys.intern(category)
+        for product in products:
+            product_index.setdefault(product.strip().lower(), category)
+    return product_index
+
+def read_catalog(catalog_file):
+    # CSV needs 'product' and 'category' columns. JSON may be {category: [products]},
+    # {category: {product: display_name}} or a list of {"product": ..., "category": ...}.
+    if catalog_file.endswith('.csv'):
+        with open(catalog_file, 'r', encoding='utf-8') as file:
+            return [(row['category'], [row['product']]) for row in csv.DictReader(file)]
+
+    with open(catalog_file, 'r', encoding='utf-8') as file:
+        catalog = json.load(file)
+    if isinstance(catalog, list):
+        return [(entry['category'], [entry['product']]) for entry in catalog]
+    return list(catalog.items())
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_index_cache(cache_file):
+    # None for a missing, corrupt or outdated cache, which is then rebuilt from the catalog
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            cache = json.load(file)
+        if isinstance(cache, dict) and cache.get('version') == INDEX_VERSION and isinstance(cache.get('index'), dict):
+            # Categories are shared strings again, as build_product_index makes them
+            cache['index'] = {product: sys.intern(category) for product, category in cache['index'].items()}
+            return cache
+    except (OSError, ValueError, TypeError):
+        pass
+    return None
+
+def write_index_cache(cache_file, cache):
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(cache, file, separators=(',', ':'))
+    os.replace(temp_file, cache_file)
+
+def load_product_index(catalog_file=None):
+    if not catalog_file:
+        return DEFAULT_PRODUCT_INDEX
+
+    stat = os.stat(catalog_file)
+    cache_file = index_path(catalog_file)
+    cache = read_index_cache(cache_file)
+
+    # Same mtime and size: trust the cache without reading the catalog at all
+    if cache and cache['mtime_ns'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+        return cache['index']
+
+    # Touched but unchanged content: keep the index and only refresh the recorded mtime
+    sha256 = file_sha256(catalog_file)
+    if cache and cache['sha256'] == sha256:
+        logging.info(f"Catalog {catalog_file} touched but unchanged, reusing index")
+        product_index = cache['index']
+    else:
+        product_index = build_product_index(read_catalog(catalog_file))
+        logging.info(f"Built product index with {len(product_index)} products from {catalog_file}")
+
+    write_index_cache(cache_file, {
+        'version': INDEX_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': sha256,
+        'index': product_index
+    })
+    return product_index
+
+DEFAULT_PRODUCT_INDEX = build_product_index(
+    (category, products.keys()) for category, products in CATEGORY_MAP.items()
+)
+
+if __name__ == '__main__':
+    product_index = load_product_index('../data/product_catalog.csv')
+    print(product_index)
+    print(product_index == DEFAULT_PRODUCT_INDEX)
@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+from array import array
+from datetime import date
+from itertools import accumulate, islice
+from date_parser import parse_iso_date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNAR_FORMAT = 'columnar'
+MANIFEST_NAME = 'manifest.json'
+
+# Column kind: (array typecode, .npy dtype without the byte order)
+COLUMN_KINDS = {
+    'float': ('d', 'f8'),
+    'int': ('q', 'i8'),
+    'date': ('q', 'M8[D]'),       # days since 1970-01-01
+    'dictionary': ('i', 'i4'),    # codes into the column's value list in the manifest
+    'string': ('q', 'i8')         # offsets into <name>.bytes.npy, one more than there are rows
+}
+BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+# Rows turned into columns and appended to the files at a time
+BATCH_ROWS = 65536
+# Every .npy header takes this many bytes, so it can be rewritten in place once the row count is known
+HEADER_SIZE = 128
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def npy_header(descr, length):
+    # Format version 1.0: magic, version, header length, then a dict literal padded with spaces to end in a newline
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': (length,)})
+    header = header.ljust(HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + (HEADER_SIZE - 10).to_bytes(2, 'little') + header.encode('latin1')
+
+def open_npy(output_dir, file_name, descr):
+    file = open(os.path.join(output_dir, file_name), 'wb')
+    file.write(npy_header(descr, 0))
+    return file
+
+def finish_npy(file, descr, length):
+    file.seek(0)
+    file.write(npy_header(descr, length))
+    file.close()
+
+def open_column(output_dir, name, kind):
+    typecode, dtype = COLUMN_KINDS[kind]
+    column = {'name': name, 'kind': kind, 'typecode': typecode, 'descr': BYTE_ORDER + dtype,
+              'file_name': name + '.npy'}
+    column['file'] = open_npy(output_dir, column['file_name'], column['descr'])
+    if kind == 'dictionary':
+        column['codes'] = {}
+    elif kind == 'string':
+        column['bytes_file_name'] = name + '.bytes.npy'
+        column['bytes_file'] = open_npy(output_dir, column['bytes_file_name'], '|u1')
+        column['size'] = 0
+        array(typecode, [0]).tofile(column['file'])
+    return column
+
+def append_column(column, values):
+    kind = column['kind']
+    if kind == 'dictionary':
+        # Each value seen for the first time gets the next code
+        codes = column['codes']
+        encoded = array(column['typecode'], [codes.setdefault(value, len(codes)) for value in values])
+    elif kind == 'date':
+        encoded = array(column['typecode'], [parse_iso_date(value).toordinal() - EPOCH_ORDINAL for value in values])
+    elif kind == 'string':
+        data = [value.encode('utf-8') for value in values]
+        encoded = array(column['typecode'], islice(accumulate(map(len, data), initial=column['size']), 1, None))
+        column['bytes_file'].write(b''.join(data))
+        column['size'] = encoded[-1]
+    else:
+        encoded = array(column['typecode'], values)
+    encoded.tofile(column['file'])
+
+def finish_column(column, total_records):
+    entry = {'kind': column['kind'], 'dtype': column['descr'], 'file': column['file_name']}
+    if column['kind'] == 'string':
+        finish_npy(column['file'], column['descr'], total_records + 1)
+        finish_npy(column['bytes_file'], '|u1', column['size'])
+        entry['bytes_file'] = column['bytes_file_name']
+    else:
+        finish_npy(column['file'], column['descr'], total_records)
+    if column['kind'] == 'dictionary':
+        entry['values'] = list(column['codes'])
+    return entry
+
+def close_column(column):
+    column['file'].close()
+    if 'bytes_file' in column:
+        column['bytes_file'].close()
+
+def write_columnar(rows, output_dir, metadata, column_kinds, count_key='total_records'):
+    # Writes rows (tuples in column_kinds order) as one .npy file per column under output_dir and
+    # returns how many were written. manifest.json holds the metadata block with the count and, for
+    # each column, its kind, dtype, files and, for dictionary columns, the values the codes point to.
+    # The manifest is written last, so a run that fails part way leaves no readable output behind.
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    columns = []
+    try:
+        for name, kind in column_kinds.items():
+            columns.append(open_column(output_dir, name, kind))
+
+        total_records = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, BATCH_ROWS))
+            if not batch:
+                break
+            for column, values in zip(columns, zip(*batch)):
+                append_column(column, values)
+            total_records += len(batch)
+
+        entries = {column['name']: finish_column(column, total_records) for column in columns}
+    finally:
+        for column in columns:
+            close_column(column)
+
+    manifest = {'metadata': dict(metadata), 'columns': entries}
+    manifest['metadata'][count_key] = total_records
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return total_records
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def load_column(output_dir, name, manifest=None):
+    # Memory-maps a single column; dictionary columns come back as their codes and string columns
+    # as their offsets. Needs NumPy, unlike writing.
+    if np is None:
+        raise ImportError('NumPy is needed to read columnar output')
+    manifest = manifest or read_manifest(output_dir)
+    return np.load(os.path.join(output_dir, manifest['columns'][name]['file']), mmap_mode='r')
+
+def column_values(output_dir, name, manifest=None):
+    # The column decoded back to Python values, as they appear in the JSON output
+    manifest = manifest or read_manifest(output_dir)
+    column = manifest['columns'][name]
+    stored = load_column(output_dir, name, manifest)
+    if column['kind'] == 'dictionary':
+        values = column['values']
+        return [values[code] for code in stored.tolist()]
+    if column['kind'] == 'date':
+        return [date.fromordinal(day + EPOCH_ORDINAL).isoformat() for day in stored.astype('i8').tolist()]
+    if column['kind'] == 'string':
+        data = np.load(os.path.join(output_dir, column['bytes_file']), mmap_mode='r').tobytes()
+        offsets = stored.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+    return stored.tolist()
+
+if __name__ == '__main__':
+    import tempfile
+
+    output_dir = os.path.join(tempfile.gettempdir(), 'columnar_demo')
+    kinds = {'order_id': 'string', 'quantity': 'int', 'order_date': 'date', 'region': 'dictionary'}
+    rows = [('ORD-001', 1, '2024-03-15', 'Boston'), ('ORD-002', 2, '2024-03-16', 'Boston')]
+    print(write_columnar(rows, output_dir, {'data_source': 'demo'}, kinds))
+    if np is not None:
+        for name in kinds:
+            print(name, column_values(output_dir, name))
@@ -0,0 +1,65 @@
+import csv
+import os
+import shutil
+
+# Columns after the input's own columns in a dead-letter file
+DEAD_LETTER_COLUMNS = ('rejection_code', 'rejection_reasons')
+
+def start_dead_letter(dead_letter_file, fieldnames, rejection_text, header=True):
+    # Rejected rows are streamed to a CSV as they are found: the input columns as read, the reason
+    # bitmask and its text. The file is opened on the first write; set 'append' before then to add
+    # to an existing file instead of replacing it.
+    return {
+        'path': dead_letter_file,
+        'fieldnames': list(fieldnames),
+        'rejection_text': rejection_text,
+        'header': header,
+        'append': False,
+        'file': None,
+        'writer': None,
+        'rows': 0
+    }
+
+def open_dead_letter(dead_letter):
+    append = dead_letter['append'] and os.path.exists(dead_letter['path'])
+    dead_letter['file'] = open(dead_letter['path'], 'a' if append else 'w', encoding='utf-8', newline='')
+    dead_letter['writer'] = csv.writer(dead_letter['file'], lineterminator='\n')
+    if dead_letter['header'] and not append:
+        dead_letter['writer'].writerow(dead_letter['fieldnames'] + list(DEAD_LETTER_COLUMNS))
+
+def write_dead_letter(dead_letter, rejected):
+    # rejected holds (record, code) pairs as the validators return them
+    if dead_letter['file'] is None:
+        open_dead_letter(dead_letter)
+    fieldnames = dead_letter['fieldnames']
+    rejection_text = dead_letter['rejection_text']
+    dead_letter['writer'].writerows([record.get(name) for name in fieldnames] + [code, rejection_text(code)]
+                                    for record, code in rejected)
+    dead_letter['rows'] += len(rejected)
+
+def append_dead_letter_parts(dead_letter, part_files, rows):
+    # Adds headerless dead-letter files, written by other processes, in the order given
+    if dead_letter['file'] is None:
+        open_dead_letter(dead_letter)
+    for part_file in part_files:
+        if os.path.exists(part_file):
+            with open(part_file, 'r', encoding='utf-8', newline='') as part:
+                shutil.copyfileobj(part, dead_letter['file'])
+    dead_letter['rows'] += rows
+
+def close_dead_letter(dead_letter):
+    # A run without rejects still replaces the previous run's file
+    if dead_letter['file'] is None:
+        open_dead_letter(dead_letter)
+    dead_letter['file'].close()
+    return dead_letter['rows']
+
+if __name__ == '__main__':
+    import tempfile
+
+    path = os.path.join(tempfile.gettempdir(), 'dead_letter_demo.csv')
+    dead_letter = start_dead_letter(path, ['order_id', 'quantity'], lambda code: f'reason bits {code}')
+    write_dead_letter(dead_letter, [({'order_id': 'ORD-003', 'quantity': '-1'}, 4)])
+    print(close_dead_letter(dead_letter))
+    with open(path, 'r', encoding='utf-8') as file:
+        print(file.read())
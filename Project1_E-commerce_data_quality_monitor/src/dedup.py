@@ -0,0 +1,360 @@
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+from array import array
+from itertools import islice
+from hashlib import blake2b
+from validate import DUPLICATE_ORDER_ID
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Order ids loaded by earlier runs, kept in a directory:
+#   keys.bin    every id, length-prefixed, in the order they were added
+#   table.bin   open-addressing hash table over keys.bin, the exact answer
+#   bloom.bin   Bloom filter over the same ids, so most new ids never touch the table
+#   state.json  sizes as of the last committed run; anything past them is from a run that did not finish
+# The table and the filter are memory-mapped, so only the pages lookups touch are held in memory.
+INDEX_VERSION = 1
+STATE_NAME = 'state.json'
+KEYS_NAME = 'keys.bin'
+TABLE_NAME = 'table.bin'
+BLOOM_NAME = 'bloom.bin'
+
+ID_HASHES = struct.Struct('<QQ')
+KEY_LENGTH = struct.Struct('<I')
+# Hash table slot: the id's first hash and its offset in keys.bin plus one; 0 marks an empty slot
+SLOT = struct.Struct('<QQ')
+
+TABLE_SLOTS = 1 << 16
+MAX_LOAD = 0.5
+# The filter is sized for this many ids at this false positive rate, and rebuilt larger once a commit passes it
+BLOOM_CAPACITY = 1 << 20
+BLOOM_ERROR_RATE = 0.01
+HASH_MASK = (1 << 64) - 1
+# Ids hashed at a time when the filter is rebuilt
+REBUILD_BATCH = 65536
+
+def id_hashes(key):
+    return ID_HASHES.unpack(blake2b(key, digest_size=16).digest())
+
+def bloom_positions(h1, h2, bits, hashes):
+    # Double hashing: k positions out of two 64-bit hashes
+    return [((h1 + i * h2) & HASH_MASK) % bits for i in range(hashes)]
+
+def bloom_size(capacity):
+    bits = math.ceil(-capacity * math.log(BLOOM_ERROR_RATE) / math.log(2) ** 2)
+    bits = (bits + 7) // 8 * 8
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+def table_slots_for(count):
+    slots = TABLE_SLOTS
+    while count > slots * MAX_LOAD:
+        slots *= 2
+    return slots
+
+def index_file(index, name):
+    return os.path.join(index['index_dir'], name)
+
+def map_file(path, size):
+    # Opens a file of exactly `size` bytes, zero-filled when new, and memory-maps it
+    file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+    file.truncate(size)
+    return file, mmap.mmap(file.fileno(), size)
+
+def unmap(index, name):
+    index[name].close()
+    index[name + '_file'].close()
+
+def read_state(index_dir):
+    try:
+        with open(os.path.join(index_dir, STATE_NAME), 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return None
+    if state.get('version') != INDEX_VERSION:
+        raise ValueError(f"{index_dir} is an order id index version {state.get('version')}, expected {INDEX_VERSION}")
+    return state
+
+def write_state(index):
+    state = {name: index[name] for name in ('version', 'count', 'keys_size', 'table_slots', 'bloom_capacity',
+                                            'bloom_bits', 'bloom_hashes')}
+    temp_file = index_file(index, STATE_NAME) + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_file, index_file(index, STATE_NAME))
+
+def iter_keys(index):
+    # Every committed id with its offset, read front to back
+    keys_file = index['keys_file']
+    keys_file.seek(0)
+    offset = 0
+    while offset < index['keys_size']:
+        length, = KEY_LENGTH.unpack(keys_file.read(KEY_LENGTH.size))
+        yield offset, keys_file.read(length)
+        offset += KEY_LENGTH.size + length
+
+def map_keys(index):
+    # Committed ids are read through a map; ids added since are still read from the file
+    if index.get('keys_map') is not None:
+        index['keys_map'].close()
+    index['keys_file'].flush()
+    size = index['keys_size']
+    index['keys_map'] = mmap.mmap(index['keys_file'].fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+def read_key(index, offset):
+    # None for an offset past the ids written so far, which only a slot left by a crashed run can hold
+    if offset + KEY_LENGTH.size > index['keys_size']:
+        return None
+    keys_map = index['keys_map']
+    if keys_map is not None and offset < len(keys_map):
+        length, = KEY_LENGTH.unpack_from(keys_map, offset)
+        start = offset + KEY_LENGTH.size
+        return keys_map[start:start + length]
+    keys_file = index['keys_file']
+    keys_file.seek(offset)
+    length, = KEY_LENGTH.unpack(keys_file.read(KEY_LENGTH.size))
+    if offset + KEY_LENGTH.size + length > index['keys_size']:
+        return None
+    return keys_file.read(length)
+
+def find_slot(index, key, h1):
+    # The slot holding key, or the empty slot it would go in, and whether it was found
+    table = index['table']
+    mask = index['table_slots'] - 1
+    slot = h1 & mask
+    while True:
+        stored, reference = SLOT.unpack_from(table, slot * SLOT.size)
+        if not reference:
+            return slot, False
+        if stored == h1 and read_key(index, reference - 1) == key:
+            return slot, True
+        slot = (slot + 1) & mask
+
+def put_slot(table, mask, h1, reference):
+    slot = h1 & mask
+    while SLOT.unpack_from(table, slot * SLOT.size)[1]:
+        slot = (slot + 1) & mask
+    SLOT.pack_into(table, slot * SLOT.size, h1, reference)
+    return slot
+
+def rebuild_table(index):
+    # Only used to recover from a run that stopped without committing or rolling back
+    unmap(index, 'table')
+    os.remove(index_file(index, TABLE_NAME))
+    index['table_slots'] = table_slots_for(index['count'])
+    index['table_file'], index['table'] = map_file(index_file(index, TABLE_NAME), index['table_slots'] * SLOT.size)
+    mask = index['table_slots'] - 1
+    for offset, key in iter_keys(index):
+        put_slot(index['table'], mask, id_hashes(key)[0], offset + 1)
+
+def rebuild_bloom(index, capacity):
+    bits, hashes = bloom_size(capacity)
+    temp_file = index_file(index, BLOOM_NAME) + '.tmp'
+    file, bloom = map_file(temp_file, bits // 8)
+    keys = (key for _, key in iter_keys(index))
+    while True:
+        batch = list(islice(keys, REBUILD_BATCH))
+        if not batch:
+            break
+        bloom_set(bloom, batch_positions(id_digests(batch), bits, hashes), range(len(batch)))
+    bloom.flush()
+    bloom.close()
+    file.close()
+
+    unmap(index, 'bloom')
+    os.replace(temp_file, index_file(index, BLOOM_NAME))
+    index['bloom_capacity'], index['bloom_bits'], index['bloom_hashes'] = capacity, bits, hashes
+    index['bloom_file'], index['bloom'] = map_file(index_file(index, BLOOM_NAME), bits // 8)
+
+def grow_table(index, count):
+    # Rehashes into a table big enough for `count` ids. Committed ids go in first, so none of their
+    # probe runs pass through a slot that a rollback empties again.
+    slots = table_slots_for(count)
+    mask = slots - 1
+    committed_size = index['committed']['keys_size']
+    temp_file = index_file(index, TABLE_NAME) + '.tmp'
+    file, table = map_file(temp_file, slots * SLOT.size)
+    added = array('q')
+    for h1, reference in SLOT.iter_unpack(index['table']):
+        if reference and reference <= committed_size:
+            put_slot(table, mask, h1, reference)
+    for h1, reference in SLOT.iter_unpack(index['table']):
+        if reference > committed_size:
+            added.append(put_slot(table, mask, h1, reference))
+    table.flush()
+    table.close()
+    file.close()
+
+    unmap(index, 'table')
+    os.replace(temp_file, index_file(index, TABLE_NAME))
+    index['table_slots'] = slots
+    index['added'] = added
+    index['table_file'], index['table'] = map_file(index_file(index, TABLE_NAME), slots * SLOT.size)
+
+def open_order_index(index_dir, capacity=BLOOM_CAPACITY):
+    os.makedirs(index_dir, exist_ok=True)
+    state = read_state(index_dir)
+    if state is None:
+        # A new index; files without a state.json were never committed
+        for name in (KEYS_NAME, TABLE_NAME, BLOOM_NAME):
+            if os.path.exists(os.path.join(index_dir, name)):
+                os.remove(os.path.join(index_dir, name))
+        bits, hashes = bloom_size(capacity)
+        state = {'version': INDEX_VERSION, 'count': 0, 'keys_size': 0, 'table_slots': TABLE_SLOTS,
+                 'bloom_capacity': capacity, 'bloom_bits': bits, 'bloom_hashes': hashes}
+
+    index = dict(state, index_dir=index_dir, added=array('q'), keys_map=None)
+    index['committed'] = {'count': state['count'], 'keys_size': state['keys_size']}
+    keys_path = os.path.join(index_dir, KEYS_NAME)
+    unfinished = os.path.exists(keys_path) and os.path.getsize(keys_path) != state['keys_size']
+    index['keys_file'] = open(keys_path, 'a+b')
+    index['keys_file'].truncate(state['keys_size'])
+
+    table_path = os.path.join(index_dir, TABLE_NAME)
+    unfinished = unfinished or (state['count'] and (
+        not os.path.exists(table_path) or os.path.getsize(table_path) != state['table_slots'] * SLOT.size))
+    index['table_file'], index['table'] = map_file(table_path, state['table_slots'] * SLOT.size)
+    bloom_path = os.path.join(index_dir, BLOOM_NAME)
+    bloom_missing = state['count'] and not os.path.exists(bloom_path)
+    index['bloom_file'], index['bloom'] = map_file(bloom_path, state['bloom_bits'] // 8)
+
+    if unfinished:
+        logging.warning(f'{index_dir} holds order ids from a run that did not finish, rebuilding its hash table')
+        rebuild_table(index)
+    if bloom_missing:
+        rebuild_bloom(index, index['bloom_capacity'])
+    if state['count'] == 0 or unfinished or bloom_missing:
+        write_state(index)
+    map_keys(index)
+    return index
+
+def add_order_ids(index, pending):
+    # pending maps each new id to its first hash. Inserting them in slot order keeps the writes to the
+    # table close together.
+    if index['count'] + len(pending) > index['table_slots'] * MAX_LOAD:
+        grow_table(index, index['count'] + len(pending))
+    table = index['table']
+    mask = index['table_slots'] - 1
+    keys_file = index['keys_file']
+    offset = index['keys_size']
+    slots = []
+    for key, h1 in sorted(pending.items(), key=lambda item: item[1] & mask):
+        keys_file.write(KEY_LENGTH.pack(len(key)))
+        keys_file.write(key)
+        slots.append((h1, offset + 1))
+        offset += KEY_LENGTH.size + len(key)
+    # The mapped table reaches the file even if the process dies, so the ids it points at are written out
+    # first; a keys.bin longer than state.json says then tells open_order_index to rebuild the table
+    keys_file.flush()
+    for h1, reference in slots:
+        index['added'].append(put_slot(table, mask, h1, reference))
+    index['keys_size'] = offset
+    index['count'] += len(pending)
+
+def batch_positions(digests, bits, hashes):
+    # Filter bit positions for a batch of ids, one row per id. NumPy works out the whole batch at once;
+    # the positions are the same either way.
+    if np is not None:
+        pairs = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        # uint64 arithmetic wraps the way HASH_MASK does
+        return (pairs[:, :1] + np.arange(hashes, dtype=np.uint64) * pairs[:, 1:]) % np.uint64(bits)
+    return [bloom_positions(h1, h2, bits, hashes) for h1, h2 in ID_HASHES.iter_unpack(digests)]
+
+def bloom_test(bloom, positions):
+    # Per row, whether every bit is set: the filter may hold the id
+    if np is not None:
+        bloom = np.frombuffer(bloom, dtype=np.uint8)
+        return ((bloom[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).all(axis=1).tolist()
+    return [all(bloom[position >> 3] >> (position & 7) & 1 for position in row) for row in positions]
+
+def bloom_set(bloom, positions, rows):
+    if np is not None:
+        selected = positions[rows].ravel()
+        np.bitwise_or.at(np.frombuffer(bloom, dtype=np.uint8), selected >> 3,
+                         np.left_shift(1, selected & 7).astype(np.uint8))
+        return
+    for row in rows:
+        for position in positions[row]:
+            bloom[position >> 3] |= 1 << (position & 7)
+
+def id_digests(keys):
+    return b''.join(blake2b(key, digest_size=16).digest() for key in keys)
+
+def dedup_sales_data(records, index):
+    # Splits records into the ones whose order_id was never loaded, which are added to the index,
+    # and (record, DUPLICATE_ORDER_ID) pairs for ids seen in an earlier run or earlier in this one
+    if not records:
+        return [], []
+    keys = [record['order_id'].encode('utf-8') for record in records]
+    digests = id_digests(keys)
+    positions = batch_positions(digests, index['bloom_bits'], index['bloom_hashes'])
+    seen = bloom_test(index['bloom'], positions)
+
+    unique = []
+    duplicates = []
+    pending = {}
+    new_rows = []
+    for row, (record, key, (h1, _), maybe_seen) in enumerate(zip(records, keys, ID_HASHES.iter_unpack(digests), seen)):
+        # Only ids the filter may have seen are looked up in the table
+        if key in pending or (maybe_seen and find_slot(index, key, h1)[1]):
+            duplicates.append((record, DUPLICATE_ORDER_ID))
+        else:
+            pending[key] = h1
+            new_rows.append(row)
+            unique.append(record)
+
+    if pending:
+        bloom_set(index['bloom'], positions, new_rows)
+        add_order_ids(index, pending)
+    return unique, duplicates
+
+def commit_order_index(index):
+    # Makes the ids added since the last commit permanent. Called once the run's output is written.
+    if index['count'] > index['bloom_capacity']:
+        capacity = index['bloom_capacity']
+        while capacity < index['count']:
+            capacity *= 4
+        rebuild_bloom(index, capacity)
+    index['keys_file'].flush()
+    index['table'].flush()
+    index['bloom'].flush()
+    index['committed'] = {'count': index['count'], 'keys_size': index['keys_size']}
+    index['added'] = array('q')
+    write_state(index)
+    map_keys(index)
+
+def rollback_order_index(index):
+    # Drops the ids added since the last commit. Bloom filter bits they set stay; they only cost
+    # an extra table lookup now and then.
+    table = index['table']
+    for slot in index['added']:
+        SLOT.pack_into(table, slot * SLOT.size, 0, 0)
+    index.update(index['committed'])
+    index['keys_file'].truncate(index['keys_size'])
+    index['added'] = array('q')
+    write_state(index)
+
+def close_order_index(index):
+    if index['added'] or index['keys_size'] != index['committed']['keys_size']:
+        rollback_order_index(index)
+    if index['keys_map'] is not None:
+        index['keys_map'].close()
+    index['keys_file'].close()
+    unmap(index, 'table')
+    unmap(index, 'bloom')
+
+if __name__ == '__main__':
+    import tempfile
+
+    index = open_order_index(os.path.join(tempfile.gettempdir(), 'order_index_demo'))
+    records = [{'order_id': 'ORD-001'}, {'order_id': 'ORD-002'}, {'order_id': 'ORD-001'}]
+    unique, duplicates = dedup_sales_data(records, index)
+    print(f"{len(unique)} new, {len(duplicates)} duplicates, {index['count']} ids in the index")
+    commit_order_index(index)
+    close_order_index(index)
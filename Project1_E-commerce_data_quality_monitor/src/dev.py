@@ -2,6 +2,7 @@ import json
 from datetime import datetime
 import logging
 import re
+from validate import rejection_text
 
 def save_clean_data(transformed_data, output_file):
     try:
@@ -50,8 +51,8 @@ def generate_quality_report(valid_data, invalid_data, input_file, report_file):
     if match:
         quality_report['report_metadata']['data_source'] = match.group(0)
 
-    for record in invalid_data:
-        reason = record['rejection_reasons']
+    for record, code in invalid_data:
+        reason = rejection_text(code)
         quality_report['validation_details']['error_breakdown'][reason] = quality_report['validation_details']['error_breakdown'].get(reason, 0) + 1
 
         quality_report['validation_details']['invalid_records'].append({
@@ -60,11 +61,11 @@ def generate_quality_report(valid_data, invalid_data, input_file, report_file):
             'original_data': record
         })
 
-        if 'customer_name' in  record['rejection_reasons']:
+        if 'customer_name' in  reason:
             quality_report['recommendations'].append("Improve data entry validation for customer names")
-        if 'quantity' in record['rejection_reasons']:
+        if 'quantity' in reason:
             quality_report['recommendations'].append("Add quantity validation in sales system")
-        if 'order_date' in record['rejection_reasons']:
+        if 'order_date' in reason:
             quality_report['recommendations'].append("Fix date picker in order management system")
 
 
@@ -1,11 +1,36 @@
+import glob
 import logging
 import csv
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from compression import open_input, detect_compression, COMPRESSION_EXTENSIONS
+from mapped_reader import mapped_rows, mapped_row_blocks
 
-def extract_sales_data(file_path):
+# csv: csv.DictReader rows; mmap: dicts split straight from 1 MB blocks of the memory-mapped file, as csv.DictReader
+# gives them apart from dropping extra fields. Only rows holding quotes go through the csv module. Plain files
+# only, a compressed one is read with csv.
+READERS = ('csv', 'mmap')
+
+@contextmanager
+def open_sales_rows(file_path, reader='csv'):
+    if reader == 'mmap' and not detect_compression(file_path):
+        rows = mapped_rows(file_path)
+        try:
+            yield rows
+        finally:
+            rows.close()
+        return
+
+    with open_input(file_path) as file:
+        yield csv.DictReader(file)
+
+def extract_sales_data(file_path, reader='csv'):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            data = list(reader)
+        with open_sales_rows(file_path, reader) as rows:
+            data = list(rows)
 
         logging.info(f'Successfully extracted {len(data)} records')
         return data
@@ -17,6 +42,159 @@ def extract_sales_data(file_path):
         logging.error(f"File extraced failed: {e}")
         return []
 
+def extract_sales_data_chunks(file_path, chunk_size=10000, reader='csv'):
+    # Yields lists of at most chunk_size rows so the whole file is never held in memory
+    total_records = 0
+    try:
+        with open_sales_rows(file_path, reader) as rows:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                total_records += len(chunk)
+                yield chunk
+
+        logging.info(f'Successfully extracted {total_records} records')
+
+    except FileNotFoundError:
+        logging.error(f"File {file_path} does not exist")
+        raise
+    except Exception as e:
+        # Raised on so a chunked run fails instead of writing out the rows read so far as complete
+        logging.error(f"File extraced failed: {e}")
+        raise
+
+def extract_sales_coded_chunks(file_path, chunk_size=10000, block_codes=None):
+    # Like extract_sales_data_chunks with the mmap reader (plain files only), but yields (chunk, codes):
+    # codes is a list holding block_codes(fieldnames, rows, block) for the part of each mapped block in the chunk
+    total_records = 0
+    chunk, codes = [], []
+    try:
+        for fieldnames, rows, block in mapped_row_blocks(file_path):
+            row_codes = block_codes(fieldnames, rows, block)
+            start = 0
+            while start < len(rows):
+                end = start + chunk_size - len(chunk)
+                chunk += rows[start:end]
+                codes.append(row_codes[start:end])
+                start = end
+                if len(chunk) == chunk_size:
+                    total_records += len(chunk)
+                    yield chunk, codes
+                    chunk, codes = [], []
+        if chunk:
+            total_records += len(chunk)
+            yield chunk, codes
+
+        logging.info(f'Successfully extracted {total_records} records')
+
+    except FileNotFoundError:
+        logging.error(f"File {file_path} does not exist")
+        raise
+    except Exception as e:
+        logging.error(f"File extraced failed: {e}")
+        raise
+
+def read_csv_header(file_path):
+    # Returns the column names and the byte offset where the data rows start
+    with open(file_path, 'rb') as file:
+        header = file.readline()
+        data_start = file.tell()
+    return next(csv.reader([header.decode('utf-8')])), data_start
+
+def complete_lines_end(file_path, block_size=64 * 1024):
+    # Byte offset just past the last newline, so a row still being appended is left for later
+    with open(file_path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - block_size, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+def read_lines_between(file, start, end):
+    # Decoded lines of a binary file between two byte offsets. A line running past end
+    # (the file grew while being read) is cut there, so callers can resume exactly at end.
+    file.seek(start)
+    position = start
+    while position < end:
+        line = file.readline()
+        if not line:
+            break
+        if position + len(line) > end:
+            line = line[:end - position]
+        position += len(line)
+        yield line.decode('utf-8')
+
+def extract_sales_data_range(file_path, fieldnames, start, end, chunk_size=10000):
+    # Like extract_sales_data_chunks, but only for the rows between two byte offsets
+    total_records = 0
+    try:
+        with open(file_path, 'rb') as file:
+            reader = csv.DictReader(read_lines_between(file, start, end), fieldnames=fieldnames)
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                total_records += len(chunk)
+                yield chunk
+
+        logging.info(f'Successfully extracted {total_records} records from bytes {start}-{end}')
+
+    except Exception as e:
+        # Raised on so an incremental run fails instead of moving its watermark past rows it never read
+        logging.error(f"File extraced failed: {e}")
+        raise
+
+# Columns the rest of the pipeline reads from every sales row
+SALES_COLUMNS = ('order_id', 'customer_name', 'product', 'price', 'quantity', 'order_date', 'region')
+
+def missing_sales_columns(records):
+    return [column for column in SALES_COLUMNS if column not in records[0]] if records else []
+
+def list_input_files(pattern):
+    # A directory means every CSV directly inside it, compressed or not; anything else is a glob pattern
+    if os.path.isdir(pattern):
+        extensions = ('.csv',) + tuple(f'.csv{extension}' for extension in COMPRESSION_EXTENSIONS.values())
+        return sorted(path for path in glob.glob(os.path.join(pattern, '*.csv*'))
+                      if path.endswith(extensions) and os.path.isfile(path))
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+def read_sales_source(file_path, reader='csv'):
+    # (records, None), or ([], error message) for a file that could not be read, so it is not taken for an empty one
+    try:
+        with open_sales_rows(file_path, reader) as rows:
+            return list(rows), None
+    except Exception as e:
+        logging.error(f"File {file_path} could not be read: {e}")
+        return [], str(e)
+
+def extract_sales_sources(file_paths, concurrency=8, reader='csv'):
+    # Yields (file_path, records, error) in the order given, error being None for a file that was read.
+    # Files are read whole, so one that fails partway is skipped rather than half loaded. At most
+    # `concurrency` of them are read ahead in a thread pool while the current one is processed.
+    remaining = iter(file_paths)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for file_path in islice(remaining, concurrency):
+                pending.append((file_path, executor.submit(read_sales_source, file_path, reader)))
+            while pending:
+                file_path, future = pending.popleft()
+                records, error = future.result()
+                for next_path in islice(remaining, 1):
+                    pending.append((next_path, executor.submit(read_sales_source, next_path, reader)))
+                yield file_path, records, error
+        finally:
+            for _, future in pending:
+                future.cancel()
+
 if __name__ == '__main__':
     data = extract_sales_data('../data/daily_sales.csv')
     print(data)
+
+    for chunk in extract_sales_data_chunks('../data/daily_sales.csv', chunk_size=3):
+        print(f"Chunk of {len(chunk)} records")
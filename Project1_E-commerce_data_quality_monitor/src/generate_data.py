@@ -0,0 +1,91 @@
+import argparse
+import csv
+import logging
+import os
+import random
+from datetime import date, timedelta
+
+FIELDNAMES = ['order_id', 'customer_name', 'product', 'price', 'quantity', 'order_date', 'region']
+
+DATASET_SIZES = {'100k': 100000, '1M': 1000000, '10M': 10000000}
+
+# Chance per row of each problem validate_sales_data rejects; a row can get several
+ERROR_RATES = {
+    'customer_name empty': 0.02,
+    'order_date invalid': 0.02,
+    'quantity invalid': 0.02,
+    'Invalid numeric format': 0.01
+}
+
+PRODUCTS = [
+    ('Laptop', 999.99), ('Wireless Mouse', 25.99), ('Programming Book', 35.50), ('Monitor', 299.99),
+    ('Notebook', 5.99), ('Keyboard', 75.50), ('Desk Lamp', 45.99)
+]
+FIRST_NAMES = ['Alice', 'Bob', 'Charlie', 'Diana', 'Eve', 'Frank', 'Grace', 'Henry', 'Ivy', 'Jack']
+LAST_NAMES = ['Johnson', 'Smith', 'Brown', 'Davis', 'Wilson', 'Miller', 'Moore', 'Taylor', 'Clark', 'Lee']
+REGIONS = ['New York', 'Boston', 'Chicago', 'Seattle', 'Los Angeles', 'Miami']
+BAD_DATES = ['2024-02-30', '2024-13-01', '15/03/2024', '']
+BAD_QUANTITIES = ['0', '-2']
+BAD_NUMBERS = ['two', '', '1,5']
+START_DATE = date(2024, 1, 1)
+
+def generate_sales_rows(rows, seed=42, error_rates=None):
+    rates = dict(ERROR_RATES, **(error_rates or {}))
+    rng = random.Random(seed)
+    for index in range(1, rows + 1):
+        product, price = rng.choice(PRODUCTS)
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        quantity = str(rng.randint(1, 5))
+        order_date = (START_DATE + timedelta(days=rng.randrange(366))).isoformat()
+
+        if rng.random() < rates['customer_name empty']:
+            name = ''
+        if rng.random() < rates['order_date invalid']:
+            order_date = rng.choice(BAD_DATES)
+        if rng.random() < rates['quantity invalid']:
+            quantity = rng.choice(BAD_QUANTITIES)
+        elif rng.random() < rates['Invalid numeric format']:
+            quantity = rng.choice(BAD_NUMBERS)
+
+        yield [f'ORD-{index:03d}', name, product, f'{price:.2f}', quantity, order_date, rng.choice(REGIONS)]
+
+def generate_sales_file(output_file, rows, seed=42, error_rates=None):
+    try:
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(FIELDNAMES)
+            writer.writerows(generate_sales_rows(rows, seed, error_rates))
+
+        logging.info(f'Generated {rows} sales rows in {output_file}')
+        return True
+
+    except Exception as e:
+        logging.error(f"Error generating {output_file}: {e}")
+        return False
+
+def parse_rows(value):
+    return DATASET_SIZES[value] if value in DATASET_SIZES else int(value)
+
+def parse_error_rate(value):
+    reason, rate = value.rsplit('=', 1)
+    if reason not in ERROR_RATES:
+        raise argparse.ArgumentTypeError(f"unknown rejection reason '{reason}'")
+    return reason, float(rate)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Generate a synthetic daily_sales.csv')
+    parser.add_argument('--rows', type=parse_rows, default='100k',
+                        help=f"row count or one of {', '.join(DATASET_SIZES)}")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--error-rate', type=parse_error_rate, action='append', default=[],
+                        help="override one rejection rate, e.g. 'quantity invalid=0.1'")
+    parser.add_argument('--output', default=None,
+                        help='defaults to ../data/generated/daily_sales_<rows>.csv')
+    args = parser.parse_args()
+
+    output_file = args.output or f'../data/generated/daily_sales_{args.rows}.csv'
+    success = generate_sales_file(output_file, args.rows, args.seed, dict(args.error_rate))
+    if not success:
+        exit(1)
@@ -1,31 +1,233 @@
 import json
 from datetime import datetime
 import logging
+import random
 import re
+from stream_writer import write_encoded_stream, append_encoded_stream, encode_record
+from columnar_writer import COLUMNAR_FORMAT, write_columnar
+from sqlite_writer import SQLITE_FORMAT, write_sqlite, count_rows
+from rollup import remove_replaced_orders
+from extract import SALES_COLUMNS
+from validate import CUSTOMER_NAME_EMPTY, ORDER_DATE_INVALID, QUANTITY_INVALID, DUPLICATE_ORDER_ID
+from validate import rejection_text, rejection_code
 
-def save_clean_data(transformed_data, output_file):
+def sales_metadata():
+    return {
+        'export_timestamp': datetime.now().isoformat(),
+        'total_records': None,
+        'data_source': 'daily_sales.csv',
+        'processing_version': '1.0'
+    }
+
+def encode_sales_record(record):
+    # SalesRecord tuples only become dicts here, one at a time, as they are written
+    return encode_record(record._asdict())
+
+# Kind of each SalesRecord field in columnar output; repeated names and labels are dictionary-encoded
+SALES_COLUMN_KINDS = {
+    'order_id': 'string',
+    'customer_name': 'string',
+    'product': 'dictionary',
+    'price': 'float',
+    'quantity': 'int',
+    'total_amount': 'float',
+    'category': 'dictionary',
+    'order_date': 'date',
+    'region': 'dictionary',
+    'processed_date': 'dictionary'
+}
+
+# Indexed in SQLite output once the rows are loaded
+SALES_INDEX_COLUMNS = ('order_date', 'region')
+
+def save_sales_sqlite(transformed_chunks, output_file, rejected=None, append=False, rollup=None):
+    # SalesRecord tuples go straight to executemany; rejected rows keep their raw CSV fields.
+    # Orders already in the table are replaced, so a rollup of the run has their stored values taken back out.
+    before_batch = (lambda connection, batch: remove_replaced_orders(rollup, connection, batch)) if rollup else None
+    return write_sqlite(transformed_chunks, output_file, 'sales', SALES_COLUMN_KINDS, 'order_id', SALES_INDEX_COLUMNS,
+                        sales_metadata(), rejected, SALES_COLUMNS, rejection_text, append=append,
+                        before_batch=before_batch)
+
+def save_clean_data(transformed_data, output_file, output_format='json', rejected=None, rollup=None):
+    # SQLite output empties the rejected list it is given; the caller's list still goes into the report
+    rejected = list(rejected) if rejected is not None else None
+    return save_clean_data_chunks([transformed_data], output_file, output_format, rejected, rollup)
+
+def save_clean_data_chunks(transformed_chunks, output_file, output_format='json', rejected=None, rollup=None):
+    # `rejected` and `rollup` are only used by SQLite output, which stores rejected rows in their own table
     try:
-        load_info = {
-            'metadata': {
-                'export_timestamp': datetime.now().isoformat(),
-                'total_records': len(transformed_data),
-                'data_source': 'daily_sales.csv',
-                'processing_version': '1.0'
-            },
-            'sales_data': transformed_data
-        }
-
-        with open(output_file, 'w', encoding='utf-8') as file:
-            json.dump(load_info, file, indent=2)
-        logging.info(f"Successfully loaded {len(transformed_data)} records")
+        if output_format == SQLITE_FORMAT:
+            total_records = save_sales_sqlite(transformed_chunks, output_file, rejected, rollup=rollup)
+        elif output_format == COLUMNAR_FORMAT:
+            # SalesRecord tuples are already in SALES_COLUMN_KINDS order
+            records = (record for chunk in transformed_chunks for record in chunk)
+            total_records = write_columnar(records, output_file, sales_metadata(), SALES_COLUMN_KINDS)
+        else:
+            records = (encode_sales_record(record) for chunk in transformed_chunks for record in chunk)
+            total_records = write_encoded_stream(records, output_file, sales_metadata(), 'sales_data',
+                                                 output_format=output_format)
+        logging.info(f"Successfully loaded {total_records} records")
         return True
 
     except Exception as e:
         logging.error(f"Error loading data: {e}")
         return False
 
-def generate_quality_report(valid_data, invalid_data, input_file, report_file):
-    success_rate = round(len(valid_data) / (len(valid_data) + len(invalid_data)) * 100, 2)
+def append_clean_data_chunks(transformed_chunks, output_file, output_format='json', rejected=None, rollup=None):
+    try:
+        if output_format == SQLITE_FORMAT:
+            save_sales_sqlite(transformed_chunks, output_file, rejected, append=True, rollup=rollup)
+            total_records = count_rows(output_file, 'sales')
+        else:
+            records = (encode_sales_record(record) for chunk in transformed_chunks for record in chunk)
+            total_records = append_encoded_stream(records, output_file, sales_metadata(), 'sales_data',
+                                                  output_format=output_format)
+        logging.info(f"Successfully appended records, {total_records} in total")
+        return True
+
+    except Exception as e:
+        logging.error(f"Error loading data: {e}")
+        return False
+
+def read_encoded_parts(part_files):
+    for part_file in part_files:
+        with open(part_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                yield line.rstrip('\n')
+
+def save_clean_data_parts(part_files, output_file, output_format='json'):
+    # Merges per-shard files of encoded records, in the order given, into one output
+    try:
+        total_records = write_encoded_stream(read_encoded_parts(part_files), output_file, sales_metadata(),
+                                             'sales_data', output_format=output_format)
+        logging.info(f"Successfully loaded {total_records} records")
+        return True
+
+    except Exception as e:
+        logging.error(f"Error loading data: {e}")
+        return False
+
+def quality_grade(success_rate):
+    return 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
+
+# Rejected rows kept as examples in the report; every other reject is only counted
+REPORT_SAMPLE_SIZE = 100
+
+# Reported once for each rejection rule that occurs, however many rows fail it
+RECOMMENDATIONS = [
+    (CUSTOMER_NAME_EMPTY, "Improve data entry validation for customer names"),
+    (QUANTITY_INVALID, "Add quantity validation in sales system"),
+    (ORDER_DATE_INVALID, "Fix date picker in order management system"),
+    (DUPLICATE_ORDER_ID, "Stop resending orders that were already delivered")
+]
+
+def start_quality_report(sample_size=REPORT_SAMPLE_SIZE, seed=0):
+    # Running totals for the quality report, fed one batch at a time; its size does not grow with the rejects
+    return {
+        'valid_records': 0,
+        'invalid_records': 0,
+        'error_breakdown': {},
+        'invalid_sample': [],
+        'sample_size': sample_size,
+        'recommendations': [],
+        'rng': random.Random(seed)
+    }
+
+def add_recommendations(aggregate, code):
+    for bit, recommendation in RECOMMENDATIONS:
+        if code & bit and recommendation not in aggregate['recommendations']:
+            aggregate['recommendations'].append(recommendation)
+
+def add_invalid_record(aggregate, record, code):
+    # Counts are kept per reason bitmask; the text is only rendered by finish_quality_report
+    error_breakdown = aggregate['error_breakdown']
+    if code not in error_breakdown:
+        error_breakdown[code] = 0
+        add_recommendations(aggregate, code)
+    error_breakdown[code] += 1
+    aggregate['invalid_records'] += 1
+
+    # Reservoir sampling: after n rejects each of them has had the same sample_size / n chance to be kept
+    sample = aggregate['invalid_sample']
+    if len(sample) < aggregate['sample_size']:
+        slot = len(sample)
+        sample.append(None)
+    else:
+        slot = aggregate['rng'].randrange(aggregate['invalid_records'])
+        if slot >= aggregate['sample_size']:
+            return
+    sample[slot] = (record, code)
+
+def add_quality_batch(aggregate, valid_count, invalid_data):
+    aggregate['valid_records'] += valid_count
+    for record, code in invalid_data:
+        add_invalid_record(aggregate, record, code)
+
+def merge_samples(aggregate, sample, population):
+    # Combines two uniform samples, drawing from each in proportion to the rejects it stands for
+    ours = aggregate['invalid_sample']
+    size = aggregate['sample_size']
+    if len(ours) + len(sample) <= size:
+        return ours + sample
+
+    rng = aggregate['rng']
+    ours, theirs = list(ours), list(sample)
+    rng.shuffle(ours)
+    rng.shuffle(theirs)
+    our_population, their_population = aggregate['invalid_records'], population
+    merged = []
+    while len(merged) < size and (ours or theirs):
+        if theirs and (not ours or rng.randrange(our_population + their_population) >= our_population):
+            merged.append(theirs.pop())
+            their_population -= 1
+        else:
+            merged.append(ours.pop())
+            our_population -= 1
+    return merged
+
+def merge_quality_aggregates(aggregate, other):
+    aggregate['invalid_sample'] = merge_samples(aggregate, other['invalid_sample'], other['invalid_records'])
+    aggregate['valid_records'] += other['valid_records']
+    aggregate['invalid_records'] += other['invalid_records']
+    for reason, count in other['error_breakdown'].items():
+        aggregate['error_breakdown'][reason] = aggregate['error_breakdown'].get(reason, 0) + count
+    for recommendation in other['recommendations']:
+        if recommendation not in aggregate['recommendations']:
+            aggregate['recommendations'].append(recommendation)
+    return aggregate
+
+def aggregate_from_report(quality_report, sample_size=REPORT_SAMPLE_SIZE):
+    # Turns a saved report back into running totals so a later run can add to it
+    aggregate = start_quality_report(sample_size)
+    details = quality_report['validation_details']
+    aggregate['valid_records'] = quality_report['summary']['valid_records']
+    aggregate['invalid_records'] = quality_report['summary']['invalid_records']
+    aggregate['error_breakdown'] = {rejection_code(reason): count for reason, count in details['error_breakdown'].items()}
+    aggregate['invalid_sample'] = [sample_record(entry) for entry in details['invalid_records'][:sample_size]]
+    # Reports written before recommendations were deduplicated repeat them once per reject
+    aggregate['recommendations'] = list(dict.fromkeys(quality_report['recommendations']))
+    return aggregate
+
+def sample_entry(record, code):
+    reason = rejection_text(code)
+    original_data = dict(record)
+    original_data['rejection_reasons'] = reason
+    return {
+        'order_id': record['order_id'],
+        'error_reasons': reason,
+        'original_data': original_data
+    }
+
+def sample_record(entry):
+    # The reverse of sample_entry, for reports written earlier
+    record = dict(entry['original_data'])
+    record.pop('rejection_reasons', None)
+    return record, rejection_code(entry['error_reasons'])
+
+def finish_quality_report(aggregate, input_file):
+    total_valid = aggregate['valid_records']
+    total_invalid = aggregate['invalid_records']
+    success_rate = round(total_valid / (total_valid + total_invalid) * 100, 2)
     quality_report = {
         'report_metadata': {
             'generated_at': datetime.now().isoformat(),
@@ -33,51 +235,47 @@ def generate_quality_report(valid_data, invalid_data, input_file, report_file):
             'report_type': 'data_quality'
         },
         'summary': {
-            'total_records_processed': len(valid_data) + len(invalid_data),
-            'valid_records': len(valid_data),
-            'invalid_records': len(invalid_data),
+            'total_records_processed': total_valid + total_invalid,
+            'valid_records': total_valid,
+            'invalid_records': total_invalid,
             'success_rate': success_rate,
-            'data_quality_grade': 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
+            'data_quality_grade': quality_grade(success_rate)
         },
         'validation_details': {
-            'error_breakdown': {},
-            'invalid_records': []
+            'error_breakdown': {rejection_text(code): count for code, count in aggregate['error_breakdown'].items()},
+            'invalid_records': [sample_entry(record, code) for record, code in aggregate['invalid_sample']]
         },
-        'recommendations': []
+        'recommendations': list(aggregate['recommendations'])
     }
 
     match = re.search(r'([^/]+)$', input_file)
     if match:
         quality_report['report_metadata']['data_source'] = match.group(0)
 
-    for record in invalid_data:
-        reason = record['rejection_reasons']
-        quality_report['validation_details']['error_breakdown'][reason] = quality_report['validation_details']['error_breakdown'].get(reason, 0) + 1
-
-        quality_report['validation_details']['invalid_records'].append({
-            'order_id': record['order_id'],
-            'error_reasons': reason,
-            'original_data': record
-        })
-
-        if 'customer_name' in  record['rejection_reasons']:
-            quality_report['recommendations'].append("Improve data entry validation for customer names")
-        if 'quantity' in record['rejection_reasons']:
-            quality_report['recommendations'].append("Add quantity validation in sales system")
-        if 'order_date' in record['rejection_reasons']:
-            quality_report['recommendations'].append("Fix date picker in order management system")
+    return quality_report
 
+def build_quality_report(valid_data, invalid_data, input_file, valid_count=None):
+    # valid_count lets chunked runs report without keeping every valid record
+    aggregate = start_quality_report()
+    add_quality_batch(aggregate, len(valid_data) if valid_count is None else valid_count, invalid_data)
+    return finish_quality_report(aggregate, input_file)
 
-
-
-
-        # quality_report['invalid_records'].append(invalid_data)
-
+def write_quality_report(quality_report, report_file):
     with open(report_file, 'w', encoding='utf-8') as file:
         json.dump(quality_report, file, indent=2)
 
+def generate_quality_report(valid_data, invalid_data, input_file, report_file, valid_count=None):
+    write_quality_report(build_quality_report(valid_data, invalid_data, input_file, valid_count), report_file)
 
+def append_quality_report(aggregate, input_file, report_file):
+    # Folds a new run's totals into the existing report instead of rebuilding it from all rows
+    try:
+        with open(report_file, 'r', encoding='utf-8') as file:
+            aggregate = merge_quality_aggregates(aggregate_from_report(json.load(file)), aggregate)
+    except FileNotFoundError:
+        pass
 
+    write_quality_report(finish_quality_report(aggregate, input_file), report_file)
 
 if __name__ == "__main__":
     from extract import extract_sales_data
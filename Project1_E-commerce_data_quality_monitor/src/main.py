@@ -1,9 +1,28 @@
+import argparse
 import logging
+import os
 import re
-from extract import extract_sales_data
-from validate import validate_sales_data
+import shutil
+import tempfile
+from extract import extract_sales_data, extract_sales_data_chunks, extract_sales_data_range, read_csv_header, READERS
+from extract import list_input_files, extract_sales_sources, missing_sales_columns, SALES_COLUMNS, complete_lines_end
+from extract import extract_sales_coded_chunks
+from validate import validate_sales_data, rejection_text, sales_block_codes, VALIDATION_BACKENDS, COLUMNAR_AVAILABLE
 from transform import transform_sales_data
-from load import save_clean_data,generate_quality_report
+from catalog import load_product_index
+from load import save_clean_data,generate_quality_report, save_clean_data_chunks, save_clean_data_parts
+from load import append_clean_data_chunks, append_quality_report, start_quality_report, add_quality_batch
+from load import merge_quality_aggregates, finish_quality_report, write_quality_report
+from parallel import run_shards
+from stream_writer import OUTPUT_FORMATS
+from columnar_writer import COLUMNAR_FORMAT
+from sqlite_writer import SQLITE_FORMAT
+from compression import COMPRESSION_EXTENSIONS, compression_from_name, detect_compression
+from watermark import resume_offset, save_watermark, load_watermark, clear_watermark
+from metrics import start_metrics, stage, timed_chunks, add_stage, publish_metrics
+from dead_letter import start_dead_letter, write_dead_letter, append_dead_letter_parts, close_dead_letter
+from dedup import open_order_index, dedup_sales_data, commit_order_index, close_order_index
+from rollup import start_rollup, add_rollup_batch, merge_rollup_groups, save_rollup
 
 # Setup Logging
 logging.basicConfig(
@@ -15,68 +34,502 @@ logging.basicConfig(
     ]
 )
 
-def run_etl_pipeline():
+def process_sales_chunks(chunks, stats, report, product_index=None, metrics=None, rejected=None, dead_letter=None,
+                         order_index=None, rollup=None, validation_backend='rows'):
+    for chunk in chunks:
+        # Columnar chunks come paired with the codes read from the mapped bytes
+        codes = None
+        if validation_backend == 'columnar':
+            chunk, codes = chunk
+        stats['extracted'] += len(chunk)
+        stats['last_order_id'] = chunk[-1]['order_id']
+        with stage(metrics, 'validate') as current:
+            cleaned, chunk_rejected = validate_sales_data(chunk, codes)
+            current['records'] = len(chunk)
+        if order_index is not None:
+            with stage(metrics, 'dedup') as current:
+                current['records'] = len(cleaned)
+                cleaned, duplicates = dedup_sales_data(cleaned, order_index)
+            chunk_rejected += duplicates
+        stats['valid'] += len(cleaned)
+        add_quality_batch(report, len(cleaned), chunk_rejected)
+        # Rejected rows are only kept when the output stores them (SQLite)
+        if rejected is not None:
+            rejected.extend(chunk_rejected)
+        if dead_letter is not None:
+            write_dead_letter(dead_letter, chunk_rejected)
 
-    input_file = '../data/daily_sales.csv'
-    output_file = '../data/clean_sales.json'
-    report_file = '../data/quality_report.json'
+        with stage(metrics, 'transform') as current:
+            transformed = transform_sales_data(cleaned, product_index)
+            current['records'] = len(cleaned)
+        if transformed is False:
+            raise ValueError('Transform failed for chunk')
+        stats['transformed'] += len(transformed)
+        if rollup is not None:
+            add_rollup_batch(rollup, transformed)
+        yield transformed
 
+def process_sales_sources(sources, stats, report, source_counts, product_index=None, metrics=None, rejected=None,
+                          dead_letter=None, order_index=None, rollup=None, chunk_size=None):
+    # Each source file goes through validate/transform as one chunk, or in chunks of chunk_size records;
+    # its own counts are kept for the report
+    for file_path, records, error in sources:
+        if error is not None:
+            source_counts[file_path] = {'total_records': 0, 'skipped': f'unreadable: {error}'}
+            continue
+        missing = missing_sales_columns(records)
+        if missing:
+            logging.warning(f"Skipping {file_path}, missing columns {', '.join(missing)}")
+            source_counts[file_path] = {'total_records': len(records), 'skipped': f"missing {', '.join(missing)}"}
+            continue
+
+        valid_before, invalid_before = stats['valid'], report['invalid_records']
+        if records:
+            chunks = [records]
+            if chunk_size:
+                chunks = (records[start:start + chunk_size] for start in range(0, len(records), chunk_size))
+            yield from process_sales_chunks(chunks, stats, report, product_index, metrics, rejected, dead_letter,
+                                            order_index, rollup)
+        source_counts[file_path] = {
+            'total_records': len(records),
+            'valid_records': stats['valid'] - valid_before,
+            'invalid_records': report['invalid_records'] - invalid_before
+        }
+
+def run_multi_file_etl_pipeline(input_pattern, output_file, report_file, concurrency=8, output_format='json',
+                                product_index=None, metrics=None, reader='csv', dead_letter=None, order_index=None,
+                                rollup=None, chunk_size=None):
+    input_files = list_input_files(input_pattern)
+    if not input_files:
+        logging.error(f'No input files match {input_pattern}. Pipeline stopped')
+        return False
+    logging.info(f'=== SALES DATA PIPELINE STARTED ({len(input_files)} files, {concurrency} read concurrently) ===')
+
+    stats = {'extracted': 0, 'valid': 0, 'transformed': 0}
+    report = start_quality_report()
+    source_counts = {}
+    rejected = [] if output_format == SQLITE_FORMAT else None
+
+    # All files end up in one output; files are read ahead concurrently but written in sorted order
+    sources = timed_chunks(metrics, 'extract', extract_sales_sources(input_files, concurrency, reader),
+                           count=lambda source: len(source[1]))
+    with stage(metrics, 'load') as current:
+        load_success = save_clean_data_chunks(process_sales_sources(sources, stats, report, source_counts,
+                                                                    product_index, metrics, rejected, dead_letter,
+                                                                    order_index, rollup, chunk_size),
+                                              output_file, output_format, rejected, rollup)
+        current['records'] = stats['transformed']
+
+    skipped = [file_path for file_path, counts in source_counts.items() if 'skipped' in counts]
+    if skipped:
+        logging.warning(f"Skipped {len(skipped)} of {len(input_files)} files: {', '.join(skipped)}")
+
+    if not stats['extracted']:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+
+    logging.info(f"valid records: {stats['valid']}")
+    logging.info(f"invalid records: {report['invalid_records']}")
+    logging.info(f"✅ Saved clean data to: {output_file} ({stats['transformed']} records)")
+
+    logging.info("Step 4. Generating report...")
+    with stage(metrics, 'report') as current:
+        quality_report = finish_quality_report(report, input_pattern)
+        base_dir = os.path.dirname(input_files[0]) if len(input_files) == 1 else os.path.commonpath(input_files)
+        quality_report['report_metadata']['data_source'] = {
+            'input': input_pattern,
+            'files': len(input_files),
+            'sources': {os.path.relpath(file_path, base_dir): counts for file_path, counts in source_counts.items()}
+        }
+        write_quality_report(quality_report, report_file)
+        current['records'] = stats['extracted']
+    logging.info(f"✅ Generated quality report: {report_file}")
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    logging.info(f"Valid: {stats['transformed']} records | Invalid: {report['invalid_records']}")
+    return load_success
+
+def run_chunked_etl_pipeline(input_file, output_file, report_file, chunk_size, output_format='json',
+                             product_index=None, metrics=None, reader='csv', dead_letter=None, order_index=None,
+                             rollup=None, validation_backend='rows'):
+    logging.info(f'=== SALES DATA PIPELINE STARTED (chunks of {chunk_size} records) ===')
+    stats = {'extracted': 0, 'valid': 0, 'transformed': 0}
+    report = start_quality_report()
+    rejected = [] if output_format == SQLITE_FORMAT else None
+
+    # Extract, validate, transform and load all happen while the output file is being written
+    if validation_backend == 'columnar':
+        chunks = extract_sales_coded_chunks(input_file, chunk_size, sales_block_codes)
+        chunks = timed_chunks(metrics, 'extract', chunks, count=lambda chunk: len(chunk[0]))
+    else:
+        chunks = timed_chunks(metrics, 'extract', extract_sales_data_chunks(input_file, chunk_size, reader))
+    with stage(metrics, 'load') as current:
+        load_success = save_clean_data_chunks(process_sales_chunks(chunks, stats, report, product_index, metrics,
+                                                                   rejected, dead_letter, order_index, rollup,
+                                                                   validation_backend),
+                                              output_file, output_format, rejected, rollup)
+        current['records'] = stats['transformed']
+
+    if not stats['extracted']:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+
+    logging.info(f"valid records: {stats['valid']}")
+    logging.info(f"invalid records: {report['invalid_records']}")
+    logging.info(f"✅ Saved clean data to: {output_file} ({stats['transformed']} records)")
+
+    logging.info("Step 4. Generating report...")
+    with stage(metrics, 'report') as current:
+        write_quality_report(finish_quality_report(report, input_file), report_file)
+        current['records'] = stats['extracted']
+    logging.info(f"✅ Generated quality report: quality_report.json")
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    success_rate = round(stats['valid'] / stats['extracted'] * 100, 2)
+    grade = 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
+    logging.info(f"Data Quality Score: {success_rate}% (Grade {grade}) ")
+
+    logging.info(f"Valid: {stats['transformed']} records | Invalid: {report['invalid_records']}")
+    return load_success
+
+def run_incremental_etl_pipeline(input_file, output_file, report_file, chunk_size=10000, output_format='json',
+                                 product_index=None, metrics=None, dead_letter=None, order_index=None, rollup=None):
+    fieldnames, data_start = read_csv_header(input_file)
+    # Rows appended while this run is going, and a last row not yet ended by a newline, are left for the next one
+    end_offset = complete_lines_end(input_file)
+
+    start_offset = resume_offset(input_file, output_file)
+    appending = start_offset is not None
+    if not appending:
+        start_offset = data_start
+    logging.info(f'=== SALES DATA PIPELINE STARTED (incremental, bytes {start_offset}-{end_offset}) ===')
+
+    previous = load_watermark(input_file) if appending else None
+    stats = {'extracted': 0, 'valid': 0, 'transformed': 0,
+             'last_order_id': previous['last_order_id'] if previous else None}
+    report = start_quality_report()
+    rejected = [] if output_format == SQLITE_FORMAT else None
+    if dead_letter is not None:
+        dead_letter['append'] = appending
+    if rollup is not None:
+        rollup['append'] = rollup['append'] or appending
+
+    chunks = timed_chunks(metrics, 'extract',
+                          extract_sales_data_range(input_file, fieldnames, start_offset, end_offset, chunk_size))
+    chunks = process_sales_chunks(chunks, stats, report, product_index, metrics, rejected, dead_letter, order_index,
+                                  rollup)
+    with stage(metrics, 'load') as current:
+        if appending:
+            load_success = append_clean_data_chunks(chunks, output_file, output_format, rejected, rollup)
+        else:
+            load_success = save_clean_data_chunks(chunks, output_file, output_format, rejected, rollup)
+        current['records'] = stats['transformed']
+    if not load_success:
+        return False
+
+    if stats['extracted']:
+        logging.info(f"valid records: {stats['valid']}")
+        logging.info(f"invalid records: {report['invalid_records']}")
+        with stage(metrics, 'report') as current:
+            if appending:
+                append_quality_report(report, input_file, report_file)
+            else:
+                write_quality_report(finish_quality_report(report, input_file), report_file)
+            current['records'] = stats['extracted']
+        logging.info(f"✅ Updated quality report: {report_file}")
+    elif appending:
+        logging.info('No new records since the last run')
+    else:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+
+    save_watermark(input_file, output_file, end_offset, stats['last_order_id'])
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    logging.info(f"New valid: {stats['transformed']} records | New invalid: {report['invalid_records']}")
+    return True
+
+def run_parallel_etl_pipeline(input_file, output_file, report_file, workers, chunk_size=10000, output_format='json',
+                              catalog_file=None, metrics=None, dead_letter=None, rollup=None):
+    logging.info(f'=== SALES DATA PIPELINE STARTED ({workers} workers) ===')
+
+    # Part files live next to the output so the final merge stays on one filesystem
+    part_dir = tempfile.mkdtemp(prefix='etl_shards_', dir=os.path.dirname(os.path.abspath(output_file)))
     try:
-        logging.info('=== SALES DATA PIPELINE STARTED ===\n📁 STEP 1: Extracting data...')
-        raw_data = extract_sales_data(input_file)
+        with stage(metrics, 'shards'):
+            part_files, rejected_files, results = run_shards(input_file, part_dir, workers, chunk_size, catalog_file,
+                                                             rollup is not None)
 
-        match = re.search(r'([^/]+)$', input_file)
-        file = ''
+        stats = {'extracted': 0, 'valid': 0, 'transformed': 0}
+        report = start_quality_report()
+        for shard_stats, shard_report, shard_rollup in results:
+            for key in stats:
+                stats[key] += shard_stats[key]
+            merge_quality_aggregates(report, shard_report)
+            if rollup is not None:
+                merge_rollup_groups(rollup, shard_rollup)
 
-        if match:
-            file = match.group(0)
+        # Extract, validate and transform run inside the workers, so their CPU time and records are added here
+        add_stage(metrics, 'shards', 0.0, sum(shard_stats['cpu_seconds'] for shard_stats, _, _ in results),
+                  stats['extracted'])
 
-        if not raw_data:
+        if not stats['extracted']:
             logging.error('No data extracted. Pipeline stopped')
             return False
-        else:
-            logging.info(f'✅ Extracted {len(raw_data)} records from {file}')
 
+        logging.info(f"✅ Extracted {stats['extracted']} records from {len(part_files)} shards")
+        logging.info(f"valid records: {stats['valid']}")
+        logging.info(f"invalid records: {report['invalid_records']}")
+
+        with stage(metrics, 'load') as current:
+            load_success = save_clean_data_parts(part_files, output_file, output_format)
+            current['records'] = stats['transformed']
+        if dead_letter is not None:
+            append_dead_letter_parts(dead_letter, rejected_files, report['invalid_records'])
+        logging.info(f"✅ Saved clean data to: {output_file} ({stats['transformed']} records)")
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    logging.info("Step 4. Generating report...")
+    with stage(metrics, 'report') as current:
+        write_quality_report(finish_quality_report(report, input_file), report_file)
+        current['records'] = stats['extracted']
+    logging.info(f"✅ Generated quality report: quality_report.json")
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    success_rate = round(stats['valid'] / stats['extracted'] * 100, 2)
+    grade = 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
+    logging.info(f"Data Quality Score: {success_rate}% (Grade {grade}) ")
+
+    logging.info(f"Valid: {stats['transformed']} records | Invalid: {report['invalid_records']}")
+    return load_success
+
+def run_serial_etl_pipeline(input_file, output_file, report_file, output_format='json', product_index=None,
+                            metrics=None, reader='csv', dead_letter=None, order_index=None, rollup=None):
+    logging.info('=== SALES DATA PIPELINE STARTED ===\n📁 STEP 1: Extracting data...')
+    with stage(metrics, 'extract') as current:
+        raw_data = extract_sales_data(input_file, reader)
+        current['records'] = len(raw_data)
+
+    match = re.search(r'([^/]+)$', input_file)
+    file = ''
+
+    if match:
+        file = match.group(0)
+
+    if not raw_data:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+    else:
+        logging.info(f'✅ Extracted {len(raw_data)} records from {file}')
+
+    with stage(metrics, 'validate') as current:
         cleaned, rejected = validate_sales_data(raw_data)
+        current['records'] = len(raw_data)
+    if order_index is not None:
+        with stage(metrics, 'dedup') as current:
+            current['records'] = len(cleaned)
+            cleaned, duplicates = dedup_sales_data(cleaned, order_index)
+        rejected += duplicates
 
-        if not cleaned:
-            logging.warning('No valid data')
+    if not cleaned:
+        logging.warning('No valid data')
 
-        logging.info(f'valid records: {len(cleaned)}')
-        logging.info(f'invalid records: {len(rejected)}')
-        for record in rejected:
-            logging.info(f" - {record['order_id']} : {record['rejection_reasons']}")
+    logging.info(f'valid records: {len(cleaned)}')
+    logging.info(f'invalid records: {len(rejected)}')
+    if dead_letter is not None:
+        write_dead_letter(dead_letter, rejected)
 
-        logging.info('🔄 STEP 3: Transforming data...')
-        transformed = transform_sales_data(cleaned)
-        if not transformed:
-            logging.warning(f"No data transformed")
-        logging.info(f"Transformed {len(transformed)} records")
+    logging.info('🔄 STEP 3: Transforming data...')
+    with stage(metrics, 'transform') as current:
+        transformed = transform_sales_data(cleaned, product_index)
+        current['records'] = len(cleaned)
+    if not transformed:
+        logging.warning(f"No data transformed")
+    logging.info(f"Transformed {len(transformed)} records")
+    if rollup is not None and transformed:
+        add_rollup_batch(rollup, transformed)
 
-        # LOAD
-        logging.info("Step 3. Loading data...")
-        load_success = save_clean_data(transformed, output_file)
-        logging.info(f"✅ Saved clean data to: clean_sales.json ({len(transformed)} records)")
+    # LOAD
+    logging.info("Step 3. Loading data...")
+    with stage(metrics, 'load') as current:
+        load_success = save_clean_data(transformed, output_file, output_format, rejected, rollup)
+        current['records'] = len(transformed)
+    logging.info(f"✅ Saved clean data to: {output_file} ({len(transformed)} records)")
 
 
-        # GENERATE REPORT
-        logging.info("Step 4. Generating report...")
+    # GENERATE REPORT
+    logging.info("Step 4. Generating report...")
+    with stage(metrics, 'report') as current:
         generate_quality_report(cleaned, rejected, input_file, report_file)
-        logging.info(f"✅ Generated quality report: quality_report.json")
+        current['records'] = len(cleaned) + len(rejected)
+    logging.info(f"✅ Generated quality report: quality_report.json")
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    success_rate = round(len(cleaned) / (len(cleaned) + len(rejected)) * 100, 2)
+    grade = 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
+    logging.info(f"Data Quality Score: {success_rate}% (Grade {grade}) ")
 
-        logging.info(f"=== PIPELINE COMPLETED ===")
-        success_rate = round(len(cleaned) / (len(cleaned) + len(rejected)) * 100, 2)
-        grade = 'A' if success_rate >= 90 else 'B' if success_rate >= 80 else "C" if success_rate >= 70 else 'D' if success_rate >= 60 else "E"
-        logging.info(f"Data Quality Score: {success_rate}% (Grade {grade}) ")
+    logging.info(f"Valid: {len(transformed)} records | Invalid: {len(rejected)}")
+    return load_success
 
-        logging.info(f"Valid: {len(transformed)} records | Invalid: {len(rejected)}")
-        return load_success
+def run_etl_pipeline(input_file='../data/daily_sales.csv', output_file='../data/clean_sales.json',
+                     report_file='../data/quality_report.json', chunk_size=None, output_format='json', workers=None,
+                     catalog_file=None, incremental=False, metrics=False, trace_memory=False,
+                     metrics_file='../data/sales_metrics.prom', input_pattern=None, concurrency=8, reader='csv',
+                     dead_letter_file='../data/rejected_sales.csv', order_index_dir=None,
+                     rollup_file='../data/sales_rollups.db', validation_backend='rows'):
 
+    pipeline_metrics = start_metrics('sales', trace_memory) if metrics else None
+    dead_letter = start_dead_letter(dead_letter_file, SALES_COLUMNS, rejection_text) if dead_letter_file else None
+    order_index = None
+    # The sales table of SQLite output is upserted into across runs, so its rollup is always added to;
+    # orders a run replaces are taken back out as they are loaded
+    rollup = start_rollup(append=output_format == SQLITE_FORMAT) if rollup_file else None
+
+    try:
+        # Loading here also refreshes the on-disk index before any worker process reads it
+        product_index = load_product_index(catalog_file)
+
+        # Several input files are read whole into one output; there are no byte offsets to resume or shard
+        if input_pattern and (incremental or (workers and workers > 1)):
+            logging.warning('Several input files, running them in order instead of incremental or parallel mode')
+            incremental, workers = False, None
+
+        # Incremental and parallel runs work with byte offsets into plain files
+        if (incremental or (workers and workers > 1)) and (
+                compression_from_name(output_file) or (os.path.exists(input_file) and detect_compression(input_file))):
+            logging.warning('Compressed input or output, running in chunks instead of incremental or parallel mode')
+            incremental, workers, chunk_size = False, None, chunk_size or 10000
+
+        # Columnar output is written in one pass and cannot be appended to or merged from shards
+        if (incremental or (workers and workers > 1)) and output_format == COLUMNAR_FORMAT:
+            logging.warning('Columnar output, running in chunks instead of incremental or parallel mode')
+            incremental, workers, chunk_size = False, None, chunk_size or 10000
+
+        # Shards only hand back their clean rows, SQLite output also stores the rejected ones
+        if workers and workers > 1 and output_format == SQLITE_FORMAT:
+            logging.warning('SQLite output, running in chunks instead of parallel mode')
+            workers, chunk_size = None, chunk_size or 10000
+
+        # The order id index is written by one process at a time
+        if workers and workers > 1 and order_index_dir:
+            logging.warning('Order id index in use, running in chunks instead of parallel mode')
+            workers, chunk_size = None, chunk_size or 10000
+        # Columnar validation reads the codes from the bytes of a plain file mapped in memory, in chunks
+        if validation_backend == 'columnar' and not COLUMNAR_AVAILABLE:
+            logging.warning('NumPy is not installed, falling back to row-by-row validation')
+            validation_backend = 'rows'
+        if validation_backend == 'columnar' and (input_pattern or incremental or (workers and workers > 1) or (
+                os.path.exists(input_file) and detect_compression(input_file))):
+            logging.warning('Columnar validation needs one plain input file run in chunks, validating row by row')
+            validation_backend = 'rows'
+
+        if order_index_dir:
+            order_index = open_order_index(order_index_dir)
+
+        if input_pattern:
+            success = run_multi_file_etl_pipeline(input_pattern, output_file, report_file, concurrency,
+                                                  output_format, product_index, pipeline_metrics, reader,
+                                                  dead_letter, order_index, rollup, chunk_size)
+        elif incremental:
+            success = run_incremental_etl_pipeline(input_file, output_file, report_file, chunk_size or 10000,
+                                                   output_format, product_index, pipeline_metrics, dead_letter,
+                                                   order_index, rollup)
+        elif workers and workers > 1:
+            success = run_parallel_etl_pipeline(input_file, output_file, report_file, workers, chunk_size or 10000,
+                                                output_format, catalog_file, pipeline_metrics, dead_letter, rollup)
+        elif chunk_size or validation_backend == 'columnar':
+            success = run_chunked_etl_pipeline(input_file, output_file, report_file, chunk_size or 10000,
+                                               output_format, product_index, pipeline_metrics, reader, dead_letter,
+                                               order_index, rollup, validation_backend)
+        else:
+            success = run_serial_etl_pipeline(input_file, output_file, report_file, output_format, product_index,
+                                              pipeline_metrics, reader, dead_letter, order_index, rollup)
+
+        # A run that rewrote the output from scratch leaves nothing for an incremental run to resume
+        if success and not incremental and not input_pattern:
+            clear_watermark(input_file)
+        # Ids are only kept once the run's output is written; a failed run leaves the index as it was
+        if success and order_index is not None:
+            commit_order_index(order_index)
+            logging.info(f"Order id index {order_index_dir}: {order_index['count']} ids")
+        if success and rollup is not None:
+            groups = save_rollup(rollup, rollup_file)
+            logging.info(f"{'Updated' if rollup['append'] else 'Rebuilt'} {groups} sales rollups in {rollup_file}")
+        if dead_letter is not None:
+            logging.info(f"Rejected records written to {dead_letter_file} ({close_dead_letter(dead_letter)} records)")
+        if success and pipeline_metrics is not None:
+            publish_metrics(pipeline_metrics, report_file, metrics_file)
+        return success
 
     except Exception as e:
         logging.error(f"ETL Pipeline failed: {e}")
         return False
+    finally:
+        # Closing twice is harmless; this covers runs that stopped with the file still open
+        if dead_letter is not None and dead_letter['file'] is not None:
+            dead_letter['file'].close()
+        if order_index is not None:
+            close_order_index(order_index)
 
 if __name__ == '__main__':
-    success = run_etl_pipeline()
+    parser = argparse.ArgumentParser(description='Sales data ETL pipeline')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='stream the input through the pipeline this many rows at a time')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS + (COLUMNAR_FORMAT, SQLITE_FORMAT), default='json',
+                        help='json array document, compact NDJSON with a .meta.json sidecar, a directory of '
+                             'one .npy file per column with a manifest.json, or a SQLite database')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='validate and transform byte-range shards of the input in this many processes')
+    parser.add_argument('--catalog', default=None,
+                        help='product catalog (CSV or JSON) used to look up each product\'s category')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process rows appended since the last run, falling back to a full run if the file was rewritten')
+    parser.add_argument('--metrics', action='store_true',
+                        help='record per-stage timing, throughput and memory in the report and a metrics file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record tracemalloc peaks per stage (slows the run down)')
+    parser.add_argument('--metrics-file', default='../data/sales_metrics.prom',
+                        help='where to write the Prometheus text-format metrics')
+    parser.add_argument('--inputs', default=None,
+                        help='directory or glob of daily CSVs to load into one output and report (instead of daily_sales.csv); '
+                             'each file is read whole, then split by --chunk-size, and --workers and --incremental '
+                             'do not apply')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='with --inputs, how many files are read ahead at the same time')
+    parser.add_argument('--input', default='../data/daily_sales.csv',
+                        help='sales CSV, optionally gzip, bz2 or xz compressed')
+    parser.add_argument('--reader', choices=READERS, default='csv',
+                        help='csv.DictReader, or an mmap reader that splits unquoted rows of a plain file on commas '
+                             'itself and leaves only quoted rows to the csv module')
+    parser.add_argument('--validation-backend', choices=VALIDATION_BACKENDS, default='rows',
+                        help='validate row by row, or check each chunk as NumPy columns read straight from the '
+                             'mapped bytes of a plain input file')
+    parser.add_argument('--compress', choices=COMPRESSION_EXTENSIONS, default=None,
+                        help='compress the clean data output')
+    parser.add_argument('--dead-letter', default='../data/rejected_sales.csv',
+                        help="CSV the rejected rows and their reasons are streamed to ('' to skip it)")
+    parser.add_argument('--rollups', default='../data/sales_rollups.db',
+                        help="SQLite store of revenue, quantity and orders per date, region and category, updated "
+                             "with each run's new rows ('' to skip it); query it with rollup.py")
+    parser.add_argument('--order-index', default=None,
+                        help='directory of order ids loaded by earlier runs; rows whose order_id is already in it '
+                             'are rejected as duplicates, and the new ids are added once the run succeeds')
+    args = parser.parse_args()
+
+    if args.compress and args.output_format in (COLUMNAR_FORMAT, SQLITE_FORMAT):
+        parser.error('--compress only applies to json and ndjson output')
+
+    output_file = {'ndjson': '../data/clean_sales.ndjson',
+                   COLUMNAR_FORMAT: '../data/clean_sales_columns',
+                   SQLITE_FORMAT: '../data/sales.db'}.get(args.output_format, '../data/clean_sales.json')
+    if args.compress:
+        output_file += COMPRESSION_EXTENSIONS[args.compress]
+    success = run_etl_pipeline(input_file=args.input, output_file=output_file, chunk_size=args.chunk_size, output_format=args.output_format,
+                               workers=args.workers, catalog_file=args.catalog, incremental=args.incremental,
+                               metrics=args.metrics or args.trace_memory, trace_memory=args.trace_memory,
+                               metrics_file=args.metrics_file, input_pattern=args.inputs,
+                               concurrency=args.concurrency, reader=args.reader,
+                               dead_letter_file=args.dead_letter or None, order_index_dir=args.order_index,
+                               rollup_file=args.rollups or None, validation_backend=args.validation_backend)
 
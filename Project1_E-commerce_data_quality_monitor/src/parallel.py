@@ -0,0 +1,106 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from validate import validate_sales_data, rejection_text
+from transform import transform_sales_data
+from catalog import load_product_index
+from extract import read_csv_header, read_lines_between, SALES_COLUMNS
+from dead_letter import start_dead_letter, write_dead_letter, close_dead_letter
+from load import encode_sales_record, start_quality_report, add_quality_batch
+from rollup import start_rollup, add_rollup_batch
+
+def shard_file(file_path, shards):
+    # Splits the data rows into byte ranges that start right after a newline.
+    # Rows must not contain quoted newlines, which holds for the sales export.
+    fieldnames, data_start = read_csv_header(file_path)
+    with open(file_path, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        step = max((file_size - data_start) // shards, 1)
+
+        boundaries = [data_start]
+        for shard in range(1, shards):
+            # Reading from one byte earlier keeps a boundary that already sits on a line start
+            file.seek(data_start + shard * step - 1)
+            file.readline()
+            position = file.tell()
+            if position >= file_size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+        boundaries.append(file_size)
+
+    return fieldnames, list(zip(boundaries[:-1], boundaries[1:]))
+
+def process_shard(shard):
+    # Runs in a worker process: validates and transforms one byte range and writes
+    # the encoded records to its own part file, one record per line, and the rejected
+    # rows to a headerless dead-letter part
+    cpu_start = time.process_time()
+    start, end = shard['start'], shard['end']
+    product_index = load_product_index(shard['catalog_file'])
+    stats = {'extracted': 0, 'valid': 0, 'transformed': 0}
+    report = start_quality_report()
+    dead_letter = start_dead_letter(shard['rejected_file'], SALES_COLUMNS, rejection_text, header=False)
+    rollup = start_rollup() if shard['rollups'] else None
+
+    with open(shard['file_path'], 'rb') as source, open(shard['part_file'], 'w', encoding='utf-8') as part:
+        reader = csv.DictReader(read_lines_between(source, start, end), fieldnames=shard['fieldnames'])
+        while True:
+            chunk = list(islice(reader, shard['chunk_size']))
+            if not chunk:
+                break
+            stats['extracted'] += len(chunk)
+
+            cleaned, chunk_rejected = validate_sales_data(chunk)
+            stats['valid'] += len(cleaned)
+            add_quality_batch(report, len(cleaned), chunk_rejected)
+            write_dead_letter(dead_letter, chunk_rejected)
+
+            transformed = transform_sales_data(cleaned, product_index)
+            if transformed is False:
+                raise ValueError(f'Transform failed for shard {start}-{end}')
+            stats['transformed'] += len(transformed)
+            if rollup is not None:
+                add_rollup_batch(rollup, transformed)
+            for record in transformed:
+                part.write(encode_sales_record(record))
+                part.write('\n')
+    close_dead_letter(dead_letter)
+
+    stats['cpu_seconds'] = time.process_time() - cpu_start
+    return stats, report, rollup['groups'] if rollup is not None else None
+
+def run_shards(input_file, part_dir, workers, chunk_size=10000, catalog_file=None, rollups=False):
+    # Returns part files, dead-letter parts and per shard its stats, quality report totals and, with
+    # rollups, its rollup groups, all in input order
+    shards_per_worker = 4
+    fieldnames, ranges = shard_file(input_file, workers * shards_per_worker)
+    shards = [
+        {
+            'file_path': input_file,
+            'fieldnames': fieldnames,
+            'start': start,
+            'end': end,
+            'part_file': os.path.join(part_dir, f'part-{index:05d}.ndjson'),
+            'rejected_file': os.path.join(part_dir, f'part-{index:05d}.rejected.csv'),
+            'chunk_size': chunk_size,
+            'catalog_file': catalog_file,
+            'rollups': rollups
+        }
+        for index, (start, end) in enumerate(ranges)
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process_shard, shards))
+
+    part_files = [shard['part_file'] for shard in shards]
+    rejected_files = [shard['rejected_file'] for shard in shards]
+    return part_files, rejected_files, results
+
+if __name__ == '__main__':
+    fieldnames, ranges = shard_file('../data/daily_sales.csv', 3)
+    print(fieldnames)
+    print(ranges)
@@ -0,0 +1,143 @@
+import argparse
+import sqlite3
+from datetime import datetime
+from date_parser import parse_iso_date
+from sqlite_writer import open_database
+
+# Revenue, quantity and order count per (order_date, region, category), kept in SQLite next to the output.
+# Revenue is summed in integer cents, so folding runs in one at a time gives exactly what a full
+# recompute would.
+ROLLUP_KEYS = ('order_date', 'region', 'category')
+ROLLUP_TABLE = 'sales_rollup'
+
+def start_rollup(append=True):
+    # Totals of the batches loaded in this run. Set 'append' to False when the run rewrites the
+    # output from scratch, so the stored rollup is replaced rather than added to.
+    return {'groups': {}, 'append': append}
+
+def add_rollup_batch(rollup, records):
+    # records are SalesRecord tuples as transform_sales_data returns them
+    groups = rollup['groups']
+    for record in records:
+        key = (record.order_date, record.region, record.category)
+        totals = groups.get(key)
+        if totals is None:
+            totals = groups[key] = [0, 0, 0]
+        totals[0] += round(record.total_amount * 100)
+        totals[1] += record.quantity
+        totals[2] += 1
+
+# Order ids looked up per query when checking which orders a SQLite load replaces
+LOOKUP_IDS = 500
+
+def remove_replaced_orders(rollup, connection, records):
+    # SQLite output keeps one row per order_id in its sales table, so an order loaded again replaces the
+    # stored row. Called with each batch before it is upserted: takes the stored version of every order
+    # in records (or an earlier copy in the same batch) back out of the totals add_rollup_batch added to.
+    order_ids = [record.order_id for record in records]
+    stored = {}
+    for start in range(0, len(order_ids), LOOKUP_IDS):
+        ids = order_ids[start:start + LOOKUP_IDS]
+        rows = connection.execute(f"SELECT order_id, order_date, region, category, total_amount, quantity "
+                                  f"FROM sales WHERE order_id IN ({', '.join('?' * len(ids))})", ids)
+        stored.update((row[0], row[1:]) for row in rows)
+
+    groups = rollup['groups']
+    for record in records:
+        previous = stored.get(record.order_id)
+        if previous is not None:
+            order_date, region, category, total_amount, quantity = previous
+            totals = groups.setdefault((order_date, region, category), [0, 0, 0])
+            totals[0] -= round(total_amount * 100)
+            totals[1] -= quantity
+            totals[2] -= 1
+        stored[record.order_id] = (record.order_date, record.region, record.category, record.total_amount,
+                                   record.quantity)
+
+def merge_rollup_groups(rollup, groups):
+    # Adds totals worked out elsewhere, such as by the parallel shards
+    for key, (revenue_cents, quantity, orders) in groups.items():
+        totals = rollup['groups'].setdefault(key, [0, 0, 0])
+        totals[0] += revenue_cents
+        totals[1] += quantity
+        totals[2] += orders
+
+def create_rollup_tables(connection):
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (order_date TEXT, region TEXT, category TEXT, '
+                       f'revenue_cents INTEGER, quantity INTEGER, orders INTEGER, '
+                       f'PRIMARY KEY (order_date, region, category)) WITHOUT ROWID')
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE}_runs '
+                       f'(updated_at TEXT, groups INTEGER, orders INTEGER, replaced INTEGER)')
+
+def save_rollup(rollup, rollup_file):
+    # Folds this run's totals into the store in one transaction and returns how many groups changed.
+    # Totals can be negative where a SQLite load replaced orders stored by an earlier run.
+    # Dates are stored zero-padded, which the validator does not insist on, so ranges compare as text.
+    groups = {}
+    for (order_date, region, category), totals in rollup['groups'].items():
+        key = (parse_iso_date(order_date).isoformat(), region, category)
+        stored = groups.setdefault(key, [0, 0, 0])
+        for position, value in enumerate(totals):
+            stored[position] += value
+
+    connection = open_database(rollup_file)
+    try:
+        create_rollup_tables(connection)
+        connection.execute('BEGIN')
+        if not rollup['append']:
+            connection.execute(f'DELETE FROM {ROLLUP_TABLE}')
+        connection.executemany(f'INSERT INTO {ROLLUP_TABLE} VALUES (?, ?, ?, ?, ?, ?) '
+                               f'ON CONFLICT (order_date, region, category) DO UPDATE SET '
+                               f'revenue_cents = revenue_cents + excluded.revenue_cents, '
+                               f'quantity = quantity + excluded.quantity, orders = orders + excluded.orders',
+                               (key + tuple(totals) for key, totals in groups.items()))
+        connection.execute(f'INSERT INTO {ROLLUP_TABLE}_runs VALUES (?, ?, ?, ?)',
+                           (datetime.now().isoformat(), len(groups), sum(totals[2] for totals in groups.values()),
+                            int(not rollup['append'])))
+        connection.execute('COMMIT')
+        return len(groups)
+
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def query_rollup(rollup_file, start_date=None, end_date=None, group_by=('region',)):
+    # Totals per group_by combination for orders dated start_date..end_date (both included, either
+    # may be left open), read from the rollup alone
+    for name in group_by:
+        if name not in ROLLUP_KEYS:
+            raise ValueError(f"cannot group by '{name}', expected some of {', '.join(ROLLUP_KEYS)}")
+    conditions, parameters = [], []
+    if start_date:
+        conditions.append('order_date >= ?')
+        parameters.append(parse_iso_date(start_date).isoformat())
+    if end_date:
+        conditions.append('order_date <= ?')
+        parameters.append(parse_iso_date(end_date).isoformat())
+
+    columns = ', '.join(group_by)
+    query = (f"SELECT {columns + ', ' if group_by else ''}SUM(revenue_cents), SUM(quantity), SUM(orders) "
+             f"FROM {ROLLUP_TABLE}{' WHERE ' + ' AND '.join(conditions) if conditions else ''}"
+             f"{' GROUP BY ' + columns + ' ORDER BY ' + columns if group_by else ''}")
+    connection = sqlite3.connect(rollup_file)
+    try:
+        rows = connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+
+    return [dict(zip(group_by, row), total_amount=round(row[-3] / 100, 2), quantity=row[-2], orders=row[-1])
+            for row in rows if row[-1]]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Grouped sales totals from the rollup store')
+    parser.add_argument('--rollups', default='../data/sales_rollups.db')
+    parser.add_argument('--from', dest='start_date', default=None, help='first order date, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end_date', default=None, help='last order date, YYYY-MM-DD')
+    parser.add_argument('--group-by', nargs='*', choices=ROLLUP_KEYS, default=['region'])
+    args = parser.parse_args()
+
+    for row in query_rollup(args.rollups, args.start_date, args.end_date, args.group_by):
+        print(row)
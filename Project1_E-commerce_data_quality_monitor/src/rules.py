@@ -0,0 +1,145 @@
+import linecache
+import re
+from date_parser import parse_iso_date
+
+# A rule is a dict with the 'rule' kind, the 'field' it reads and the reason 'bit' a failing record gets:
+#   required  the value is not empty
+#   regex     the value is not empty and 'pattern' matches at its start. 'groups' names the pattern's groups;
+#             each becomes a value of its own, converted with 'type' when one is given
+#   enum      the value is one of 'values'
+#   number    'type' (float by default) converts the value; 'min' and 'max' bound it inclusively and 'above'
+#             exclusively. A value that does not convert gets 'format_bit', or 'bit' without one.
+#   date      a valid YYYY-MM-DD date; with 'missing_bit', an empty value gets that bit instead
+#   order     the value of 'field' is not before the value of 'after'; both need a number or date rule
+#             earlier in the list, and the rule is skipped when either of them did not convert
+# 'store': True on a number or date rule puts the converted value in the valid record instead of the text,
+# and on a regex rule with 'groups' adds the group values to it.
+RULE_KINDS = ('required', 'regex', 'enum', 'number', 'date', 'order')
+
+def rule_lines(index, rule, value, converted, bound):
+    kind = rule['rule']
+    bit = rule['bit']
+
+    if kind == 'required':
+        return [f'if not {value}:', f'    code |= {bit}']
+
+    if kind == 'regex':
+        bound[f'match{index}'] = re.compile(rule['pattern']).match
+        if not rule.get('groups'):
+            return [f'if not {value} or not match{index}({value}):', f'    code |= {bit}']
+        convert = ''
+        if rule.get('type') is not None:
+            bound[f'convert{index}'] = rule['type']
+            convert = f'convert{index}'
+        lines = [f'm{index} = match{index}({value}) if {value} else None',
+                 f'if m{index} is None:',
+                 f'    code |= {bit}',
+                 'else:']
+        for position, name in enumerate(rule['groups'], 1):
+            converted[name] = f'g{index}_{position}'
+            lines.append(f'    g{index}_{position} = {convert}(m{index}.group({position}))')
+        return lines
+
+    if kind == 'enum':
+        bound[f'values{index}'] = frozenset(rule['values'])
+        return [f'if {value} not in values{index}:', f'    code |= {bit}']
+
+    if kind == 'number':
+        bound[f'convert{index}'] = rule.get('type', float)
+        number = f'n{index}'
+        converted[rule['field']] = number
+        lines = ['try:',
+                 f'    {number} = convert{index}({value})',
+                 'except ValueError:',
+                 f'    {number} = None',
+                 f"    code |= {rule.get('format_bit', bit)}"]
+        # Written as the rejecting comparisons, so NaN passes the way the hand-written checks let it
+        bounds = [f'{number} {operator} {rule[key]!r}'
+                  for key, operator in (('min', '<'), ('max', '>'), ('above', '<=')) if rule.get(key) is not None]
+        if bounds:
+            lines += ['else:', f"    if {' or '.join(bounds)}:", f'        code |= {bit}']
+        return lines
+
+    if kind == 'date':
+        parsed = f'd{index}'
+        converted[rule['field']] = parsed
+        if 'missing_bit' not in rule:
+            return [f'{parsed} = parse_date({value})', f'if {parsed} is None:', f'    code |= {bit}']
+        return [f'{parsed} = None',
+                f'if not {value}:',
+                f"    code |= {rule['missing_bit']}",
+                'else:',
+                f'    {parsed} = parse_date({value})',
+                f'    if {parsed} is None:',
+                f'        code |= {bit}']
+
+    if kind == 'order':
+        if rule['field'] not in converted or rule['after'] not in converted:
+            raise ValueError(f"order rule on '{rule['field']}' needs number or date rules on both fields first")
+        later, earlier = converted[rule['field']], converted[rule['after']]
+        return [f'if {earlier} is not None and {later} is not None and {later} < {earlier}:', f'    code |= {bit}']
+
+    raise ValueError(f"unknown rule '{kind}', expected one of {', '.join(RULE_KINDS)}")
+
+def rules_source(rules, name, record_type=None):
+    # Generated code for the rules, and the objects it refers to: compiled patterns, converters, enum sets.
+    # Each field is read from the record once, then every rule on it works on a local.
+    bound = {'parse_date': parse_iso_date}
+    values = {}
+    converted = {}
+    checks = []
+    for index, rule in enumerate(rules):
+        field = rule['field']
+        if field not in values:
+            values[field] = f'v{len(values)}'
+        checks += rule_lines(index, rule, values[field], converted, bound)
+
+    if record_type is not None:
+        # Every field of the tuple takes the converted value when a rule has one, so nothing is parsed twice
+        bound['make_record'] = record_type
+        fields = [converted.get(field) or values.get(field) or f'record[{field!r}]' for field in record_type._fields]
+        valid_record = f"make_record({', '.join(fields)})"
+    else:
+        stored = [f'{field!r}: {converted[field]}' for rule in rules if rule.get('store')
+                  for field in rule.get('groups') or (rule['field'],)]
+        valid_record = '{**record, ' + ', '.join(stored) + '}' if stored else 'record'
+
+    lines = [f'def {name}(raw_data):',
+             '    valid_data = []',
+             '    invalid_data = []',
+             '    append_valid = valid_data.append',
+             '    append_invalid = invalid_data.append']
+    # Names used in the loop are bound as locals once per call rather than looked up as globals per row
+    lines += [f'    {key} = _{key}' for key in bound]
+    lines += ['    for record in raw_data:', '        code = 0']
+    lines += [f'        {value} = record[{field!r}]' for field, value in values.items()]
+    lines += ['        ' + line for line in checks]
+    lines += ['        if code:',
+              '            append_invalid((record, code))',
+              '        else:',
+              f'            append_valid({valid_record})',
+              '    return valid_data, invalid_data']
+    return '\n'.join(lines) + '\n', {f'_{key}': value for key, value in bound.items()}
+
+def compile_rules(rules, name='validate_records', record_type=None):
+    # One function(raw_data) -> (valid_data, invalid_data) checking every rule per record in a single pass.
+    # Valid records are passed on as they are, as a copy holding the stored values, or, given a namedtuple
+    # record_type, as that tuple built from the converted values; a rejected record is passed on as it was
+    # read, paired with the OR of the bits it failed.
+    source, namespace = rules_source(rules, name, record_type)
+    file_name = f'<rules {name}>'
+    # Lets tracebacks and inspect.getsource show the generated lines
+    linecache.cache[file_name] = (len(source), None, source.splitlines(True), file_name)
+    exec(compile(source, file_name, 'exec'), namespace)
+    return namespace[name]
+
+if __name__ == '__main__':
+    demo_rules = [
+        {'rule': 'required', 'field': 'customer_name', 'bit': 1},
+        {'rule': 'date', 'field': 'order_date', 'bit': 2, 'store': True},
+        {'rule': 'number', 'field': 'quantity', 'type': int, 'above': 0, 'bit': 4, 'format_bit': 8}
+    ]
+    print(rules_source(demo_rules, 'validate_demo')[0])
+    validate_demo = compile_rules(demo_rules, 'validate_demo')
+    print(validate_demo([{'customer_name': 'Ann', 'order_date': '2024-03-15', 'quantity': '2'},
+                         {'customer_name': '', 'order_date': '2024-02-30', 'quantity': 'two'}]))
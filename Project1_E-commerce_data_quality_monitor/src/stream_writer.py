@@ -0,0 +1,193 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from compression import open_output
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OUTPUT_FORMATS = ('json', 'ndjson')
+
+def sidecar_path(output_file):
+    return output_file + '.meta.json'
+
+def temporary_path(output_file):
+    return output_file + '.tmp'
+
+def remove_temporary(path):
+    try:
+        os.remove(temporary_path(path))
+    except FileNotFoundError:
+        pass
+
+def encode_record(record):
+    # orjson gives the same compact JSON several times faster, apart from writing non-ASCII text unescaped
+    if orjson is not None:
+        return orjson.dumps(record).decode('utf-8')
+    return json.dumps(record, separators=(',', ':'))
+
+def encode_batches(batches, encode_batch, workers):
+    # Runs encode_batch(batch) -> list of encoded records in worker processes and yields the encoded records
+    # in input order. At most two batches per worker are in flight, so a chunked run stays streaming.
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            pending.append(executor.submit(encode_batch, batch))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def write_records_stream(records, output_file, metadata, records_key, count_key='total_records', output_format='json'):
+    return write_encoded_stream(map(encode_record, records), output_file, metadata, records_key, count_key,
+                                output_format)
+
+def encoded_size(encoded):
+    # Bytes the text takes in UTF-8, without encoding it when it is plain ASCII
+    return len(encoded) if encoded.isascii() else len(encoded.encode('utf-8'))
+
+def write_encoded_stream(encoded_records, output_file, metadata, records_key, count_key='total_records',
+                         output_format='json', record_offsets=None):
+    # Writes already-encoded records one by one and returns how many were written.
+    # json:   {"metadata": {..., count: null}, "<records_key>": [...], "trailer": {count: N}}
+    # ndjson: one compact record per line, full metadata (with count) in a <output_file>.meta.json sidecar
+    # Given a record_offsets list, appends (byte offset, byte length) of each record as it is written;
+    # the offsets are only of use on an uncompressed output.
+    # Both files are written to <name>.tmp and renamed over the old ones once complete, so a run that fails
+    # partway leaves the previous output in place.
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+    try:
+        total_records = write_encoded_temporary(encoded_records, output_file, metadata, records_key, count_key,
+                                                output_format, record_offsets)
+    except BaseException:
+        remove_temporary(output_file)
+        remove_temporary(sidecar_path(output_file))
+        raise
+
+    os.replace(temporary_path(output_file), output_file)
+    if output_format == 'ndjson':
+        os.replace(temporary_path(sidecar_path(output_file)), sidecar_path(output_file))
+    return total_records
+
+def write_encoded_temporary(encoded_records, output_file, metadata, records_key, count_key, output_format,
+                            record_offsets):
+    total_records = 0
+    position = 0
+    # A .gz/.bz2/.xz output name gives a compressed file; the ndjson sidecar is always plain
+    with open_output(output_file, temporary_path(output_file)) as file:
+        if output_format == 'ndjson':
+            for encoded in encoded_records:
+                file.write(encoded)
+                file.write('\n')
+                total_records += 1
+                if record_offsets is not None:
+                    size = encoded_size(encoded)
+                    record_offsets.append((position, size))
+                    position += size + 1
+        else:
+            header = dict(metadata)
+            header[count_key] = None
+            header_text = '{"metadata":' + encode_record(header) + ',\n"' + records_key + '":['
+            file.write(header_text)
+            position = encoded_size(header_text)
+            for encoded in encoded_records:
+                separator = ',\n' if total_records else '\n'
+                file.write(separator)
+                file.write(encoded)
+                total_records += 1
+                if record_offsets is not None:
+                    size = encoded_size(encoded)
+                    record_offsets.append((position + len(separator), size))
+                    position += len(separator) + size
+            file.write('\n],\n"trailer":' + encode_record({count_key: total_records}) + '}\n')
+
+    if output_format == 'ndjson':
+        sidecar = dict(metadata)
+        sidecar[count_key] = total_records
+        with open(temporary_path(sidecar_path(output_file)), 'w', encoding='utf-8') as file:
+            json.dump(sidecar, file, indent=2)
+
+    return total_records
+
+TRAILER_MARKER = b'\n],\n"trailer":'
+
+def find_trailer(file):
+    # Returns (offset of the closing "]", trailer dict). The trailer sits at the very end,
+    # so only the tail of the file is read.
+    file.seek(0, os.SEEK_END)
+    tail_start = max(file.tell() - 4096, 0)
+    file.seek(tail_start)
+    tail = file.read()
+    marker = tail.rindex(TRAILER_MARKER)
+    trailer = tail[marker + len(TRAILER_MARKER):].rstrip()[:-1]
+    return tail_start + marker, json.loads(trailer)
+
+def read_total_records(output_file, count_key='total_records', output_format='json'):
+    if output_format == 'ndjson':
+        with open(sidecar_path(output_file), 'r', encoding='utf-8') as file:
+            return json.load(file)[count_key]
+
+    with open(output_file, 'rb') as file:
+        return find_trailer(file)[1][count_key]
+
+def append_encoded_stream(encoded_records, output_file, metadata, records_key, count_key='total_records',
+                          output_format='json'):
+    # Adds records to an existing output without rewriting it and returns the new total.
+    # Starts a fresh output when there is nothing to append to. If the records run out with an error
+    # the output is put back the way it was before the error is raised again.
+    if not os.path.exists(output_file):
+        return write_encoded_stream(encoded_records, output_file, metadata, records_key, count_key, output_format)
+
+    if output_format == 'ndjson':
+        with open(sidecar_path(output_file), 'r', encoding='utf-8') as file:
+            sidecar = json.load(file)
+        total_records = sidecar[count_key]
+        with open(output_file, 'ab') as file:
+            original_size = file.tell()
+            try:
+                for encoded in encoded_records:
+                    file.write(encoded.encode('utf-8'))
+                    file.write(b'\n')
+                    total_records += 1
+            except BaseException:
+                file.truncate(original_size)
+                raise
+        sidecar[count_key] = total_records
+        with open(sidecar_path(output_file), 'w', encoding='utf-8') as file:
+            json.dump(sidecar, file, indent=2)
+        return total_records
+
+    # Cut the file just before the closing "]" and trailer, write the new records, then a new trailer
+    with open(output_file, 'r+b') as file:
+        array_end, trailer = find_trailer(file)
+        total_records = trailer[count_key]
+        file.seek(array_end)
+        original_tail = file.read()
+        file.seek(array_end)
+        file.truncate()
+        try:
+            for encoded in encoded_records:
+                file.write((',\n' if total_records else '\n').encode('utf-8'))
+                file.write(encoded.encode('utf-8'))
+                total_records += 1
+        except BaseException:
+            file.seek(array_end)
+            file.truncate()
+            file.write(original_tail)
+            raise
+        file.write(TRAILER_MARKER + encode_record({count_key: total_records}).encode('utf-8') + b'}\n')
+    return total_records
+
+if __name__ == '__main__':
+    import tempfile
+
+    sample = [{'order_id': 'ORD-001', 'quantity': 1}, {'order_id': 'ORD-002', 'quantity': 2}]
+    for output_format in OUTPUT_FORMATS:
+        path = os.path.join(tempfile.gettempdir(), f'stream_writer_demo.{output_format}')
+        count = write_records_stream(iter(sample), path, {'data_source': 'demo'}, 'sales_data', output_format=output_format)
+        print(output_format, count, read_total_records(path, output_format=output_format))
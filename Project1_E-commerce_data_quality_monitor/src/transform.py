@@ -1,20 +1,23 @@
+import sys
+from collections import namedtuple
 from datetime import datetime
+from catalog import DEFAULT_PRODUCT_INDEX
 
-def transform_sales_data(valid_data):
+# Transformed rows are tuples rather than dicts to keep memory down on large files;
+# load.py turns them back into dicts only when encoding them
+SALES_FIELDS = ('order_id', 'customer_name', 'product', 'price', 'quantity', 'total_amount', 'category',
+                'order_date', 'region', 'processed_date')
+SalesRecord = namedtuple('SalesRecord', SALES_FIELDS)
+
+def transform_sales_data(valid_data, product_index=None):
     transformed_data = []
 
-    category_map = {
-        'Electronics': {
-            'laptop': 'Laptop',
-            'wireless mouse': 'Wireless Mouse',
-            'notebook': 'Notebook',
-            'keyboard': 'Keyboard',
-            'desk lamp': 'Desk Lamp'
-        },
-        'Books': {
-            'programming book': 'Programming Book'
-        }
-    }
+    # product_index maps lower-cased product names to categories, see catalog.load_product_index
+    if product_index is None:
+        product_index = DEFAULT_PRODUCT_INDEX
+
+    # One timestamp per batch instead of one string per row
+    processed_date = datetime.now().isoformat()
 
     for record in valid_data:
         try:
@@ -22,26 +25,22 @@ def transform_sales_data(valid_data):
             quantity = int(record['quantity'])
             total_amount = round(price * quantity, 2)
 
-            product_name = record['product'].lower()
-            found_category = 'Unknown'
-
-            for main_category, sub_category in category_map.items():
-                if product_name in sub_category:
-                    found_category = main_category
-                    break
-
-            transformed_record = {
-                'order_id': record['order_id'],
-                'customer_name': record['customer_name'],
-                'product': record['product'],
-                'price': price,
-                'quantity': quantity,
-                'total_amount': total_amount,
-                'category': found_category,
-                'order_date': record['order_date'],
-                'region': record['region'],
-                'processed_date': datetime.now().isoformat()
-            }
+            product = record['product']
+            found_category = product_index.get(product.lower(), 'Unknown')
+
+            # product and region repeat across rows, interning stores each distinct value once
+            transformed_record = SalesRecord(
+                record['order_id'],
+                record['customer_name'],
+                sys.intern(product),
+                price,
+                quantity,
+                total_amount,
+                found_category,
+                record['order_date'],
+                sys.intern(record['region']),
+                processed_date
+            )
 
             transformed_data.append(transformed_record)
 
@@ -1,47 +1,171 @@
-import logging
-import re
-from calendar import prcal
-from datetime import datetime
+from functools import lru_cache
+from itertools import compress
+from date_parser import parse_iso_date
+from rules import compile_rules
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# One bit per rejection rule. A rejected row carries the OR of the bits it failed; the numbers end up
+# in dead-letter files, so a rule keeps its bit for good.
+CUSTOMER_NAME_EMPTY = 1
+ORDER_DATE_INVALID = 2
+QUANTITY_INVALID = 4
+INVALID_NUMERIC_FORMAT = 8
+DUPLICATE_ORDER_ID = 16    # set by dedup.dedup_sales_data, not by the validators
+
+VALIDATION_BACKENDS = ('rows', 'columnar')
+COLUMNAR_AVAILABLE = np is not None
+
+REJECTION_REASONS = {
+    CUSTOMER_NAME_EMPTY: 'customer_name empty',
+    ORDER_DATE_INVALID: 'order_date invalid',
+    QUANTITY_INVALID: 'quantity invalid',
+    INVALID_NUMERIC_FORMAT: 'Invalid numeric format',
+    DUPLICATE_ORDER_ID: 'order_id already loaded'
+}
+
+@lru_cache(maxsize=None)
+def rejection_text(code):
+    # Only called when rejects are written out; each distinct combination is joined once
+    return '. '.join(text for bit, text in REJECTION_REASONS.items() if code & bit)
+
+def rejection_code(text):
+    # The reverse of rejection_text, for reports written earlier
+    bits = {reason: bit for bit, reason in REJECTION_REASONS.items()}
+    return sum(bits[reason] for reason in text.split('. ') if reason)
+
+# The row-by-row checks, compiled by rules.compile_rules into validate_sales_rows
+SALES_RULES = [
+    {'rule': 'required', 'field': 'customer_name', 'bit': CUSTOMER_NAME_EMPTY},
+    {'rule': 'date', 'field': 'order_date', 'bit': ORDER_DATE_INVALID},
+    {'rule': 'number', 'field': 'quantity', 'above': 0, 'bit': QUANTITY_INVALID, 'format_bit': INVALID_NUMERIC_FORMAT}
+]
+
+# Rows are passed on as they are; a rejected one is paired with its reason bits
+validate_sales_rows = compile_rules(SALES_RULES, 'validate_sales_rows')
 
 def validate_date(date_string):
-    try:
-        datetime.strptime(date_string, '%Y-%m-%d')
-        return True
-    except ValueError:
-        return False
-
-def validate_sales_data(raw_data):
-    valid_data = []
-    invalid_data = []
-
-    for record in raw_data:
-        processed_data = record.copy()
-        is_valid = True
-        rejection_reasons = []
-
-        if not processed_data['customer_name']:
-            is_valid = False
-            rejection_reasons.append('customer_name empty')
-
-        if not validate_date(processed_data['order_date']):
-            is_valid = False
-            rejection_reasons.append('order_date invalid')
-
-        try:
-            quantity = float(processed_data['quantity'])
-
-            if quantity <= 0:
-                is_valid = False
-                rejection_reasons.append('quantity invalid')
-        except ValueError:
-            is_valid = False
-            rejection_reasons.append('Invalid numeric format')
-
-        if is_valid:
-            valid_data.append(processed_data)
-        else:
-            processed_data['rejection_reasons'] = '. '.join(rejection_reasons)
-            invalid_data.append(processed_data)
+    return parse_iso_date(date_string) is not None
+
+def validate_sales_data(raw_data, codes=None):
+    # codes: the arrays extract.extract_sales_coded_chunks pairs a chunk with, covering its rows in order
+    if codes is None:
+        return validate_sales_rows(raw_data)
+    return validate_sales_coded(raw_data, np.concatenate(codes))
+
+# The byte-level checks below settle the rows whose fields have the plain shapes SALES_RULES is written for;
+# a quantity of up to this many digits, and YYYY-MM-DD dates
+QUANTITY_DIGITS = 4
+MONTH_DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+UNDECIDED = -1
+
+def sales_block_codes(fieldnames, rows, block):
+    # Reason bits for each row of a mapped block, read as columns straight from its bytes: one row per non-empty
+    # line, fields between commas. UNDECIDED is left for the rows the bytes alone do not settle (quoted
+    # fields, a wrong number of fields, quantities like "1.5" or dates like "2024-3-5"), and for the whole
+    # block when there are no bytes to go by.
+    codes = np.full(len(rows), UNDECIDED, np.int32)
+    columns = ('customer_name', 'order_date', 'quantity')
+    if block is None or not block or any(fieldnames.count(column) != 1 for column in columns):
+        return codes
+
+    data = np.frombuffer(block, np.uint8)
+    size = len(data)
+    width = len(fieldnames)
+    # Positions of every comma and line end; the last line may have no newline
+    separators = np.flatnonzero((data == 44) | (data == 10))
+    line_ends = np.flatnonzero(data[separators] == 10)
+    if data[-1] != 10:
+        separators = np.append(separators, size)
+        line_ends = np.append(line_ends, len(separators) - 1)
+    ends = separators[line_ends]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    first = np.empty_like(line_ends)
+    first[0] = 0
+    first[1:] = line_ends[:-1] + 1
+    plain = line_ends - first == width - 1
+    if b'\r' in block:
+        # A carriage return is only dropped at the end of a line; anywhere else the row is left to the row rules
+        ends = ends - ((ends > starts) & (data[np.maximum(ends - 1, 0)] == 13))
+        returns = np.flatnonzero(data == 13)
+        returns = returns[~np.isin(returns, ends)]
+        plain[np.searchsorted(starts, returns, 'right') - 1] = False
+    if b'"' in block:
+        plain[np.searchsorted(starts, np.flatnonzero(data == 34), 'right') - 1] = False
+    lines = ends > starts
+    if np.count_nonzero(lines) != len(rows):
+        return codes
+    starts, ends, first, plain = starts[lines], ends[lines], first[lines], plain[lines]
+    last_separator = len(separators) - 1
+
+    def field(column):
+        # (start offsets, lengths) of a column; only meaningful on plain lines
+        index = fieldnames.index(column)
+        field_starts = starts if index == 0 else separators[np.minimum(first + index - 1, last_separator)] + 1
+        field_ends = ends if index == width - 1 else separators[np.minimum(first + index, last_separator)]
+        return field_starts, field_ends - field_starts
+
+    def column_byte(field_starts, offset):
+        return data[np.minimum(field_starts + offset, size - 1)]
+
+    codes[:] = 0
+    undecided = ~plain
+
+    field_starts, lengths = field('customer_name')
+    codes[lengths == 0] |= CUSTOMER_NAME_EMPTY
+
+    # The same answer as parse_iso_date's fixed-width path: year 0, month 13 or 30 February do not make a date
+    field_starts, lengths = field('order_date')
+    shaped = (lengths == 10) & (column_byte(field_starts, 4) == 45) & (column_byte(field_starts, 7) == 45)
+    digits = []
+    for offset in (0, 1, 2, 3, 5, 6, 8, 9):
+        digit = column_byte(field_starts, offset) - np.uint8(48)
+        shaped &= digit < 10
+        digits.append(digit.astype(np.int32))
+    year = digits[0] * 1000 + digits[1] * 100 + digits[2] * 10 + digits[3]
+    month = digits[4] * 10 + digits[5]
+    day = digits[6] * 10 + digits[7]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    real_month = (month >= 1) & (month <= 12)
+    month_days = np.array(MONTH_DAYS, np.int32)[np.where(real_month, month, 0)] + (leap & (month == 2))
+    real_date = (year >= 1) & real_month & (day >= 1) & (day <= month_days)
+    codes[(shaped & ~real_date) | (lengths == 0)] |= ORDER_DATE_INVALID
+    undecided |= ~shaped & (lengths != 0)
+
+    # Whole numbers are above 0 unless every digit is 0; an empty value does not convert at all
+    field_starts, lengths = field('quantity')
+    whole = (lengths >= 1) & (lengths <= QUANTITY_DIGITS)
+    zero = whole.copy()
+    for offset in range(QUANTITY_DIGITS):
+        byte = column_byte(field_starts, offset)
+        past_end = lengths <= offset
+        whole &= (byte - np.uint8(48) < 10) | past_end
+        zero &= (byte == 48) | past_end
+    codes[zero] |= QUANTITY_INVALID
+    codes[lengths == 0] |= INVALID_NUMERIC_FORMAT
+    undecided |= ~whole & (lengths != 0)
+
+    codes[undecided] = UNDECIDED
+    return codes
+
+def validate_sales_coded(raw_data, codes):
+    # validate_sales_rows' result from per-row codes; the UNDECIDED rows are run through the row rules first,
+    # which pass valid rows on as the same dicts
+    undecided = np.flatnonzero(codes == UNDECIDED).tolist()
+    if undecided:
+        valid_data, invalid_data = validate_sales_rows([raw_data[index] for index in undecided])
+        found = {id(record): code for record, code in invalid_data}
+        found.update((id(record), 0) for record in valid_data)
+        codes[undecided] = [found[id(raw_data[index])] for index in undecided]
+
+    valid_data = list(compress(raw_data, (codes == 0).tolist()))
+    rejected = np.flatnonzero(codes).tolist()
+    invalid_data = list(zip([raw_data[index] for index in rejected], codes[rejected].tolist()))
     return valid_data, invalid_data
 
 if __name__ == '__main__':
@@ -55,7 +179,9 @@ if __name__ == '__main__':
     print(f"Rejected data: {len(rejected)} records")
 
     print(f"Valid data: \n{cleaned}")
-    print(f"\nInvalid data:\n{rejected}")
+    print(f"\nInvalid data:")
+    for record, code in rejected:
+        print(record['order_id'], rejection_text(code))
 
 
 
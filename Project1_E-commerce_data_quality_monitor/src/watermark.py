@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+# Bytes hashed at the start of the file and just before the watermark to tell appends from rewrites
+FINGERPRINT_BLOCK = 64 * 1024
+
+def watermark_path(input_file):
+    return input_file + '.watermark.json'
+
+def block_sha256(file, start, end):
+    file.seek(start)
+    return hashlib.sha256(file.read(end - start)).hexdigest()
+
+def file_fingerprint(input_file, byte_offset):
+    with open(input_file, 'rb') as file:
+        return {
+            'head_sha256': block_sha256(file, 0, min(byte_offset, FINGERPRINT_BLOCK)),
+            'tail_sha256': block_sha256(file, max(byte_offset - FINGERPRINT_BLOCK, 0), byte_offset)
+        }
+
+def load_watermark(input_file):
+    try:
+        with open(watermark_path(input_file), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def output_signature(output_file):
+    # Size and mtime of the output as this run left it; any other write to it changes one of them
+    stat = os.stat(output_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def save_watermark(input_file, output_file, byte_offset, last_order_id):
+    watermark = {
+        'input_file': input_file,
+        'output_file': output_file,
+        'output': output_signature(output_file),
+        'byte_offset': byte_offset,
+        'fingerprint': file_fingerprint(input_file, byte_offset),
+        'last_order_id': last_order_id,
+        'updated_at': datetime.now().isoformat()
+    }
+    temp_file = watermark_path(input_file) + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(watermark, file, indent=2)
+    os.replace(temp_file, watermark_path(input_file))
+    return watermark
+
+def clear_watermark(input_file):
+    # For runs that rewrite the output from scratch, so no later run resumes into it
+    try:
+        os.remove(watermark_path(input_file))
+    except FileNotFoundError:
+        pass
+
+def resume_offset(input_file, output_file):
+    # Byte offset to continue from, or None when the next run has to start from scratch
+    watermark = load_watermark(input_file)
+    if not watermark:
+        return None
+
+    if watermark['output_file'] != output_file or not os.path.exists(output_file):
+        logging.info('Watermark belongs to another output, running full load')
+        return None
+
+    if watermark.get('output') != output_signature(output_file):
+        logging.info(f'{output_file} was written since the watermark, running full load')
+        return None
+
+    byte_offset = watermark['byte_offset']
+    if os.path.getsize(input_file) < byte_offset:
+        logging.info(f'{input_file} is smaller than the watermark, it was rewritten. Running full load')
+        return None
+
+    if file_fingerprint(input_file, byte_offset) != watermark['fingerprint']:
+        logging.info(f'{input_file} changed before the watermark, it was rewritten. Running full load')
+        return None
+
+    logging.info(f"Resuming after order {watermark['last_order_id']} at byte {byte_offset}")
+    return byte_offset
+
+if __name__ == '__main__':
+    print(load_watermark('../data/daily_sales.csv'))
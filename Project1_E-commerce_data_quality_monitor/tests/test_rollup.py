@@ -0,0 +1,62 @@
+import os
+import shutil
+import sqlite3
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+DATA_DIR = os.path.join(SRC_DIR, '..', 'data')
+sys.path.insert(0, SRC_DIR)
+
+
+def run_sqlite_load(monkeypatch, tmp_path, input_file, chunk_size=None):
+    # main.py logs to etl_pipeline.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    from main import run_etl_pipeline
+    return run_etl_pipeline(input_file, str(tmp_path / 'sales.db'), str(tmp_path / 'report.json'),
+                            chunk_size=chunk_size, output_format='sqlite', dead_letter_file=None,
+                            rollup_file=str(tmp_path / 'rollups.db'))
+
+
+def sales_totals(tmp_path):
+    with sqlite3.connect(tmp_path / 'sales.db') as connection:
+        return connection.execute('SELECT region, ROUND(SUM(total_amount), 2), SUM(quantity), COUNT(*) '
+                                  'FROM sales GROUP BY region ORDER BY region').fetchall()
+
+
+def rollup_totals(tmp_path):
+    from rollup import query_rollup
+    return [(row['region'], row['total_amount'], row['quantity'], row['orders'])
+            for row in query_rollup(str(tmp_path / 'rollups.db'))]
+
+
+def test_loading_the_same_file_twice_leaves_the_rollup_unchanged(monkeypatch, tmp_path):
+    input_file = str(tmp_path / 'daily_sales.csv')
+    shutil.copy(os.path.join(DATA_DIR, 'daily_sales.csv'), input_file)
+
+    assert run_sqlite_load(monkeypatch, tmp_path, input_file)
+    first = rollup_totals(tmp_path)
+    assert run_sqlite_load(monkeypatch, tmp_path, input_file)
+
+    from rollup import query_rollup
+    assert rollup_totals(tmp_path) == first == sales_totals(tmp_path)
+    [overall] = query_rollup(str(tmp_path / 'rollups.db'), group_by=())
+    assert overall['orders'] == 4
+    assert overall['total_amount'] == 1225.44
+
+
+def test_reloaded_orders_move_to_their_new_group(monkeypatch, tmp_path):
+    header = 'order_id,customer_name,product,price,quantity,order_date,region\n'
+    first_file, second_file = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    with open(first_file, 'w', encoding='utf-8') as file:
+        file.write(header + 'ORD-001,Ann Lee,Laptop,999.99,1,2024-03-15,Boston\n'
+                            'ORD-002,Bob Ray,Notebook,5.99,2,2024-03-15,Boston\n')
+    # ORD-001 comes back in another region, and twice in one batch
+    with open(second_file, 'w', encoding='utf-8') as file:
+        file.write(header + 'ORD-001,Ann Lee,Laptop,999.99,1,2024-03-15,Chicago\n'
+                            'ORD-003,Cy Poe,Notebook,5.99,3,2024-03-16,Boston\n'
+                            'ORD-001,Ann Lee,Laptop,999.99,2,2024-03-15,Chicago\n')
+
+    assert run_sqlite_load(monkeypatch, tmp_path, first_file)
+    assert run_sqlite_load(monkeypatch, tmp_path, second_file, chunk_size=2)
+
+    assert rollup_totals(tmp_path) == sales_totals(tmp_path) == [('Boston', 29.95, 5, 2), ('Chicago', 1999.98, 2, 1)]
@@ -0,0 +1,115 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from extract import extract_patient_data
+from validate import validate_patient_data
+from transform import transform_patient_data
+from load import save_patient_records, generate_medical_report
+from metrics import start_metrics, stage, metrics_summary
+from generate_data import DATASET_SIZES, generate_patient_file, parse_rows
+
+BASELINE_FILE = '../data/benchmark_baseline.json'
+
+def run_stages(input_file, work_dir):
+    metrics = start_metrics('patients')
+    with stage(metrics, 'extract_patient_data') as current:
+        data = extract_patient_data(input_file)
+        current['records'] = len(data)
+    with stage(metrics, 'validate_patient_data') as current:
+        cleaned, rejected = validate_patient_data(data)
+        current['records'] = len(data)
+    with stage(metrics, 'transform_patient_data') as current:
+        transformed = transform_patient_data(cleaned)
+        current['records'] = len(cleaned)
+    with stage(metrics, 'save_patient_records') as current:
+        save_patient_records(transformed, input_file, os.path.join(work_dir, 'clean_records.json'))
+        current['records'] = len(transformed)
+    with stage(metrics, 'generate_medical_report') as current:
+        generate_medical_report(data, cleaned, rejected, input_file, os.path.join(work_dir, 'medical_quality_report.json'))
+        current['records'] = len(data)
+    return metrics_summary(metrics)['stages']
+
+def run_benchmark(input_file, repeats=3):
+    # Keeps the fastest run of each stage, which is the least disturbed by other load on the machine
+    best = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(repeats):
+            for name, values in run_stages(input_file, work_dir).items():
+                if name not in best or values['wall_seconds'] < best[name]['wall_seconds']:
+                    best[name] = values
+    return {
+        name: {'wall_seconds': values['wall_seconds'], 'records': values['records'],
+               'records_per_second': values['records_per_second']}
+        for name, values in best.items()
+    }
+
+def load_baseline(baseline_file):
+    if not os.path.exists(baseline_file):
+        return {}
+    with open(baseline_file, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_baseline(baseline_file, dataset, results):
+    baseline = load_baseline(baseline_file)
+    baseline[dataset] = {'recorded_at': datetime.now().isoformat(), 'stages': results}
+    with open(baseline_file, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, indent=2)
+
+def compare_to_baseline(results, baseline_stages, tolerance=0.15):
+    regressions = []
+    for name, values in results.items():
+        if name not in baseline_stages:
+            continue
+        before = baseline_stages[name]['wall_seconds']
+        after = values['wall_seconds']
+        change = (after - before) / before if before > 0 else 0.0
+        status = 'REGRESSION' if change > tolerance else 'ok'
+        logging.info(f"{name}: {before:.4f}s -> {after:.4f}s ({change:+.1%}) {status}")
+        if status == 'REGRESSION':
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Time each patient pipeline stage and compare against a baseline')
+    parser.add_argument('--rows', type=parse_rows, default='100k',
+                        help=f"row count or one of {', '.join(DATASET_SIZES)}")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--input', default=None, help='benchmark an existing CSV instead of a generated one')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='slowdown allowed per stage before it counts as a regression')
+    args = parser.parse_args()
+
+    input_file = args.input or f'../data/generated/patient_record_{args.rows}.csv'
+    if not args.input and not os.path.exists(input_file):
+        generate_patient_file(input_file, args.rows, args.seed)
+    dataset = os.path.basename(input_file)
+
+    # The pipeline modules log every step; only the benchmark's own lines are wanted here
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmark(input_file, args.repeats)
+    logging.getLogger().setLevel(logging.INFO)
+
+    for name, values in results.items():
+        logging.info(f"{name}: {values['wall_seconds']:.4f}s, {values['records_per_second']} records/s")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, dataset, results)
+        logging.info(f"Saved baseline for {dataset} to {args.baseline}")
+        exit(0)
+
+    baseline = load_baseline(args.baseline).get(dataset)
+    if baseline is None:
+        logging.warning(f"No baseline for {dataset} in {args.baseline}, run with --save-baseline first")
+        exit(0)
+
+    regressions = compare_to_baseline(results, baseline['stages'], args.tolerance)
+    if regressions:
+        logging.error(f"Slower than baseline: {', '.join(regressions)}")
+        exit(1)
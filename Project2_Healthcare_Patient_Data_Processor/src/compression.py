@@ -0,0 +1,171 @@
+import bz2
+import codecs
+import gzip
+import lzma
+import mmap
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+# name: (file extensions, magic bytes at the start of the file, opener)
+COMPRESSIONS = {
+    'gzip': (('.gz',), b'\x1f\x8b', gzip.open),
+    'bz2': (('.bz2',), b'BZh', bz2.open),
+    'xz': (('.xz', '.lzma'), b'\xfd7zXZ\x00', lzma.open)
+}
+COMPRESSION_EXTENSIONS = {name: extensions[0] for name, (extensions, _, _) in COMPRESSIONS.items()}
+
+# gzip level 9 is several times slower than 6 for a few percent smaller files
+OUTPUT_OPTIONS = {'gzip': {'compresslevel': 6}, 'bz2': {}, 'xz': {}}
+
+# Multi-member gzip files are split into about this many segments per thread
+SEGMENTS_PER_WORKER = 4
+GZIP_MEMBER_MAGIC = b'\x1f\x8b\x08'
+
+def compression_from_name(file_path):
+    for name, (extensions, _, _) in COMPRESSIONS.items():
+        if file_path.endswith(extensions):
+            return name
+    return None
+
+def detect_compression(file_path):
+    # The extension decides when there is one, otherwise the first bytes of the file
+    name = compression_from_name(file_path)
+    if name:
+        return name
+    with open(file_path, 'rb') as file:
+        head = file.read(6)
+    for name, (_, magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+def is_gzip_header(data, position):
+    # Magic, deflate method, no reserved flag bits and a known extra-flags value: random bytes inside
+    # compressed data almost never pass all of these
+    header = data[position:position + 10]
+    return (len(header) == 10 and header[:3] == GZIP_MEMBER_MAGIC and not header[3] & 0xe0
+            and header[8] in (0, 2, 4))
+
+def find_gzip_header(data, start):
+    position = data.find(GZIP_MEMBER_MAGIC, start)
+    while position != -1 and not is_gzip_header(data, position):
+        position = data.find(GZIP_MEMBER_MAGIC, position + 1)
+    return position
+
+def gzip_segments(data, segments):
+    # Cuts the file at gzip member headers into roughly equal segments. A header-looking byte
+    # sequence inside compressed data is caught later, when its segment fails to decompress.
+    target = max(len(data) // segments, 1)
+    boundaries = [0]
+    position = find_gzip_header(data, target)
+    while position != -1:
+        boundaries.append(position)
+        position = find_gzip_header(data, position + target)
+    boundaries.append(len(data))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def decompress_gzip_members(data):
+    # Decompresses one or more complete gzip members; raises zlib.error if the data ends mid-member
+    blocks = []
+    while data:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        blocks.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise zlib.error('gzip member is cut short')
+        data = decompressor.unused_data
+    return b''.join(blocks)
+
+def stream_gzip_members(data, start, block_size=1 << 20):
+    # Serial decompression from start to the end of the data, one input block at a time
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    for position in range(start, len(data), block_size):
+        block = data[position:position + block_size]
+        while block:
+            yield decompressor.decompress(block)
+            block = b''
+            if decompressor.eof:
+                block = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+def decompress_gzip_parallel(data, workers):
+    # Yields decompressed blocks in file order. zlib releases the GIL, so threads decompress
+    # segments side by side, at most `workers` segments ahead of the consumer.
+    segments = iter(gzip_segments(data, workers * SEGMENTS_PER_WORKER))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def read_ahead(count):
+            for start, end in islice(segments, count):
+                pending.append((start, executor.submit(decompress_gzip_members, data[start:end])))
+
+        read_ahead(workers)
+        while pending:
+            start, future = pending.popleft()
+            try:
+                block = future.result()
+            except zlib.error:
+                # A false member boundary: everything before start was whole members, finish serially
+                for _, later in pending:
+                    later.cancel()
+                yield from stream_gzip_members(data, start)
+                return
+            read_ahead(1)
+            yield block
+
+def decoded_lines(blocks):
+    # Splits decoded text into lines on '\n' only, as open(..., newline='') does, for the csv module
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for block in blocks:
+        lines = (pending + decoder.decode(block)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+@contextmanager
+def open_input(file_path, workers=None):
+    # Opens a CSV for reading as lines of text, decompressing gzip, bz2 and xz on the fly.
+    # Gzip files made of several members (pigz, concatenated .gz files) are decompressed in parallel.
+    compression = detect_compression(file_path)
+    if compression is None:
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            yield file
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if compression == 'gzip' and workers > 1 and os.path.getsize(file_path) > 0:
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if find_gzip_header(data, 1) != -1:
+                yield decoded_lines(decompress_gzip_parallel(data, workers))
+                return
+
+    opener = COMPRESSIONS[compression][2]
+    with opener(file_path, 'rt', encoding='utf-8', newline='') as file:
+        yield file
+
+def open_output(file_path, write_path=None):
+    # Opens an output for writing text, compressed when the name ends in .gz, .bz2 or .xz. Newlines are
+    # written as they are on every platform, so byte offsets worked out from the text hold.
+    # write_path is where the bytes go when that is not file_path, e.g. a file renamed to it once complete.
+    compression = compression_from_name(file_path)
+    if compression is None:
+        return open(write_path or file_path, 'w', encoding='utf-8', newline='')
+    opener = COMPRESSIONS[compression][2]
+    return opener(write_path or file_path, 'wt', encoding='utf-8', newline='', **OUTPUT_OPTIONS[compression])
+
+if __name__ == '__main__':
+    import tempfile
+
+    path = os.path.join(tempfile.gettempdir(), 'compression_demo.csv.gz')
+    with open(path, 'wb') as file:
+        for part in range(3):
+            file.write(gzip.compress(f'part {part}\n'.encode('utf-8')))
+    with open_input(path, workers=2) as lines:
+        print(detect_compression(path), list(lines))
@@ -0,0 +1,37 @@
+from datetime import datetime, date
+from functools import lru_cache
+
+# Daily files only hold a few hundred distinct dates, so a small cache catches nearly every lookup
+DATE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_iso_date(value):
+    # Returns a date for a valid YYYY-MM-DD string and None otherwise.
+    # Fixed-width values skip strptime; anything else still gets strptime's exact rules.
+    if len(value) == 10 and value[4] == '-' and value[7] == '-' and value.isascii():
+        year, month, day = value[:4], value[5:7], value[8:]
+        if year.isdigit() and month.isdigit() and day.isdigit():
+            try:
+                return date(int(year), int(month), int(day))
+            except ValueError:
+                return None
+
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def parse_iso_dates(values):
+    # Parses a whole column, touching each distinct value only once
+    parsed = {}
+    for value in values:
+        if value not in parsed:
+            parsed[value] = parse_iso_date(value)
+    return [parsed[value] for value in values]
+
+def date_cache_info():
+    return parse_iso_date.cache_info()
+
+if __name__ == '__main__':
+    print(parse_iso_dates(['2024-03-15', '2024-02-30', '2024-3-5', '2024-03-15', 'x']))
+    print(date_cache_info())
@@ -2,6 +2,7 @@ from datetime import datetime, date
 import json
 import re
 import logging
+from validate import rejection_text
 
 medical_metadata = {
         "facility_name": "HealthCare Plus Hospital",
@@ -77,6 +78,8 @@ def save_patient_records(transformed_data, input_file, output_file):
                     break
 
         for record in transformed_data:
+            # transform_patient_data returns PatientRecord tuples
+            record = record._asdict()
             final_score = data_quality_score(record)
             metadata_patient['patient_records'].append({
                 'patient_id': record['patient_id'],
@@ -200,7 +203,8 @@ def generate_medical_report(all_data, valid_data, invalid_data, input_file, repo
 
 
         invalid_records_detail = []
-        for invalid_record in invalid_data:
+        for invalid_record, code in invalid_data:
+            invalid_record = dict(invalid_record)
             admission_date = invalid_record['admission_date']
             discharge_date = invalid_record['discharge_date']
 
@@ -247,7 +251,7 @@ def generate_medical_report(all_data, valid_data, invalid_data, input_file, repo
                 'patient_id': invalid_record.get('patient_id', 'N/A'),
                 'error_severity': severity,
                 'clinical_impact': impact,
-                'errors': errors_list if errors_list else [invalid_record.get('rejection_reasons', 'N/A')],
+                'errors': errors_list if errors_list else [rejection_text(code) or 'N/A'],
                 'recommended_action': action
             })
 
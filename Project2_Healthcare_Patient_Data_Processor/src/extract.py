@@ -1,9 +1,11 @@
 import logging
 import csv
+from itertools import islice
+from compression import open_input
 
 def extract_patient_data(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
+        with open_input(file_path) as file:
             reader = csv.DictReader(file)
             data = list(reader)
         logging.info(f"Successfully extract {len(data)} records")
@@ -15,6 +17,30 @@ def extract_patient_data(file_path):
         logging.error(f"Extraction failed: {e}")
         return []
 
+def extract_patient_data_chunks(file_path, chunk_size=10000):
+    # Yields lists of at most chunk_size rows so the whole file is never held in memory
+    total_records = 0
+    try:
+        with open_input(file_path) as file:
+            reader = csv.DictReader(file)
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                total_records += len(chunk)
+                yield chunk
+        logging.info(f"Successfully extract {total_records} records")
+    except FileNotFoundError:
+        logging.error(f"File {file_path} not found")
+        raise
+    except Exception as e:
+        # Raised on so a chunked run fails instead of writing out the rows read so far as complete
+        logging.error(f"Extraction failed: {e}")
+        raise
+
 if __name__ == '__main__':
     extraction = extract_patient_data('../data/patient_record.csv')
-    print(extraction)
\ No newline at end of file
+    print(extraction)
+
+    for chunk in extract_patient_data_chunks('../data/patient_record.csv', chunk_size=3):
+        print(f"Chunk of {len(chunk)} records")
\ No newline at end of file
@@ -0,0 +1,126 @@
+import argparse
+import csv
+import logging
+import os
+import random
+from datetime import date, timedelta
+
+FIELDNAMES = ['patient_id', 'patient_name', 'age', 'gender', 'diagnosis', 'admission_date', 'discharge_date',
+              'blood_pressure', 'temperature', 'treatment_cost', 'doctor']
+
+DATASET_SIZES = {'100k': 100000, '1M': 1000000, '10M': 10000000}
+
+# Chance per row of each problem validate_patient_data rejects; a row can get several
+ERROR_RATES = {
+    'patient_id invalid format': 0.01,
+    'patient_name cannot be null': 0.01,
+    'age not realistic': 0.01,
+    'Age value error': 0.005,
+    'gender invalid': 0.005,
+    'admission_date must be filled': 0.005,
+    'admission_date invalid format': 0.005,
+    'discharge_date must be filled': 0.005,
+    'discharge_date invalid format': 0.005,
+    'discharge_date cannot be before admission_date': 0.005,
+    'treatment_cost must be paid': 0.01,
+    'treatment_cost invalid format': 0.005,
+    'blood_pressure invalid format': 0.005,
+    'temperature invalid format': 0.01
+}
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'David', 'Eva', 'Frank', 'Grace', 'Henry', 'Ivy', 'Jack']
+LAST_NAMES = ['Johnson', 'Wilson', 'Davis', 'Miller', 'Martinez', 'Thompson', 'Moore', 'Taylor', 'Clark', 'Lee']
+DIAGNOSES = ['Hypertension', 'Diabetes', 'Asthma', 'Influenza', 'Arthritis', 'Migraine', 'Bronchitis']
+DOCTORS = ['Dr. Smith', 'Dr. Brown', 'Dr. Lee', 'Dr. Wilson', 'Dr. Garcia', 'Dr. Kim', 'Dr. Patel']
+BAD_DATES = ['2024-02-30', '2024-01-32', '10/03/2024']
+START_DATE = date(2024, 1, 1)
+
+def generate_patient_rows(rows, seed=42, error_rates=None):
+    rates = dict(ERROR_RATES, **(error_rates or {}))
+    rng = random.Random(seed)
+    for index in range(1, rows + 1):
+        # validate_patient_data only accepts three-digit ids, so large files reuse them
+        patient_id = f'PT-{(index - 1) % 999 + 1:03d}'
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        age = str(rng.randint(1, 95))
+        gender = rng.choice('FM')
+        admission = START_DATE + timedelta(days=rng.randrange(366))
+        discharge = admission + timedelta(days=rng.randint(0, 14))
+        admission_date = admission.isoformat()
+        discharge_date = discharge.isoformat()
+        blood_pressure = f'{rng.randint(90, 199)}/{rng.randint(60, 99)}'
+        temperature = f'{rng.uniform(35.5, 41.0):.1f}'
+        treatment_cost = str(rng.randrange(100000, 5000000, 50000))
+
+        if rng.random() < rates['patient_id invalid format']:
+            patient_id = f'PT-{rng.randint(1000, 99999)}'
+        if rng.random() < rates['patient_name cannot be null']:
+            name = ''
+        if rng.random() < rates['age not realistic']:
+            age = str(rng.choice([-1, 121, 150]))
+        elif rng.random() < rates['Age value error']:
+            age = rng.choice(['', 'forty', '45.5'])
+        if rng.random() < rates['gender invalid']:
+            gender = rng.choice(['', 'X', 'f'])
+        if rng.random() < rates['admission_date must be filled']:
+            admission_date = ''
+        elif rng.random() < rates['admission_date invalid format']:
+            admission_date = rng.choice(BAD_DATES)
+        if rng.random() < rates['discharge_date must be filled']:
+            discharge_date = ''
+        elif rng.random() < rates['discharge_date invalid format']:
+            discharge_date = rng.choice(BAD_DATES)
+        elif rng.random() < rates['discharge_date cannot be before admission_date']:
+            discharge_date = (admission - timedelta(days=rng.randint(1, 10))).isoformat()
+        if rng.random() < rates['treatment_cost must be paid']:
+            treatment_cost = rng.choice(['0', '-500000'])
+        elif rng.random() < rates['treatment_cost invalid format']:
+            treatment_cost = rng.choice(['', 'free'])
+        if rng.random() < rates['blood_pressure invalid format']:
+            blood_pressure = rng.choice(['', '120-80', 'high'])
+        if rng.random() < rates['temperature invalid format']:
+            temperature = rng.choice(['34.0', '43.5', 'warm'])
+
+        yield [patient_id, name, age, gender, rng.choice(DIAGNOSES), admission_date, discharge_date, blood_pressure,
+               temperature, treatment_cost, rng.choice(DOCTORS)]
+
+def generate_patient_file(output_file, rows, seed=42, error_rates=None):
+    try:
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(FIELDNAMES)
+            writer.writerows(generate_patient_rows(rows, seed, error_rates))
+
+        logging.info(f'Generated {rows} patient rows in {output_file}')
+        return True
+
+    except Exception as e:
+        logging.error(f"Error generating {output_file}: {e}")
+        return False
+
+def parse_rows(value):
+    return DATASET_SIZES[value] if value in DATASET_SIZES else int(value)
+
+def parse_error_rate(value):
+    reason, rate = value.rsplit('=', 1)
+    if reason not in ERROR_RATES:
+        raise argparse.ArgumentTypeError(f"unknown rejection reason '{reason}'")
+    return reason, float(rate)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Generate a synthetic patient_record.csv')
+    parser.add_argument('--rows', type=parse_rows, default='100k',
+                        help=f"row count or one of {', '.join(DATASET_SIZES)}")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--error-rate', type=parse_error_rate, action='append', default=[],
+                        help="override one rejection rate, e.g. 'age not realistic=0.1'")
+    parser.add_argument('--output', default=None,
+                        help='defaults to ../data/generated/patient_record_<rows>.csv')
+    args = parser.parse_args()
+
+    output_file = args.output or f'../data/generated/patient_record_{args.rows}.csv'
+    success = generate_patient_file(output_file, args.rows, args.seed, dict(args.error_rate))
+    if not success:
+        exit(1)
@@ -1,7 +1,20 @@
+from collections import Counter
 from datetime import datetime, date
 import json
+import random
 import re
 import logging
+from itertools import chain
+from stream_writer import write_encoded_stream, encode_record, encode_batches
+from compression import compression_from_name
+from patient_index import start_patient_index, index_batches, finish_patient_index, close_patient_index
+from columnar_writer import COLUMNAR_FORMAT, write_columnar
+from sqlite_writer import SQLITE_FORMAT, write_sqlite
+from validate import rejection_text, REJECTION_REASONS, PATIENT_NAME_MISSING, AGE_NOT_REALISTIC, AGE_VALUE_ERROR
+from validate import GENDER_INVALID, ADMISSION_DATE_MISSING, ADMISSION_DATE_INVALID, DISCHARGE_DATE_MISSING
+from validate import DISCHARGE_DATE_INVALID, DISCHARGE_BEFORE_ADMISSION, TREATMENT_COST_NOT_PAID, TREATMENT_COST_INVALID
+from validate import BLOOD_PRESSURE_INVALID, TEMPERATURE_INVALID
+from transform import PatientRecord
 
 medical_metadata = {
         "facility_name": "HealthCare Plus Hospital",
@@ -14,222 +27,378 @@ medical_metadata = {
     }
 
 
-def data_quality_score(record):
-
-    null = 0
-    not_null = 0
-    for head, value in record.items():
-        if value is None or value == "" or (isinstance(value, str) and value.strip() == ""):
-            null += 1
-        else:
-            not_null += 1
-    total_fields_checked = null + not_null
-    score = (not_null - null) / total_fields_checked
-
-    return round(score,3)
-
-def save_patient_records(transformed_data, input_file, output_file):
+def quality_label(record):
+    # 'Excellent' when every field is filled in, 'Bad' at the first missing or blank one
+    if None in record:
+        return 'Bad'
+    for value in record:
+        if isinstance(value, str) and not value.strip():
+            return 'Bad'
+    return 'Excellent'
+
+def build_patient_metadata(input_file, total_records):
+    metadata = {
+        'export_timestamp': datetime.now().isoformat(),
+        'total_record': total_records,
+        'data_source': '',
+        'facility_name': '',
+        'department': '',
+        'data_sensitivity': '',
+        'processing_version': '1.0',
+        'data_retention_years': None
+    }
 
-    try:
-        metadata_patient = {
-            'metadata': {
-                'export_timestamp': datetime.now().isoformat(),
-                'total_record': len(transformed_data),
-                'data_source': '',
-                'facility_name': '',
-                'department': '',
-                'data_sensitivity': '',
-                'processing_version': '1.0',
-                'data_retention_years': None
-            },
-            'patient_records': []
+    match_data_source = re.search(r"[a-zA-Z0-9_-]+\.csv", input_file)
+    if match_data_source:
+        metadata['data_source'] = match_data_source.group(0)
+    else:
+        metadata['data_source'] = 'File not found'
+
+    for head, value in medical_metadata.items():
+        for record in metadata:
+            if record in head:
+                metadata[record] = value
+                break
+
+    return metadata
+
+def build_patient_record(record, processed_at=None):
+    # record is a transform.PatientRecord; every value in it was worked out once, upstream
+    if processed_at is None:
+        processed_at = datetime.now().isoformat()
+    return {
+        'patient_id': record.patient_id,
+        'patient_name': record.patient_name,
+        'demographics': {
+            'age': record.age,
+            'age_group': record.age_group,
+            'gender': record.gender
+        },
+        'medical_info': {
+            'diagnosis': record.diagnosis,
+            'blood_pressure': record.blood_pressure,
+            'bp_category': record.bp_category,
+            'temperature': record.temperature,
+            'temperature_status': record.temperature_status
+        },
+        'treatment_details': {
+            'admission_date': record.admission_date,
+            'discharge_date': record.discharge_date,
+            'length_of_stay': record.length_of_stay,
+            'doctor': record.doctor,
+            'treatment_cost': record.treatment_cost,
+            'cost_category': record.cost_category
+        },
+        'processing_info': {
+            'processed_at': processed_at,
+            'data_quality_score': quality_label(record)
         }
+    }
 
-        match_data_source = re.search(r"[a-zA-Z0-9_-]+\.csv", input_file)
-        if match_data_source:
-            metadata_patient['metadata']['data_source'] = match_data_source.group(0)
+# Kind of each field of build_patient_record's output, flattened, in columnar output; labels and
+# names that repeat across patients are dictionary-encoded
+PATIENT_COLUMN_KINDS = {
+    'patient_id': 'string',
+    'patient_name': 'string',
+    'age': 'int',
+    'age_group': 'dictionary',
+    'gender': 'dictionary',
+    'diagnosis': 'dictionary',
+    'blood_pressure': 'string',
+    'bp_category': 'dictionary',
+    'temperature': 'float',
+    'temperature_status': 'dictionary',
+    'admission_date': 'date',
+    'discharge_date': 'date',
+    'length_of_stay': 'int',
+    'doctor': 'dictionary',
+    'treatment_cost': 'float',
+    'cost_category': 'dictionary',
+    'processed_at': 'string',
+    'data_quality_score': 'dictionary'
+}
+
+# Indexed in SQLite output once the rows are loaded
+PATIENT_INDEX_COLUMNS = ('admission_date', 'doctor')
+
+# Columns of patient_record.csv, kept for rejected rows in SQLite output
+PATIENT_CSV_FIELDS = ('patient_id', 'patient_name', 'age', 'gender', 'diagnosis', 'admission_date', 'discharge_date',
+                      'blood_pressure', 'temperature', 'treatment_cost', 'doctor')
+
+def flatten_patient_record(record, processed_at=None):
+    # build_patient_record's output as one tuple in PATIENT_COLUMN_KINDS order, without building the dicts.
+    # PatientRecord already holds every field but the processing info, in that order.
+    if processed_at is None:
+        processed_at = datetime.now().isoformat()
+    return record + (processed_at, quality_label(record))
+
+# Records encoded per batch, and per worker task with --serialize-workers
+SERIALIZE_BATCH_SIZE = 10000
+
+def patient_batches(transformed_chunks, batch_size=SERIALIZE_BATCH_SIZE):
+    # A serial run hands over every record in one list; cut it up so it can be spread over workers
+    for chunk in transformed_chunks:
+        for start in range(0, len(chunk), batch_size):
+            yield chunk[start:start + batch_size]
+
+def flatten_patient_batch(records):
+    processed_at = datetime.now().isoformat()
+    return [flatten_patient_record(record, processed_at) for record in records]
+
+def encode_patient_batch(records):
+    # One processed_at per batch rather than one clock read per record
+    processed_at = datetime.now().isoformat()
+    return [encode_record(build_patient_record(record, processed_at)) for record in records]
+
+def encode_patient_rows(rows):
+    # The worker side of --serialize-workers. Workers are sent plain tuples, which pickle in about half the
+    # time PatientRecords take, and rebuild the records here.
+    return encode_patient_batch(list(map(PatientRecord._make, rows)))
+
+def save_patient_records(transformed_data, input_file, output_file, output_format='json', rejected=None, workers=0,
+                         index_file=None):
+    # SQLite output empties the rejected list it is given; the caller's list still goes into the report
+    rejected = list(rejected) if rejected is not None else None
+    return save_patient_records_chunks([transformed_data], input_file, output_file, output_format, rejected, workers,
+                                       index_file)
+
+def save_patient_records_chunks(transformed_chunks, input_file, output_file, output_format='json', rejected=None,
+                                workers=0, index_file=None):
+    # `rejected` is only used by SQLite output, which stores rejected rows in their own table.
+    # With workers, json and ndjson records are encoded in that many processes and written in input order.
+    # With index_file, uncompressed json and ndjson output gets the lookup index of patient_index.py.
+    index = None
+    try:
+        if output_format == SQLITE_FORMAT:
+            # Kept chunk by chunk so rejected rows are written as they come in.
+            # Upserts are keyed on patient_id, so a patient's latest admission in the input is the one kept.
+            rows = map(flatten_patient_batch, transformed_chunks)
+            total_records = write_sqlite(rows, output_file, 'patients', PATIENT_COLUMN_KINDS, 'patient_id',
+                                         PATIENT_INDEX_COLUMNS, build_patient_metadata(input_file, None), rejected,
+                                         PATIENT_CSV_FIELDS, rejection_text, count_key='total_record')
+            logging.info(f"Successfully saved {total_records} records")
+            return True
+
+        batches = patient_batches(transformed_chunks)
+        if output_format == COLUMNAR_FORMAT:
+            total_records = write_columnar(chain.from_iterable(map(flatten_patient_batch, batches)), output_file,
+                                           build_patient_metadata(input_file, None), PATIENT_COLUMN_KINDS,
+                                           count_key='total_record')
         else:
-            metadata_patient['metadata']['data_source'] = 'File not found'
-
-        for head, value in medical_metadata.items():
-            for record in metadata_patient['metadata']:
-                if record in head:
-                    metadata_patient['metadata'][record] = value
-                    break
-
-        for record in transformed_data:
-            final_score = data_quality_score(record)
-            metadata_patient['patient_records'].append({
-                'patient_id': record['patient_id'],
-                'patient_name': record['patient_name'],
-                'demographics': {
-                    'age': record['age'],
-                    'age_group': record['age_group'],
-                    'gender': record['gender']
-                },
-                'medical_info': {
-                    'diagnosis': record['diagnosis'],
-                    'blood_pressure': record['blood_pressure'],
-                    'bp_category': record['bp_category'],
-                    'temperature': record['temperature'],
-                    'temperature_status': 'Hypothermia' if record['temperature'] < 35 else 'Fever' if record['temperature'] > 37.5 else 'Low' if 35 <= record['temperature'] <= 36 else 'Normal' if 36 < record['temperature'] <= 37.5 else None
-                },
-                'treatment_details': {
-                    'admission_date': record['admission_date'],
-                    'discharge_date': record['discharge_date'],
-                    'length_of_stay': record['length_of_stay'],
-                    'doctor': record['doctor'],
-                    'treatment_cost': record['treatment_cost'],
-                    'cost_category': record['cost_category']
-                },
-                'processing_info': {
-                    'processed_at': datetime.now().isoformat(),
-                    'data_quality_score': 'Excellent' if final_score >= 1 else 'Bad'
-                }
-            })
-
-
-        with open(output_file, 'w', encoding='utf-8') as file:
-            json.dump(metadata_patient, file ,indent=2)
+            if index_file and compression_from_name(output_file):
+                logging.warning(f"Records in compressed output cannot be looked up, not indexing {output_file}")
+            elif index_file:
+                index = start_patient_index(index_file, output_file)
+                batches = index_batches(index, batches)
+            if workers:
+                rows = (list(map(tuple, batch)) for batch in batches)
+                encoded = encode_batches(rows, encode_patient_rows, workers)
+            else:
+                encoded = chain.from_iterable(map(encode_patient_batch, batches))
+            total_records = write_encoded_stream(encoded, output_file, build_patient_metadata(input_file, None),
+                                                 'patient_records', count_key='total_record',
+                                                 output_format=output_format,
+                                                 record_offsets=index['offsets'] if index else None)
+            if index is not None:
+                finish_patient_index(index, output_format, total_records)
+                logging.info(f"Indexed {total_records} records in {index_file}")
+        logging.info(f"Successfully saved {total_records} records")
         return True
     except Exception as e:
         logging.error(f"Error: {e}")
         return False
+    finally:
+        if index is not None:
+            close_patient_index(index)
+
+AGE_BITS = AGE_NOT_REALISTIC | AGE_VALUE_ERROR
+DATE_BITS = (ADMISSION_DATE_MISSING | ADMISSION_DATE_INVALID | DISCHARGE_DATE_MISSING | DISCHARGE_DATE_INVALID
+             | DISCHARGE_BEFORE_ADMISSION)
+COST_BITS = TREATMENT_COST_NOT_PAID | TREATMENT_COST_INVALID
+
+# The report's counters as the rejection bits they are read from, so they agree with what validation
+# accepted. Quality counters count the records that failed none of the bits, error counters the ones
+# that failed any of them.
+CLINICAL_QUALITY_COUNTERS = {
+    'demographic_accuracy': {
+        'valid_age_records': AGE_BITS,
+        'valid_gender_records': GENDER_INVALID,
+        'complete_patient_names': PATIENT_NAME_MISSING
+    },
+    'vital_signs_quality': {
+        'valid_blood_pressure': BLOOD_PRESSURE_INVALID,
+        'valid_temperature': TEMPERATURE_INVALID,
+        'clinically_plausible_values': AGE_BITS | BLOOD_PRESSURE_INVALID | TEMPERATURE_INVALID
+    },
+    'treatment_data_quality': {
+        'valid_date_sequency': DATE_BITS,
+        'positive_treatment_cost': COST_BITS
+    }
+}
+ERROR_COUNTERS = {
+    'critical_errors': {
+        'invalid_age_values': AGE_BITS,
+        'negative_treatment_cost': COST_BITS,
+        'date_sequence_violations': DISCHARGE_BEFORE_ADMISSION
+    },
+    'data_integrity_issue': {
+        'missing_patient_name': PATIENT_NAME_MISSING,
+        'invalid_date_format': ADMISSION_DATE_INVALID | DISCHARGE_DATE_INVALID,
+        'missing_discharge_dates': DISCHARGE_DATE_MISSING
+    }
+}
+
+# Made once for each kind of problem found, however many records have it
+MEDICAL_RECOMMENDATIONS = [
+    (AGE_BITS, {
+        'priority': 'High',
+        'recommendation': 'Implement age validation in patient registration system',
+        'department': 'IT/Medical Records',
+        'timeline': 'Immediate'
+    }),
+    (ADMISSION_DATE_INVALID | DISCHARGE_DATE_INVALID | DISCHARGE_BEFORE_ADMISSION, {
+        'priority': 'High',
+        'recommendation': 'Fix date validation in admission/discharge system',
+        'department': 'IT/Admissions',
+        'timeline': '1 week'
+    }),
+    (COST_BITS, {
+        'priority': 'Medium',
+        'recommendation': 'Add cost validation in billing system',
+        'department': 'Finance/Billing',
+        'timeline': '2 weeks'
+    })
+]
+
+# Rejected records detailed in the report; every other reject is only counted
+REPORT_SAMPLE_SIZE = 100
+
+def start_medical_profile(sample_size=REPORT_SAMPLE_SIZE, seed=0):
+    # Running totals for the medical report, fed one validated batch at a time. Rejects are counted per
+    # reason bitmask, which is all the counters need, so no record is looked at twice.
+    return {
+        'valid_records': 0,
+        'invalid_records': 0,
+        'codes': Counter(),
+        'doctor_assignments': 0,
+        'invalid_sample': [],
+        'sample_size': sample_size,
+        'rng': random.Random(seed)
+    }
 
-def generate_medical_report(all_data, valid_data, invalid_data, input_file, report_file):
-    try:
-        data_quality = round(len(valid_data) / (len(valid_data) + len(invalid_data)) * 100,2)
-
-        data_raw = all_data.copy()
-        age = int(data_raw['age'])
-        data_raw['age'] = age
-
-        valid_age = 0
-        valid_gender = 0
-        valid_name = 0
-        valid_blood_pressure = 0
-        valid_temperature = 0
-        valid_clinically_plausible = 0
-        valid_date_sequency = 0
-        valid_treatment_cost = 0
-        valid_doctor_assignment = 0
-
-        invalid_age = 0
-        invalid_treatment_cost = 0
-
-        for record in all_data:
-            print(type(record['age']))
-
-        # for record in all_data:
-        #     age, temperature, treatment_cost, bp_match = -1, -1.0, -1.0, None
-        #     try:
-        #         age = int(record['age'])
-        #         bp_match = re.match(r'(\b\d{2,3})/\d{2,3}\b', record['blood_pressure'])
-        #         temperature = float(record['temperature'])
-        #         admission_date_obj = datetime.strptime(record['admission_date'], '%Y-%m-%d')
-        #         discharge_date_obj = datetime.strptime(record['discharge_date'], '%Y-%m-%d')
-        #
-        #         if discharge_date_obj >= admission_date_obj:
-        #             valid_date_sequency += 1
-        #
-        #         treatment_cost = float(record['treatment_cost'])
-        #
-        #     except (ValueError, TypeError):
-        #         pass
-        #
-        #     if 120 > age > 0:
-        #         valid_age += 1
-        #     else:
-        #         invalid_age += 1
-        #
-        #     gender = record['gender']
-        #     if isinstance(gender, str) and gender.upper() in ['F', 'M']:
-        #         valid_gender += 1
-        #
-        #     patient_name = record['patient_name']
-        #     if isinstance(patient_name, str) and patient_name.strip():
-        #         valid_name += 1
-        #
-        #     if bp_match:
-        #         valid_blood_pressure += 1
-        #
-        #     if 42 > temperature > 35:
-        #         valid_temperature += 1
-        #
-        #     if 120 > age > 0 and bp_match and 42 > temperature > 35:
-        #         valid_clinically_plausible += 1
-        #
-        #     if treatment_cost > 0:
-        #         valid_treatment_cost += 1
-        #     else:
-        #         invalid_treatment_cost += 1
-        #
-        #     doctor_assignment = record['doctor']
-        #     if doctor_assignment:
-        #         valid_doctor_assignment += 1
-
-
-
-
-
-
-
-        metadata_report = {
-            'report_metadata': {
+def add_profile_batch(profile, valid_data, invalid_data):
+    # valid_data holds ParsedPatient tuples, invalid_data (raw record, reason bits) pairs
+    profile['valid_records'] += len(valid_data)
+    profile['codes'].update(code for record, code in invalid_data)
+    # The doctor is the one field no rule checks, so it is the one column read here
+    profile['doctor_assignments'] += (sum(1 for record in valid_data if record.doctor)
+                                      + sum(1 for record, code in invalid_data if record['doctor']))
+
+    # Reservoir sampling: after n rejects each of them has had the same sample_size / n chance to be kept
+    sample = profile['invalid_sample']
+    for record, code in invalid_data:
+        profile['invalid_records'] += 1
+        if len(sample) < profile['sample_size']:
+            sample.append((record['patient_id'], code))
+            continue
+        slot = profile['rng'].randrange(profile['invalid_records'])
+        if slot < profile['sample_size']:
+            sample[slot] = (record['patient_id'], code)
+
+def count_failed(codes, bits):
+    return sum(count for code, count in codes.items() if code & bits)
+
+def invalid_record_detail(patient_id, code):
+    if code & (PATIENT_NAME_MISSING | AGE_BITS):
+        severity, impact, action = ('High', 'Patient Identification risk/Clinical decision risk',
+                                    'Urgent data correction found')
+    elif code & COST_BITS:
+        severity, impact, action = 'Medium', 'Billing inaccuracy', 'Review Billing System'
+    else:
+        severity, impact, action = 'Low', 'Administrative risk', 'Contact medical records department'
+    return {
+        'patient_id': patient_id or 'N/A',
+        'error_severity': severity,
+        'clinical_impact': impact,
+        'errors': [text for bit, text in REJECTION_REASONS.items() if code & bit],
+        'recommended_action': action
+    }
+
+def finish_medical_report(profile, input_file):
+    valid_records, invalid_records = profile['valid_records'], profile['invalid_records']
+    total_records = valid_records + invalid_records
+    codes = profile['codes']
+    data_quality = round(valid_records / total_records * 100, 2)
+
+    clinical_data_quality = {
+        group: {name: total_records - count_failed(codes, bits) for name, bits in counters.items()}
+        for group, counters in CLINICAL_QUALITY_COUNTERS.items()
+    }
+    clinical_data_quality['treatment_data_quality']['complete_doctor_assignments'] = profile['doctor_assignments']
+    error_analysis = {
+        group: {name: count_failed(codes, bits) for name, bits in counters.items()}
+        for group, counters in ERROR_COUNTERS.items()
+    }
+    error_analysis['invalid_record_detail'] = [invalid_record_detail(patient_id, code)
+                                               for patient_id, code in profile['invalid_sample']]
+
+    demographics = clinical_data_quality['demographic_accuracy']
+    vital_signs = clinical_data_quality['vital_signs_quality']
+    treatment = clinical_data_quality['treatment_data_quality']
+    actionable_recommendation = [recommendation for bits, recommendation in MEDICAL_RECOMMENDATIONS
+                                 if count_failed(codes, bits)]
+    if data_quality < 50:
+        actionable_recommendation.append({
+            'priority': 'Medium',
+            'recommendation': 'Staff training on data entry protocols',
+            'department': 'HR/Medical Staff',
+            'timeline': '1 month'
+        })
+
+    match_data_source = re.search(r"[a-zA-Z0-9_-]+\.csv", input_file)
+    return {
+        'report_metadata': {
             'generated_at': datetime.now().isoformat(),
             'facility': medical_metadata['facility_name'],
-            'report_type': 'Medical Data Quality '+ medical_metadata['clinical_data_quality'],
+            'report_type': 'Medical Data Quality ' + medical_metadata['clinical_data_quality'],
             'reporting_period': datetime.now().strftime('%B %Y'),
-            'data_source': ''
-            },
-            'executive_summary': {
-                'total_records_processed': len(valid_data) + len(invalid_data),
-                'valid_medical_records': len(valid_data),
-                'invalid_medical_records': len(invalid_data),
-                'data_quality': data_quality,
-                'compliance_status': 'Needs Improvement' if data_quality < 50 else 'Excellent data',
-                'patient_safety_risk': 'Medium'
-            },
-            'clinical_data_quality': {
-                'demographic_accuracy': {
-                    'valid_age_records': valid_age,
-                    'valid_gender_records': valid_gender,
-                    'complete_patient_names': valid_name
-                },
-                'vital_signs_quality': {
-                    'valid_blood_pressure': valid_blood_pressure,
-                    'valid_temperature': valid_temperature,
-                    'clinically_plausible_values': valid_clinically_plausible
-                },
-                'treatment_data_quality': {
-                    'valid_date_sequency': valid_date_sequency,
-                    'positive_treatment_cost': valid_treatment_cost,
-                    'complete_doctor_assignments': valid_doctor_assignment
-                }
-            },
-            'error_analysis': {
-                'critical_errors': {
-                    'invalid_age_values': invalid_age,
-                    'negative_treatment_cost': invalid_treatment_cost,
-                    # 'date_sequence_violations': invalid_date
-                }
-            }
-        }
-
-
-        match_data_source = re.search(r"[a-zA-Z0-9_-]+\.csv", input_file)
-        if match_data_source:
-            metadata_report['report_metadata']['data_source'] = match_data_source.group(0)
-        else:
-            metadata_report['report_metadata']['data_source'] = 'File not found'
+            'data_source': match_data_source.group(0) if match_data_source else 'File not found'
+        },
+        'executive_summary': {
+            'total_records_processed': total_records,
+            'valid_medical_records': valid_records,
+            'invalid_medical_records': invalid_records,
+            'data_quality': data_quality,
+            'compliance_status': 'Needs Improvement' if data_quality < 50 else 'Excellent data',
+            'patient_safety_risk': 'Medium'
+        },
+        'clinical_data_quality': clinical_data_quality,
+        'error_analysis': error_analysis,
+        'compliance_metrics': {
+            'data_completeness_score': round((demographics['complete_patient_names']
+                                              + treatment['complete_doctor_assignments']
+                                              + treatment['positive_treatment_cost']) / (total_records * 3) * 100, 1),
+            'clinical_accuracy_score': round((demographics['valid_age_records'] + vital_signs['valid_temperature']
+                                              + vital_signs['valid_blood_pressure']) / (total_records * 3) * 100, 1)
+        },
+        'actionable_recommendation': actionable_recommendation
+    }
 
+def write_medical_report(profile, input_file, report_file):
+    try:
         with open(report_file, 'w', encoding='utf-8') as file:
-            json.dump(metadata_report, file ,indent=2)
+            json.dump(finish_medical_report(profile, input_file), file, indent=2)
         return True
     except Exception as e:
         logging.error(f"Error: {e}")
         return None
 
+def generate_medical_report(all_data, valid_data, invalid_data, input_file, report_file):
+    # Everything the report counts comes out of validation; all_data is not read again
+    profile = start_medical_profile()
+    add_profile_batch(profile, valid_data, invalid_data)
+    return write_medical_report(profile, input_file, report_file)
+
 
 if __name__ == '__main__':
     from extract import extract_patient_data
@@ -0,0 +1,207 @@
+import argparse
+import json
+import logging
+from extract import extract_patient_data, extract_patient_data_chunks
+from validate import validate_patient_data, rejection_text
+from transform import transform_patient_data
+from load import save_patient_records, save_patient_records_chunks, generate_medical_report, PATIENT_CSV_FIELDS
+from load import start_medical_profile, add_profile_batch, write_medical_report
+from stream_writer import OUTPUT_FORMATS
+from columnar_writer import COLUMNAR_FORMAT
+from sqlite_writer import SQLITE_FORMAT
+from compression import COMPRESSION_EXTENSIONS
+from metrics import start_metrics, stage, timed_chunks, publish_metrics
+from dead_letter import start_dead_letter, write_dead_letter, close_dead_letter
+
+# Setup Logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('etl_pipeline.log'),
+        logging.StreamHandler()
+    ]
+)
+
+def process_patient_chunks(chunks, stats, rejected, metrics=None, dead_letter=None, clinical_bins=None,
+                           profile=None):
+    for chunk in chunks:
+        stats['extracted'] += len(chunk)
+        with stage(metrics, 'validate') as current:
+            cleaned, chunk_rejected = validate_patient_data(chunk)
+            current['records'] = len(chunk)
+        stats['valid'] += len(cleaned)
+        stats['invalid'] += len(chunk_rejected)
+        # Rejected rows are only kept when the output stores them (SQLite)
+        if rejected is not None:
+            rejected.extend(chunk_rejected)
+        if profile is not None:
+            add_profile_batch(profile, cleaned, chunk_rejected)
+        if dead_letter is not None:
+            write_dead_letter(dead_letter, chunk_rejected)
+
+        with stage(metrics, 'transform') as current:
+            transformed = transform_patient_data(cleaned, clinical_bins)
+            current['records'] = len(cleaned)
+        if transformed is False:
+            raise ValueError('Transform failed for chunk')
+        stats['transformed'] += len(transformed)
+        yield transformed
+
+def run_chunked_patient_pipeline(input_file, output_file, report_file, chunk_size, output_format='json', metrics=None,
+                                 metrics_file=None, dead_letter=None, clinical_bins=None, serialize_workers=0,
+                                 index_file=None):
+    logging.info(f'=== PATIENT DATA PIPELINE STARTED (chunks of {chunk_size} records) ===')
+    stats = {'extracted': 0, 'valid': 0, 'invalid': 0, 'transformed': 0}
+    rejected = [] if output_format == SQLITE_FORMAT else None
+    profile = start_medical_profile()
+
+    # Extract, validate, transform and load all happen while the output file is being written
+    chunks = timed_chunks(metrics, 'extract', extract_patient_data_chunks(input_file, chunk_size))
+    with stage(metrics, 'load') as current:
+        load_success = save_patient_records_chunks(process_patient_chunks(chunks, stats, rejected, metrics, dead_letter,
+                                                                          clinical_bins, profile),
+                                                   input_file, output_file, output_format, rejected,
+                                                   serialize_workers, index_file)
+        current['records'] = stats['transformed']
+
+    if not stats['extracted']:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+
+    logging.info(f"valid records: {stats['valid']}")
+    logging.info(f"invalid records: {stats['invalid']}")
+    logging.info(f"Saved clean data to: {output_file} ({stats['transformed']} records)")
+
+    # The report only needs the counts gathered chunk by chunk
+    with stage(metrics, 'report') as current:
+        report_success = write_medical_report(profile, input_file, report_file)
+        current['records'] = stats['extracted']
+
+    if metrics is not None:
+        publish_metrics(metrics, report_file if report_success else None, metrics_file)
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    logging.info(f"Valid: {stats['transformed']} records | Invalid: {stats['invalid']}")
+    return load_success
+
+def run_serial_patient_pipeline(input_file, output_file, report_file, output_format='json', metrics=None,
+                                metrics_file=None, dead_letter=None, clinical_bins=None, serialize_workers=0,
+                                index_file=None):
+    logging.info('=== PATIENT DATA PIPELINE STARTED ===')
+    with stage(metrics, 'extract') as current:
+        data = extract_patient_data(input_file)
+        current['records'] = len(data) if data else 0
+    if not data:
+        logging.error('No data extracted. Pipeline stopped')
+        return False
+
+    with stage(metrics, 'validate') as current:
+        cleaned, rejected = validate_patient_data(data)
+        current['records'] = len(data)
+    logging.info(f'valid records: {len(cleaned)}')
+    logging.info(f'invalid records: {len(rejected)}')
+    if dead_letter is not None:
+        write_dead_letter(dead_letter, rejected)
+
+    with stage(metrics, 'transform') as current:
+        transformed = transform_patient_data(cleaned, clinical_bins)
+        current['records'] = len(cleaned)
+    if transformed is False:
+        logging.error('Transform failed. Pipeline stopped')
+        return False
+
+    with stage(metrics, 'load') as current:
+        load_success = save_patient_records(transformed, input_file, output_file, output_format, rejected,
+                                            serialize_workers, index_file)
+        current['records'] = len(transformed)
+    logging.info(f"Saved clean data to: {output_file} ({len(transformed)} records)")
+
+    with stage(metrics, 'report') as current:
+        report_success = generate_medical_report(data, cleaned, rejected, input_file, report_file)
+        current['records'] = len(data)
+
+    if metrics is not None:
+        publish_metrics(metrics, report_file if report_success else None, metrics_file)
+
+    logging.info(f"=== PIPELINE COMPLETED ===")
+    logging.info(f"Valid: {len(transformed)} records | Invalid: {len(rejected)}")
+    return load_success
+
+def run_patient_pipeline(input_file='../data/patient_record.csv', output_file='../data/clean_records.json',
+                         report_file='../data/medical_quality_report.json', chunk_size=None, output_format='json',
+                         metrics=False, trace_memory=False, metrics_file='../data/patient_metrics.prom',
+                         dead_letter_file='../data/rejected_patients.csv', clinical_bins_file=None,
+                         serialize_workers=0, index_file='../data/patient_index.db'):
+    pipeline_metrics = start_metrics('patients', trace_memory) if metrics else None
+    dead_letter = start_dead_letter(dead_letter_file, PATIENT_CSV_FIELDS, rejection_text) if dead_letter_file else None
+
+    try:
+        clinical_bins = None
+        if clinical_bins_file:
+            # {"age_group": [[18, 66], ["Child", "Adult", "Senior"]], ...}; categories left out keep their bins
+            with open(clinical_bins_file) as file:
+                clinical_bins = json.load(file)
+
+        if chunk_size:
+            success = run_chunked_patient_pipeline(input_file, output_file, report_file, chunk_size, output_format,
+                                                   pipeline_metrics, metrics_file, dead_letter, clinical_bins,
+                                                   serialize_workers, index_file)
+        else:
+            success = run_serial_patient_pipeline(input_file, output_file, report_file, output_format, pipeline_metrics,
+                                                  metrics_file, dead_letter, clinical_bins, serialize_workers,
+                                                  index_file)
+
+        if dead_letter is not None:
+            logging.info(f"Rejected records written to {dead_letter_file} ({close_dead_letter(dead_letter)} records)")
+        return success
+
+    except Exception as e:
+        logging.error(f"Patient pipeline failed: {e}")
+        return False
+    finally:
+        # Closing twice is harmless; this covers runs that stopped with the file still open
+        if dead_letter is not None and dead_letter['file'] is not None:
+            dead_letter['file'].close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Patient data ETL pipeline')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='stream the input through the pipeline this many rows at a time')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS + (COLUMNAR_FORMAT, SQLITE_FORMAT), default='json',
+                        help='json array document, compact NDJSON with a .meta.json sidecar, a directory of '
+                             'one .npy file per column with a manifest.json, or a SQLite database')
+    parser.add_argument('--metrics', action='store_true',
+                        help='record per-stage timing, throughput and memory in the report and a metrics file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record tracemalloc peaks per stage (slows the run down)')
+    parser.add_argument('--metrics-file', default='../data/patient_metrics.prom',
+                        help='where to write the Prometheus text-format metrics')
+    parser.add_argument('--input', default='../data/patient_record.csv',
+                        help='patient CSV, optionally gzip, bz2 or xz compressed')
+    parser.add_argument('--compress', choices=COMPRESSION_EXTENSIONS, default=None,
+                        help='compress the clean records output')
+    parser.add_argument('--dead-letter', default='../data/rejected_patients.csv',
+                        help="CSV the rejected rows and their reasons are streamed to ('' to skip it)")
+    parser.add_argument('--clinical-bins', default=None,
+                        help='JSON file of bin edges and labels replacing the built-in age, blood pressure or cost '
+                             'bins')
+    parser.add_argument('--serialize-workers', type=int, default=0,
+                        help='encode json and ndjson records in this many worker processes (0 encodes in-process)')
+    parser.add_argument('--index', default='../data/patient_index.db',
+                        help="SQLite lookup index over json and ndjson records, see patient_index.py ('' to skip it)")
+    args = parser.parse_args()
+
+    if args.compress and args.output_format in (COLUMNAR_FORMAT, SQLITE_FORMAT):
+        parser.error('--compress only applies to json and ndjson output')
+
+    output_file = {'ndjson': '../data/clean_records.ndjson',
+                   COLUMNAR_FORMAT: '../data/clean_records_columns',
+                   SQLITE_FORMAT: '../data/patients.db'}.get(args.output_format, '../data/clean_records.json')
+    if args.compress:
+        output_file += COMPRESSION_EXTENSIONS[args.compress]
+    success = run_patient_pipeline(input_file=args.input, output_file=output_file, chunk_size=args.chunk_size, output_format=args.output_format,
+                                   metrics=args.metrics or args.trace_memory, trace_memory=args.trace_memory,
+                                   metrics_file=args.metrics_file, dead_letter_file=args.dead_letter or None,
+                                   clinical_bins_file=args.clinical_bins, serialize_workers=args.serialize_workers,
+                                   index_file=args.index or None)
@@ -0,0 +1,178 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Returned by stage() when instrumentation is off, so callers can always write stage['records']
+DISABLED_STAGE = {}
+
+def max_rss_kb():
+    # The process's resident set high-water mark so far; it never goes down, so a stage can only
+    # be charged with how far it raised it
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def start_metrics(pipeline, trace_memory=False):
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {
+        'pipeline': pipeline,
+        'started_at': datetime.now().isoformat(),
+        'started': time.perf_counter(),
+        'trace_memory': trace_memory,
+        'stages': {},
+        'open_stages': []
+    }
+
+def stage_totals(metrics, name):
+    return metrics['stages'].setdefault(name, {
+        'wall_seconds': 0.0,
+        'cpu_seconds': 0.0,
+        'records': 0,
+        'max_rss_growth_kb': None,
+        'tracemalloc_peak_bytes': None
+    })
+
+@contextmanager
+def stage(metrics, name):
+    # Times one stage. Time spent in stages opened inside it (for example extract and validate
+    # running inside the load stage's generator) is reported for those stages, not this one.
+    if metrics is None:
+        yield DISABLED_STAGE
+        return
+
+    open_stages = metrics['open_stages']
+    if metrics['trace_memory']:
+        if open_stages:
+            parent = open_stages[-1]
+            parent['tracemalloc_peak'] = max(parent['tracemalloc_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    current = {'records': 0, 'nested_wall': 0.0, 'nested_cpu': 0.0, 'nested_rss_growth': 0, 'tracemalloc_peak': 0}
+    open_stages.append(current)
+    rss_start = max_rss_kb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield current
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        rss_growth = max_rss_kb() - rss_start if rss_start is not None else 0
+        open_stages.pop()
+        if open_stages:
+            open_stages[-1]['nested_wall'] += wall
+            open_stages[-1]['nested_cpu'] += cpu
+            open_stages[-1]['nested_rss_growth'] += rss_growth
+
+        totals = stage_totals(metrics, name)
+        totals['wall_seconds'] += wall - current['nested_wall']
+        totals['cpu_seconds'] += cpu - current['nested_cpu']
+        totals['records'] += current['records']
+        if rss_start is not None:
+            totals['max_rss_growth_kb'] = (totals['max_rss_growth_kb'] or 0) + rss_growth - current['nested_rss_growth']
+
+        if metrics['trace_memory']:
+            peak = max(current['tracemalloc_peak'], tracemalloc.get_traced_memory()[1])
+            totals['tracemalloc_peak_bytes'] = max(totals['tracemalloc_peak_bytes'] or 0, peak)
+            if open_stages:
+                open_stages[-1]['tracemalloc_peak'] = max(open_stages[-1]['tracemalloc_peak'], peak)
+
+def timed_chunks(metrics, name, chunks, count=len):
+    # Charges the time spent producing each chunk (not consuming it) to the named stage;
+    # count(chunk) gives the number of records in it
+    if metrics is None:
+        return chunks
+
+    def generator():
+        iterator = iter(chunks)
+        while True:
+            with stage(metrics, name) as current:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                current['records'] = count(chunk)
+            yield chunk
+
+    return generator()
+
+def add_stage(metrics, name, wall_seconds, cpu_seconds, records):
+    # For work measured elsewhere, e.g. inside worker processes
+    if metrics is None:
+        return
+    totals = stage_totals(metrics, name)
+    totals['wall_seconds'] += wall_seconds
+    totals['cpu_seconds'] += cpu_seconds
+    totals['records'] += records
+
+def metrics_summary(metrics):
+    stages = {}
+    for name, totals in metrics['stages'].items():
+        wall = totals['wall_seconds']
+        stages[name] = {
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(totals['cpu_seconds'], 6),
+            'records': totals['records'],
+            'records_per_second': round(totals['records'] / wall, 1) if wall > 0 else None,
+            'max_rss_growth_kb': totals['max_rss_growth_kb'],
+            'tracemalloc_peak_bytes': totals['tracemalloc_peak_bytes']
+        }
+    return {
+        'pipeline': metrics['pipeline'],
+        'started_at': metrics['started_at'],
+        'total_wall_seconds': round(time.perf_counter() - metrics['started'], 6),
+        'max_rss_kb': max_rss_kb(),
+        'stages': stages
+    }
+
+def write_metrics_file(summary, metrics_file):
+    # Prometheus text exposition format, so a node_exporter textfile collector can scrape it
+    pipeline = summary['pipeline']
+    lines = []
+    for key in ('wall_seconds', 'cpu_seconds', 'records', 'records_per_second', 'max_rss_growth_kb',
+                'tracemalloc_peak_bytes'):
+        lines.append(f'# TYPE etl_stage_{key} gauge')
+        for name, values in summary['stages'].items():
+            if values[key] is not None:
+                lines.append(f'etl_stage_{key}{{pipeline="{pipeline}",stage="{name}"}} {values[key]}')
+    lines.append('# TYPE etl_total_wall_seconds gauge')
+    lines.append(f'etl_total_wall_seconds{{pipeline="{pipeline}"}} {summary["total_wall_seconds"]}')
+    if summary['max_rss_kb'] is not None:
+        lines.append('# TYPE etl_max_rss_kb gauge')
+        lines.append(f'etl_max_rss_kb{{pipeline="{pipeline}"}} {summary["max_rss_kb"]}')
+
+    with open(metrics_file, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def attach_metrics(report_file, summary):
+    with open(report_file, 'r', encoding='utf-8') as file:
+        report = json.load(file)
+    report['metrics'] = summary
+    with open(report_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+def publish_metrics(metrics, report_file, metrics_file):
+    summary = metrics_summary(metrics)
+    if report_file:
+        attach_metrics(report_file, summary)
+    if metrics_file:
+        write_metrics_file(summary, metrics_file)
+    return summary
+
+if __name__ == '__main__':
+    metrics = start_metrics('demo', trace_memory=True)
+    with stage(metrics, 'build') as current:
+        data = [str(number) for number in range(100000)]
+        current['records'] = len(data)
+    print(json.dumps(metrics_summary(metrics), indent=2))
@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from date_parser import parse_iso_date
+from sqlite_writer import open_database
+
+# Secondary indexes over the json or ndjson clean records, kept in SQLite next to the output. Each row
+# points at one encoded record by byte offset and length, so a query reads only the records it matches
+# instead of the whole file.
+INDEX_TABLE = 'patient_index'
+INDEX_KEYS = ('patient_id', 'doctor', 'diagnosis', 'admission_date')
+# Built once the rows are in; admission date ranges are narrowed on the second column
+INDEX_COLUMNS = (('patient_id',), ('doctor', 'admission_date'), ('diagnosis', 'admission_date'), ('admission_date',))
+# Bytes hashed at each end of the output to tell a rewritten file of the same size apart
+SIGNATURE_BYTES = 64 * 1024
+
+def output_signature(output_file):
+    # (size, mtime in ns, sha256 of the first and last SIGNATURE_BYTES) of the indexed output
+    stat = os.stat(output_file)
+    digest = hashlib.sha256()
+    with open(output_file, 'rb') as file:
+        digest.update(file.read(SIGNATURE_BYTES))
+        file.seek(max(stat.st_size - SIGNATURE_BYTES, 0))
+        digest.update(file.read())
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+def start_patient_index(index_file, output_file):
+    # The old index is replaced in the same transaction the new one is written in, so a load that fails
+    # leaves the previous one in place (query_patient_records then finds it out of date)
+    connection = open_database(index_file)
+    connection.execute('BEGIN')
+    connection.execute(f'DROP TABLE IF EXISTS {INDEX_TABLE}')
+    connection.execute(f'DROP TABLE IF EXISTS {INDEX_TABLE}_output')
+    connection.execute(f"CREATE TABLE {INDEX_TABLE} ({', '.join(f'{key} TEXT' for key in INDEX_KEYS)}, "
+                       f"offset INTEGER, length INTEGER)")
+    connection.execute(f'CREATE TABLE {INDEX_TABLE}_output (output_file TEXT, output_format TEXT, size INTEGER, '
+                       f'mtime_ns INTEGER, sha256 TEXT, records INTEGER, indexed_at TEXT)')
+    # keys of records handed to the writer, offsets of records it has written; rows are inserted as both arrive
+    return {'connection': connection, 'output_file': output_file, 'keys': [], 'offsets': []}
+
+def flush_patient_index(index):
+    keys, offsets = index['keys'], index['offsets']
+    ready = min(len(keys), len(offsets))
+    if ready:
+        index['connection'].executemany(f'INSERT INTO {INDEX_TABLE} VALUES (?, ?, ?, ?, ?, ?)',
+                                        (key + offset for key, offset in zip(keys[:ready], offsets[:ready])))
+        del keys[:ready]
+        del offsets[:ready]
+
+def index_batches(index, batches):
+    # Passes batches of PatientRecords on to be written, noting the index keys of each record
+    for batch in batches:
+        flush_patient_index(index)
+        index['keys'].extend((record.patient_id, record.doctor, record.diagnosis, record.admission_date)
+                             for record in batch)
+        yield batch
+
+def finish_patient_index(index, output_format, total_records):
+    flush_patient_index(index)
+    connection = index['connection']
+    for columns in INDEX_COLUMNS:
+        connection.execute(f"CREATE INDEX idx_{INDEX_TABLE}_{'_'.join(columns)} "
+                           f"ON {INDEX_TABLE} ({', '.join(columns)})")
+    connection.execute(f'INSERT INTO {INDEX_TABLE}_output VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (index['output_file'], output_format, *output_signature(index['output_file']), total_records,
+                        datetime.now().isoformat()))
+    connection.execute('COMMIT')
+
+def close_patient_index(index):
+    # Rolls back an index that was never finished
+    connection = index['connection']
+    if connection.in_transaction:
+        connection.execute('ROLLBACK')
+    connection.close()
+
+def query_patient_records(output_file, index_file, patient_id=None, doctor=None, diagnosis=None,
+                          admitted_from=None, admitted_to=None):
+    # Clean records matching every filter given, admitted admitted_from..admitted_to (both included, either
+    # may be left open), in file order. Only the matching records are read from output_file.
+    conditions, parameters = [], []
+    for column, value in (('patient_id', patient_id), ('doctor', doctor), ('diagnosis', diagnosis)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    if admitted_from:
+        conditions.append('admission_date >= ?')
+        parameters.append(parse_iso_date(admitted_from).isoformat())
+    if admitted_to:
+        conditions.append('admission_date <= ?')
+        parameters.append(parse_iso_date(admitted_to).isoformat())
+
+    connection = sqlite3.connect(index_file)
+    try:
+        # An index written before these columns existed counts as out of date
+        try:
+            indexed = connection.execute(f'SELECT size, mtime_ns, sha256 FROM {INDEX_TABLE}_output').fetchone()
+        except sqlite3.OperationalError:
+            indexed = None
+        if indexed is None or indexed != output_signature(output_file):
+            raise ValueError(f"{index_file} does not match {output_file}, load the records again to rebuild it")
+        locations = connection.execute(f"SELECT offset, length FROM {INDEX_TABLE}"
+                                       f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY offset",
+                                       parameters).fetchall()
+    finally:
+        connection.close()
+
+    records = []
+    with open(output_file, 'rb') as file:
+        for offset, length in locations:
+            file.seek(offset)
+            records.append(json.loads(file.read(length)))
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up clean patient records through the load-time index')
+    parser.add_argument('--output', default='../data/clean_records.json', help='json or ndjson clean records')
+    parser.add_argument('--index', default='../data/patient_index.db')
+    parser.add_argument('--patient-id', default=None)
+    parser.add_argument('--doctor', default=None)
+    parser.add_argument('--diagnosis', default=None)
+    parser.add_argument('--from', dest='admitted_from', default=None, help='first admission date, YYYY-MM-DD')
+    parser.add_argument('--to', dest='admitted_to', default=None, help='last admission date, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    for record in query_patient_records(args.output, args.index, args.patient_id, args.doctor, args.diagnosis,
+                                        args.admitted_from, args.admitted_to):
+        print(record)
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+from itertools import islice
+
+SQLITE_FORMAT = 'sqlite'
+
+# Column kinds as in columnar_writer; everything that is not a number is stored as text
+SQL_TYPES = {'float': 'REAL', 'int': 'INTEGER', 'date': 'TEXT', 'dictionary': 'TEXT', 'string': 'TEXT'}
+
+# Rows per executemany call and per transaction. Commits are where SQLite waits on the disk,
+# so they are kept rare; WAL keeps readers working while a long transaction is open.
+BATCH_ROWS = 10000
+TRANSACTION_ROWS = 500000
+
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',  # with WAL, a crash can only lose the last commits, never corrupt the file
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536'    # 64 MiB page cache, which index builds over large tables use
+]
+
+def open_database(db_file):
+    # Autocommit mode, transactions are started and committed explicitly
+    connection = sqlite3.connect(db_file, isolation_level=None)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+def create_tables(connection, table, column_kinds, key, rejected_fields):
+    columns = ', '.join(f'{name} {SQL_TYPES[kind]}' + (' PRIMARY KEY' if name == key else '')
+                        for name, kind in column_kinds.items())
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+
+    rejected_columns = ', '.join(f'{name} TEXT' for name in rejected_fields)
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {table}_rejected ({rejected_columns}, '
+                       f'rejection_code INTEGER, rejection_reasons TEXT, loaded_at TEXT)')
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {table}_loads (loaded_at TEXT, metadata TEXT)')
+
+def create_indexes(connection, table, index_columns):
+    for name in index_columns:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{name} ON {table} ({name})')
+
+def upsert_statement(table, column_kinds, key):
+    # A row whose key is already in the table replaces the stored values
+    names = list(column_kinds)
+    updates = ', '.join(f'{name} = excluded.{name}' for name in names if name != key)
+    return (f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates}")
+
+def rejected_values(record, code, rejected_fields, rejection_text, loaded_at):
+    # Rejected rows keep their raw values as read from the input
+    return [record.get(name) for name in rejected_fields] + [code, rejection_text(code), loaded_at]
+
+def write_sqlite(record_chunks, db_file, table, column_kinds, key, index_columns, metadata, rejected=None,
+                 rejected_fields=(), rejection_text=str, count_key='total_records', append=False,
+                 before_batch=None):
+    # Upserts record tuples (in column_kinds order) into `table` and returns how many were written.
+    # `rejected` is a list of (record, reason code) pairs the caller adds to while record_chunks is
+    # being produced; after each chunk the pairs in it go to `<table>_rejected` and the list is emptied.
+    # Without `append` the rejected table is emptied first, as the other outputs are rewritten.
+    # Indexes are only created after the load, so a first load does not maintain them row by row.
+    # before_batch(connection, batch) is called inside the transaction before each batch is upserted.
+    connection = open_database(db_file)
+    try:
+        create_tables(connection, table, column_kinds, key, rejected_fields)
+        upsert = upsert_statement(table, column_kinds, key)
+        insert_rejected = (f'INSERT INTO {table}_rejected VALUES '
+                           f"({', '.join('?' * (len(rejected_fields) + 3))})")
+        loaded_at = metadata.get('export_timestamp')
+
+        connection.execute('BEGIN')
+        if not append:
+            connection.execute(f'DELETE FROM {table}_rejected')
+
+        total_records = 0
+        pending = 0
+        for chunk in record_chunks:
+            chunk = iter(chunk)
+            while True:
+                batch = list(islice(chunk, BATCH_ROWS))
+                if not batch:
+                    break
+                if before_batch is not None:
+                    before_batch(connection, batch)
+                connection.executemany(upsert, batch)
+                total_records += len(batch)
+                pending += len(batch)
+
+            if rejected:
+                connection.executemany(insert_rejected,
+                                       (rejected_values(record, code, rejected_fields, rejection_text, loaded_at)
+                                        for record, code in rejected))
+                pending += len(rejected)
+                del rejected[:]
+
+            if pending >= TRANSACTION_ROWS:
+                connection.execute('COMMIT')
+                connection.execute('BEGIN')
+                pending = 0
+
+        loaded = dict(metadata)
+        loaded[count_key] = total_records
+        connection.execute(f'INSERT INTO {table}_loads VALUES (?, ?)', (loaded_at, json.dumps(loaded)))
+        connection.execute('COMMIT')
+
+        create_indexes(connection, table, index_columns)
+        return total_records
+
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def count_rows(db_file, table):
+    connection = sqlite3.connect(db_file)
+    try:
+        return connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    db_file = os.path.join(tempfile.gettempdir(), 'sqlite_writer_demo.db')
+    kinds = {'patient_id': 'string', 'age': 'int', 'admission_date': 'date', 'doctor': 'dictionary'}
+    rejected = [({'patient_id': 'PT-1234', 'age': '45'}, 1)]
+    chunks = [[('PT-001', 45, '2024-03-15', 'Dr. Smith'), ('PT-002', 62, '2024-03-16', 'Dr. Lee')],
+              [('PT-001', 46, '2024-05-02', 'Dr. Smith')]]
+    print(write_sqlite(chunks, db_file, 'patients', kinds, 'patient_id', ['admission_date', 'doctor'],
+                       {'export_timestamp': 'demo'}, rejected, ('patient_id', 'age'),
+                       {1: 'patient_id invalid format'}.get, count_key='total_record'))
+    with sqlite3.connect(db_file) as connection:
+        print(connection.execute('SELECT * FROM patients ORDER BY patient_id').fetchall())
+        print(connection.execute('SELECT * FROM patients_rejected').fetchall())
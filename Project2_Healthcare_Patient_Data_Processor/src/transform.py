@@ -1,55 +1,68 @@
-from datetime import datetime
-import re
+from bisect import bisect_right
+from collections import namedtuple
+
+# Sorted bin edges and one label per bin: a value below edges[0] gets labels[0] and a value at or past
+# edges[i] gets labels[i + 1]. Age and systolic pressure are ints, so "up to 65" is an edge at 66; a positive
+# treatment cost lands in the same bin as its whole part.
+CLINICAL_BINS = {
+    'bp_category': ((90, 120, 130, 140, 180, 300),
+                    (None, 'Normal', 'Elevated', 'High Stage 1', 'High Stage 2', 'Hypertensive Crisis', None)),
+    'age_group': ((18, 66), ('Child', 'Adult', 'Senior')),
+    'cost_category': ((1000000, 2000001), ('Low', 'Medium', 'High'))
+}
+
+# A transformed patient, fields in load.PATIENT_COLUMN_KINDS order. Records stay tuples until load.py
+# encodes them.
+PATIENT_FIELDS = ('patient_id', 'patient_name', 'age', 'age_group', 'gender', 'diagnosis', 'blood_pressure',
+                  'bp_category', 'temperature', 'temperature_status', 'admission_date', 'discharge_date',
+                  'length_of_stay', 'doctor', 'treatment_cost', 'cost_category')
+PatientRecord = namedtuple('PatientRecord', PATIENT_FIELDS)
+
+def bin_label(bins, value):
+    edges, labels = bins
+    return labels[bisect_right(edges, value)]
+
+def temperature_status(temperature):
+    return 'Hypothermia' if temperature < 35 else 'Fever' if temperature > 37.5 else 'Low' if 35 <= temperature <= 36 else 'Normal' if 36 < temperature <= 37.5 else None
+
+def transform_patient_data(valid_data, bins=None):
+    # valid_data holds validate.ParsedPatient tuples, so every value is already converted
+    # bins replaces some or all of CLINICAL_BINS
+    bins = dict(CLINICAL_BINS, **(bins or {}))
 
-def transform_patient_data(valid_data):
     transformed_data = []
-
-    BP_CATEGORIES = {
-        'Normal': (90, 120),  # Systolic
-        'Elevated': (120, 130),
-        'High Stage 1': (130, 140),
-        'High Stage 2': (140, 180),
-        'Hypertensive Crisis': (180, 300)
-    }
-
-    for record_data in valid_data:
-        try:
-            age = int(record_data['age'])
-            record_data['age'] = age
-            treatment_cost =  float(record_data['treatment_cost'])
-            temperature = float(record_data['temperature'])
-
-            record_data['length_of_stay'] = (record_data['discharge_date'] - record_data['admission_date']).days
-            record_data['admission_date'] = record_data['admission_date'].strftime('%Y-%m-%d')
-            record_data['discharge_date'] = record_data['discharge_date'].strftime('%Y-%m-%d')
-
-            record_data['age_group'] = 'Child' if age < 18 else 'Adult' if age <= 65 else 'Senior'
-
-            blood_pressure_str = record_data['blood_pressure']
-            match = re.match(r'(\b\d{2,3})/\d{2,3}\b', blood_pressure_str)
-
-            if match:
-                systolic_pressure = int(match.group(1))
-                found_category = None
-
-                for main_category, (min_bp, max_bp) in BP_CATEGORIES.items():
-                    if min_bp <= systolic_pressure < max_bp:
-                        found_category = main_category
-                        break
-                record_data['bp_category'] = found_category
-            else:
-                record_data['bp_category'] = 'Invalid'
-
-            cost = int(record_data['treatment_cost'])
-            record_data['cost_category'] = 'Low' if cost < 1000000 else 'Medium' if cost <= 2000000 else 'High'
-
-            record_data['treatment_cost'] = treatment_cost
-            record_data['temperature'] = temperature
-
-            transformed_data.append(record_data)
-
-        except ValueError:
-            return False
+    append = transformed_data.append
+    # Admissions span a few hundred days, so each date is only formatted once
+    date_text = {}
+    bp_bins, age_bins, cost_bins = bins['bp_category'], bins['age_group'], bins['cost_category']
+
+    for record in valid_data:
+        admission_date, discharge_date = record.admission_date, record.discharge_date
+        admission_text = date_text.get(admission_date)
+        if admission_text is None:
+            admission_text = date_text[admission_date] = admission_date.strftime('%Y-%m-%d')
+        discharge_text = date_text.get(discharge_date)
+        if discharge_text is None:
+            discharge_text = date_text[discharge_date] = discharge_date.strftime('%Y-%m-%d')
+
+        append(PatientRecord(
+            record.patient_id,
+            record.patient_name,
+            record.age,
+            bin_label(age_bins, record.age),
+            record.gender,
+            record.diagnosis,
+            record.blood_pressure,
+            bin_label(bp_bins, record.systolic),
+            record.temperature,
+            temperature_status(record.temperature),
+            admission_text,
+            discharge_text,
+            (discharge_date - admission_date).days,
+            record.doctor,
+            record.treatment_cost,
+            bin_label(cost_bins, record.treatment_cost)
+        ))
     return transformed_data
 
 if __name__ == '__main__':
@@ -62,4 +75,4 @@ if __name__ == '__main__':
     transformed = transform_patient_data(cleaned)
     for record in transformed:
 
-        print(record)
\ No newline at end of file
+        print(record)
@@ -1,108 +1,83 @@
-from datetime import datetime,date
-import re
+from collections import namedtuple
+from functools import lru_cache
+from date_parser import parse_iso_date
+from rules import compile_rules
 
 def validate_date(string_date):
 
     if not string_date:
         return None
 
-    try:
-        return datetime.strptime(string_date, '%Y-%m-%d').date()
-    except ValueError:
+    parsed_date = parse_iso_date(string_date)
+    if parsed_date is None:
         raise ValueError(f"Date format must be YYYY-MM-DD for '{string_date}'")
-
-def validate_patient_data(raw_data):
-    valid_data = []
-    invalid_data = []
-
-
-    for record_validate in raw_data:
-        processed_record = record_validate.copy()
-        is_valid = True
-        rejection_reasons = []
-
-        if not processed_record['patient_id'] or not re.match(r'^PT-\d{3}$', processed_record['patient_id']):
-            is_valid = False
-            rejection_reasons.append(f"patient_id invalid format")
-
-        if not processed_record['patient_name']:
-            is_valid = False
-            rejection_reasons.append(f"patient_name cannot be null")
-
-        try:
-            age = int(processed_record['age'])
-            processed_record['age'] = age
-            if age < 0 or age > 120:
-                is_valid = False
-                rejection_reasons.append(f"age not realistic")
-        except ValueError:
-            is_valid = False
-            rejection_reasons.append(f"Age value error")
-
-        if processed_record['gender'] not in ['F', 'M']:
-            is_valid = False
-            rejection_reasons.append(f"Go to hell disease")
-
-        admission_date = None
-        discharge_date = None
-
-        if not processed_record['admission_date']:
-            is_valid = False
-            rejection_reasons.append(f"admission_date must be filled")
-        else:
-            try:
-                admission_date = validate_date(processed_record['admission_date'])
-                processed_record['admission_date'] = admission_date
-            except ValueError as e:
-                is_valid = False
-                rejection_reasons.append(f"admission_date: {e}")
-
-        if not processed_record['discharge_date']:
-            is_valid = False
-            rejection_reasons.append(f"discharge_date must be filled")
-        else:
-            try:
-                discharge_date = validate_date(processed_record['discharge_date'])
-                processed_record['discharge_date'] = discharge_date
-            except ValueError as e:
-                is_valid = False
-                rejection_reasons.append(f"discharge_date: {e}")
-
-        if admission_date and discharge_date:
-            if discharge_date < admission_date:
-                is_valid = False
-                rejection_reasons.append(f"discharge_date cannot be before admission_date")
-        try:
-            treatment_cost = float(processed_record['treatment_cost'])
-            if treatment_cost <= 0:
-                rejection_reasons.append(f"treatment_cost must be paid")
-                is_valid = False
-        except ValueError:
-            is_valid = False
-            rejection_reasons.append(f"treatment_cost invalid format")
-        if not re.match(r'\b\d{2,3}/\d{2}\b', processed_record['blood_pressure']):
-            is_valid = False
-            rejection_reasons.append(f"blood_pressure invalid format")
-
-        try:
-            temperature = float(processed_record['temperature'])
-            if temperature < 35.0 or temperature > 42.0:
-                is_valid = False
-                rejection_reasons.append(f"temperature invalid format")
-        except ValueError:
-            is_valid = False
-            rejection_reasons.append('temperature invalid format')
-
-        if is_valid:
-            valid_data.append(processed_record)
-        else:
-            processed_record['rejection_reasons'] = ', '.join(rejection_reasons)
-            if isinstance(processed_record['admission_date'], date):
-                processed_record['admission_date'] = processed_record['admission_date'].strftime('%Y-%m-%d')
-            if isinstance(processed_record['discharge_date'], date):
-                processed_record['discharge_date'] = processed_record['discharge_date'].strftime('%Y-%m-%d')
-            invalid_data.append(processed_record)
-    return valid_data, invalid_data
+    return parsed_date
+
+# One bit per rejection rule. A rejected record carries the OR of the bits it failed; the numbers end up
+# in dead-letter files, so a rule keeps its bit for good.
+PATIENT_ID_INVALID = 1
+PATIENT_NAME_MISSING = 2
+AGE_NOT_REALISTIC = 4
+AGE_VALUE_ERROR = 8
+GENDER_INVALID = 16
+ADMISSION_DATE_MISSING = 32
+ADMISSION_DATE_INVALID = 64
+DISCHARGE_DATE_MISSING = 128
+DISCHARGE_DATE_INVALID = 256
+DISCHARGE_BEFORE_ADMISSION = 512
+TREATMENT_COST_NOT_PAID = 1024
+TREATMENT_COST_INVALID = 2048
+BLOOD_PRESSURE_INVALID = 4096
+TEMPERATURE_INVALID = 8192
+
+REJECTION_REASONS = {
+    PATIENT_ID_INVALID: 'patient_id invalid format',
+    PATIENT_NAME_MISSING: 'patient_name cannot be null',
+    AGE_NOT_REALISTIC: 'age not realistic',
+    AGE_VALUE_ERROR: 'Age value error',
+    GENDER_INVALID: 'gender invalid',
+    ADMISSION_DATE_MISSING: 'admission_date must be filled',
+    ADMISSION_DATE_INVALID: 'admission_date invalid format',
+    DISCHARGE_DATE_MISSING: 'discharge_date must be filled',
+    DISCHARGE_DATE_INVALID: 'discharge_date invalid format',
+    DISCHARGE_BEFORE_ADMISSION: 'discharge_date cannot be before admission_date',
+    TREATMENT_COST_NOT_PAID: 'treatment_cost must be paid',
+    TREATMENT_COST_INVALID: 'treatment_cost invalid format',
+    BLOOD_PRESSURE_INVALID: 'blood_pressure invalid format',
+    TEMPERATURE_INVALID: 'temperature invalid format'
+}
+
+@lru_cache(maxsize=None)
+def rejection_text(code):
+    # Only called when rejects are written out; each distinct combination is joined once
+    return ', '.join(text for bit, text in REJECTION_REASONS.items() if code & bit)
+
+# What validate_patient_data passes on for a valid row: every field already parsed once, so later stages
+# never convert it again. age, systolic and diastolic are ints, treatment_cost and temperature floats and both
+# dates date objects; a rejected record is kept as it was read, paired with its reason bits.
+PARSED_PATIENT_FIELDS = ('patient_id', 'patient_name', 'age', 'gender', 'diagnosis', 'admission_date',
+                         'discharge_date', 'blood_pressure', 'systolic', 'diastolic', 'temperature',
+                         'treatment_cost', 'doctor')
+ParsedPatient = namedtuple('ParsedPatient', PARSED_PATIENT_FIELDS)
+
+# validate_patient_data as rules for rules.compile_rules
+PATIENT_RULES = [
+    {'rule': 'regex', 'field': 'patient_id', 'pattern': r'^PT-\d{3}$', 'bit': PATIENT_ID_INVALID},
+    {'rule': 'required', 'field': 'patient_name', 'bit': PATIENT_NAME_MISSING},
+    {'rule': 'number', 'field': 'age', 'type': int, 'min': 0, 'max': 120, 'bit': AGE_NOT_REALISTIC,
+     'format_bit': AGE_VALUE_ERROR},
+    {'rule': 'enum', 'field': 'gender', 'values': ('F', 'M'), 'bit': GENDER_INVALID},
+    {'rule': 'date', 'field': 'admission_date', 'bit': ADMISSION_DATE_INVALID, 'missing_bit': ADMISSION_DATE_MISSING},
+    {'rule': 'date', 'field': 'discharge_date', 'bit': DISCHARGE_DATE_INVALID, 'missing_bit': DISCHARGE_DATE_MISSING},
+    {'rule': 'order', 'field': 'discharge_date', 'after': 'admission_date', 'bit': DISCHARGE_BEFORE_ADMISSION},
+    {'rule': 'number', 'field': 'treatment_cost', 'above': 0, 'bit': TREATMENT_COST_NOT_PAID,
+     'format_bit': TREATMENT_COST_INVALID},
+    {'rule': 'regex', 'field': 'blood_pressure', 'pattern': r'\b(\d{2,3})/(\d{2})\b', 'groups': ('systolic', 'diastolic'),
+     'type': int, 'bit': BLOOD_PRESSURE_INVALID},
+    {'rule': 'number', 'field': 'temperature', 'min': 35.0, 'max': 42.0, 'bit': TEMPERATURE_INVALID}
+]
+
+validate_patient_data = compile_rules(PATIENT_RULES, 'validate_patient_data', ParsedPatient)
 
 if __name__ == '__main__':
     from extract import extract_patient_data
@@ -111,5 +86,5 @@ if __name__ == '__main__':
     cleaned, rejected = validate_patient_data(data)
     for record in cleaned:
         print(f"clean data: {record} records")
-    for record in rejected:
-        print(f"rejected data: {record}")
\ No newline at end of file
+    for record, code in rejected:
+        print(f"rejected data: {record} ({rejection_text(code)})")
\ No newline at end of file